@@ -0,0 +1,38 @@
+"""add sync cursors and users.stripe_customer_id index
+
+Revision ID: 3f6d2a8c9e14
+Revises: e2a91f4c0b37
+Create Date: 2026-02-16 09:42:11.318204
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = '3f6d2a8c9e14'
+down_revision: Union[str, Sequence[str], None] = 'e2a91f4c0b37'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('sync_cursors',
+    sa.Column('name', sa.String(length=100), nullable=False),
+    sa.Column('position', sa.BigInteger(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(timezone=True), nullable=False),
+    sa.PrimaryKeyConstraint('name')
+    )
+    # reconciliation maps Stripe customers back to users
+    with op.get_context().autocommit_block():
+        op.create_index('ix_users_stripe_customer_id', 'users', ['stripe_customer_id'], unique=False,
+                        postgresql_concurrently=True, if_not_exists=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_users_stripe_customer_id', table_name='users', postgresql_concurrently=True, if_exists=True)
+    op.drop_table('sync_cursors')
@@ -0,0 +1,57 @@
+"""index audit
+
+Revision ID: 5b8e3f0c6a21
+Revises: c4e1a9d2b7f3
+Create Date: 2026-02-04 16:41:09.227814
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5b8e3f0c6a21'
+down_revision: Union[str, Sequence[str], None] = 'c4e1a9d2b7f3'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# (name, table, columns) - built CONCURRENTLY so live tables are not locked against writes
+INDEXES = [
+    ('ix_refresh_tokens_user_id', 'refresh_tokens', ['user_id']),
+    ('ix_login_codes_user_created', 'login_codes', ['user_id', 'created_at']),
+    ('ix_users_created_at', 'users', ['created_at']),
+    ('ix_subscriptions_started_at', 'subscriptions', ['started_at']),
+    ('ix_subscriptions_user_started', 'subscriptions', ['user_id', 'started_at']),
+    ('ix_payments_created_at', 'payments', ['created_at']),
+    ('ix_payments_user_created', 'payments', ['user_id', 'created_at']),
+    ('ix_payments_subscription_id', 'payments', ['subscription_id']),
+]
+
+# single column indexes now covered by the leading column of a composite one
+REDUNDANT_INDEXES = [
+    ('ix_subscriptions_user_id', 'subscriptions', ['user_id']),
+    ('ix_payments_user_id', 'payments', ['user_id']),
+]
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # CREATE/DROP INDEX CONCURRENTLY can't run inside a transaction block
+    with op.get_context().autocommit_block():
+        for name, table, columns in INDEXES:
+            op.create_index(name, table, columns, unique=False,
+                            postgresql_concurrently=True, if_not_exists=True)
+        for name, table, _ in REDUNDANT_INDEXES:
+            op.drop_index(name, table_name=table, postgresql_concurrently=True, if_exists=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        for name, table, columns in REDUNDANT_INDEXES:
+            op.create_index(name, table, columns, unique=False,
+                            postgresql_concurrently=True, if_not_exists=True)
+        for name, table, _ in reversed(INDEXES):
+            op.drop_index(name, table_name=table, postgresql_concurrently=True, if_exists=True)
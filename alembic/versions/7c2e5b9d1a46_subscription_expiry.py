@@ -0,0 +1,38 @@
+"""subscription expiry: status labels and sweep index
+
+Revision ID: 7c2e5b9d1a46
+Revises: 3f6d2a8c9e14
+Create Date: 2026-02-18 11:07:52.604113
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = '7c2e5b9d1a46'
+down_revision: Union[str, Sequence[str], None] = '3f6d2a8c9e14'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # the type was created with 'TRAILAING' and extended with 'pending', while SQLAlchemy stores enum
+    # names: add the labels the model actually writes. New labels must be committed before the index uses them.
+    with op.get_context().autocommit_block():
+        for label in ('TRIALING', 'PENDING', 'EXPIRED'):
+            op.execute(f"ALTER TYPE subscriptionstatus ADD VALUE IF NOT EXISTS '{label}'")
+        op.create_index('ix_subscriptions_expiry', 'subscriptions', ['current_period_end'], unique=False,
+                        postgresql_where=sa.text("status IN ('ACTIVE', 'CANCELED', 'TRIALING')"),
+                        postgresql_concurrently=True, if_not_exists=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    # Postgres can't drop enum labels, but the previous model has no EXPIRED member to load
+    op.execute("UPDATE subscriptions SET status = 'CANCELED' WHERE status = 'EXPIRED'")
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_subscriptions_expiry', table_name='subscriptions',
+                      postgresql_concurrently=True, if_exists=True)
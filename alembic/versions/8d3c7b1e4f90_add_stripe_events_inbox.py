@@ -0,0 +1,50 @@
+"""add stripe events inbox
+
+Revision ID: 8d3c7b1e4f90
+Revises: 5b8e3f0c6a21
+Create Date: 2026-02-09 11:27:53.604118
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision: str = '8d3c7b1e4f90'
+down_revision: Union[str, Sequence[str], None] = '5b8e3f0c6a21'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('stripe_events',
+    sa.Column('id', sa.UUID(), nullable=False),
+    sa.Column('stripe_event_id', sa.String(), nullable=False),
+    sa.Column('event_type', sa.String(length=100), nullable=False),
+    sa.Column('payload', postgresql.JSONB(astext_type=sa.Text()), nullable=False),
+    sa.Column('status', sa.Enum('PENDING', 'PROCESSING', 'PROCESSED', 'FAILED', name='stripeeventstatus'), nullable=False),
+    sa.Column('attempts', sa.Integer(), nullable=False),
+    sa.Column('last_error', sa.Text(), nullable=True),
+    sa.Column('locked_at', sa.DateTime(timezone=True), nullable=True),
+    sa.Column('received_at', sa.DateTime(timezone=True), nullable=False),
+    sa.Column('processed_at', sa.DateTime(timezone=True), nullable=True),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('stripe_event_id')
+    )
+    op.create_index(
+        'ix_stripe_events_unprocessed',
+        'stripe_events',
+        ['received_at'],
+        unique=False,
+        postgresql_where=sa.text("status <> 'PROCESSED'"),
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_stripe_events_unprocessed', table_name='stripe_events')
+    op.drop_table('stripe_events')
+    sa.Enum(name='stripeeventstatus').drop(op.get_bind(), checkfirst=True)
@@ -0,0 +1,53 @@
+"""add email campaigns
+
+Revision ID: b81f3e6c2d94
+Revises: a4d8c1f7e259
+Create Date: 2026-02-20 09:42:11.208354
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = 'b81f3e6c2d94'
+down_revision: Union[str, Sequence[str], None] = 'a4d8c1f7e259'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('email_campaigns',
+    sa.Column('id', sa.UUID(), nullable=False),
+    sa.Column('plan_id', sa.UUID(), nullable=False),
+    sa.Column('created_by', sa.UUID(), nullable=False),
+    sa.Column('subject', sa.String(length=200), nullable=False),
+    sa.Column('body', sa.Text(), nullable=False),
+    sa.Column('status', sa.Enum('QUEUED', 'SENDING', 'COMPLETED', name='campaignstatus'), nullable=False),
+    sa.Column('fanout_cursor', sa.UUID(), nullable=True),
+    sa.Column('fanout_done', sa.Boolean(), nullable=False),
+    sa.Column('recipients', sa.Integer(), nullable=False),
+    sa.Column('sent', sa.Integer(), nullable=False),
+    sa.Column('failed', sa.Integer(), nullable=False),
+    sa.Column('created_at', sa.DateTime(timezone=True), nullable=False),
+    sa.Column('completed_at', sa.DateTime(timezone=True), nullable=True),
+    sa.ForeignKeyConstraint(['created_by'], ['users.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['plan_id'], ['plans.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_email_campaigns_plan_id'), 'email_campaigns', ['plan_id'], unique=False)
+    # campaign fan-out reads a plan's subscribers in user id order
+    with op.get_context().autocommit_block():
+        op.create_index('ix_subscriptions_plan_user', 'subscriptions', ['plan_id', 'user_id'], unique=False,
+                        postgresql_concurrently=True, if_not_exists=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_subscriptions_plan_user', table_name='subscriptions', postgresql_concurrently=True, if_exists=True)
+    op.drop_index(op.f('ix_email_campaigns_plan_id'), table_name='email_campaigns')
+    op.drop_table('email_campaigns')
+    sa.Enum(name='campaignstatus').drop(op.get_bind(), checkfirst=True)
@@ -0,0 +1,58 @@
+"""subscription access indexes
+
+Revision ID: c4e1a9d2b7f3
+Revises: aa22ec5f6271
+Create Date: 2026-02-02 10:12:41.518307
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c4e1a9d2b7f3'
+down_revision: Union[str, Sequence[str], None] = 'aa22ec5f6271'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Older rows may hold several ACTIVE subscriptions per user: keep the one with the
+    # latest period end and cancel the rest so the unique index can be built.
+    op.execute(
+        """
+        UPDATE subscriptions AS s
+        SET status = 'CANCELED', canceled_at = now()
+        FROM (
+            SELECT id, row_number() OVER (
+                PARTITION BY user_id ORDER BY current_period_end DESC NULLS LAST, started_at DESC
+            ) AS rn
+            FROM subscriptions
+            WHERE status = 'ACTIVE'
+        ) AS ranked
+        WHERE s.id = ranked.id AND ranked.rn > 1
+        """
+    )
+    op.create_index(
+        'ix_subscriptions_user_access',
+        'subscriptions',
+        ['user_id', sa.text('current_period_end DESC')],
+        unique=False,
+        postgresql_where=sa.text("status IN ('ACTIVE', 'CANCELED')"),
+    )
+    op.create_index(
+        'uq_subscriptions_user_active',
+        'subscriptions',
+        ['user_id'],
+        unique=True,
+        postgresql_where=sa.text("status = 'ACTIVE'"),
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('uq_subscriptions_user_active', table_name='subscriptions')
+    op.drop_index('ix_subscriptions_user_access', table_name='subscriptions')
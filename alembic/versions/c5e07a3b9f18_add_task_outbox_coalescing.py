@@ -0,0 +1,31 @@
+"""add task outbox coalescing
+
+Revision ID: c5e07a3b9f18
+Revises: b81f3e6c2d94
+Create Date: 2026-02-21 14:07:52.913640
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c5e07a3b9f18'
+down_revision: Union[str, Sequence[str], None] = 'b81f3e6c2d94'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('task_outbox', sa.Column('coalesce_key', sa.String(length=200), nullable=True))
+    op.add_column('task_outbox', sa.Column('available_at', sa.DateTime(timezone=True),
+                                           server_default=sa.text('now()'), nullable=False))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('task_outbox', 'available_at')
+    op.drop_column('task_outbox', 'coalesce_key')
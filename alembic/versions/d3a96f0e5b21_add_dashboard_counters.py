@@ -0,0 +1,40 @@
+"""add dashboard counters
+
+Revision ID: d3a96f0e5b21
+Revises: c5e07a3b9f18
+Create Date: 2026-02-23 11:26:04.517382
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd3a96f0e5b21'
+down_revision: Union[str, Sequence[str], None] = 'c5e07a3b9f18'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('dashboard_counters',
+    sa.Column('name', sa.String(length=100), nullable=False),
+    sa.Column('value', sa.BigInteger(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(timezone=True), nullable=False),
+    sa.PrimaryKeyConstraint('name')
+    )
+    # start from exact counts; the hourly recount corrects writes racing this migration
+    op.execute(
+        "INSERT INTO dashboard_counters (name, value, updated_at) VALUES "
+        "('users', (SELECT count(*) FROM users), now()), "
+        "('subscriptions', (SELECT count(*) FROM subscriptions), now()), "
+        "('payments', (SELECT count(*) FROM payments), now())"
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('dashboard_counters')
@@ -0,0 +1,51 @@
+"""add ordering key to stripe events
+
+Revision ID: e2a91f4c0b37
+Revises: 8d3c7b1e4f90
+Create Date: 2026-02-12 09:48:16.372950
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e2a91f4c0b37'
+down_revision: Union[str, Sequence[str], None] = '8d3c7b1e4f90'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('stripe_events', sa.Column('ordering_key', sa.String(), nullable=True))
+    # same extraction as billing.utils.stripe_event_ordering_key, for events still waiting
+    op.execute(
+        """
+        UPDATE stripe_events
+        SET ordering_key = CASE
+            WHEN event_type LIKE 'customer.subscription.%' THEN payload #>> '{data,object,id}'
+            WHEN event_type LIKE 'checkout.session.%' THEN payload #>> '{data,object,subscription}'
+            WHEN event_type LIKE 'invoice.%' THEN COALESCE(
+                payload #>> '{data,object,lines,data,0,parent,subscription_item_details,subscription}',
+                payload #>> '{data,object,subscription}'
+            )
+        END
+        WHERE status <> 'PROCESSED'
+        """
+    )
+    op.create_index(
+        'ix_stripe_events_ordering_unprocessed',
+        'stripe_events',
+        ['ordering_key', 'received_at'],
+        unique=False,
+        postgresql_where=sa.text("status <> 'PROCESSED'"),
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_stripe_events_ordering_unprocessed', table_name='stripe_events')
+    op.drop_column('stripe_events', 'ordering_key')
@@ -0,0 +1,76 @@
+"""add daily rollups
+
+Revision ID: e6b14d8a7c39
+Revises: d3a96f0e5b21
+Create Date: 2026-02-24 16:48:31.082716
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e6b14d8a7c39'
+down_revision: Union[str, Sequence[str], None] = 'd3a96f0e5b21'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('daily_revenue',
+    sa.Column('id', sa.BigInteger(), autoincrement=True, nullable=False),
+    sa.Column('day', sa.Date(), nullable=False),
+    sa.Column('plan_id', sa.UUID(), nullable=True),
+    sa.Column('currency', sa.String(length=10), nullable=False),
+    sa.Column('payments', sa.Integer(), nullable=False),
+    sa.Column('amount_cents', sa.BigInteger(), nullable=False),
+    sa.ForeignKeyConstraint(['plan_id'], ['plans.id'], ondelete='SET NULL'),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_daily_revenue_day'), 'daily_revenue', ['day'], unique=False)
+    op.create_table('daily_subscription_stats',
+    sa.Column('day', sa.Date(), nullable=False),
+    sa.Column('currency', sa.String(length=10), nullable=False),
+    sa.Column('new_subscriptions', sa.Integer(), nullable=False),
+    sa.Column('canceled_subscriptions', sa.Integer(), nullable=False),
+    sa.Column('active_subscriptions', sa.Integer(), nullable=False),
+    sa.Column('mrr_cents', sa.BigInteger(), nullable=False),
+    sa.PrimaryKeyConstraint('day', 'currency')
+    )
+    # started_at moves with every renewal: the first paid period, or the current one without payments,
+    # is the best record of when an existing subscription began
+    op.add_column('subscriptions', sa.Column('created_at', sa.DateTime(timezone=True),
+                                             server_default=sa.text('now()'), nullable=False))
+    op.execute("""
+        UPDATE subscriptions SET created_at = LEAST(
+            subscriptions.started_at,
+            (SELECT min(payments.created_at) FROM payments WHERE payments.subscription_id = subscriptions.id)
+        )
+        WHERE subscriptions.started_at IS NOT NULL
+    """)
+    # existing rows read as changed now, which the first rollup run covers anyway
+    op.add_column('subscriptions', sa.Column('updated_at', sa.DateTime(timezone=True),
+                                             server_default=sa.text('now()'), nullable=False))
+    op.add_column('payments', sa.Column('updated_at', sa.DateTime(timezone=True),
+                                        server_default=sa.text('now()'), nullable=False))
+    with op.get_context().autocommit_block():
+        op.create_index('ix_subscriptions_updated_at', 'subscriptions', ['updated_at'], unique=False,
+                        postgresql_concurrently=True, if_not_exists=True)
+        op.create_index('ix_payments_updated_at', 'payments', ['updated_at'], unique=False,
+                        postgresql_concurrently=True, if_not_exists=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_payments_updated_at', table_name='payments', postgresql_concurrently=True, if_exists=True)
+        op.drop_index('ix_subscriptions_updated_at', table_name='subscriptions', postgresql_concurrently=True, if_exists=True)
+    op.drop_column('payments', 'updated_at')
+    op.drop_column('subscriptions', 'updated_at')
+    op.drop_column('subscriptions', 'created_at')
+    op.drop_table('daily_subscription_stats')
+    op.drop_index(op.f('ix_daily_revenue_day'), table_name='daily_revenue')
+    op.drop_table('daily_revenue')
@@ -0,0 +1,31 @@
+"""add subscription replaced_by
+
+Revision ID: f8a2c6d41e07
+Revises: e6b14d8a7c39
+Create Date: 2026-03-02 10:14:52.407318
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f8a2c6d41e07'
+down_revision: Union[str, Sequence[str], None] = 'e6b14d8a7c39'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('subscriptions', sa.Column('replaced_by_id', sa.UUID(), nullable=True))
+    op.create_foreign_key('subscriptions_replaced_by_id_fkey', 'subscriptions', 'subscriptions',
+                          ['replaced_by_id'], ['id'], ondelete='SET NULL')
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_constraint('subscriptions_replaced_by_id_fkey', 'subscriptions', type_='foreignkey')
+    op.drop_column('subscriptions', 'replaced_by_id')
@@ -0,0 +1,109 @@
+"""
+Concurrent checkout-session creation: the old threadpool + global `stripe` module path
+against the pooled async StripeClient, both talking to benchmarks/fake_stripe.py.
+
+Next to throughput it reports how long an unrelated `run_in_threadpool` call (a sync
+dependency, password hashing, ...) waits while the load runs: the threadpool path holds
+one of AnyIO's 40 worker threads for every in-flight Stripe round trip.
+
+    python -m benchmarks.checkout_sessions --requests 500 --concurrency 100 --latency 0.05
+
+Keep --concurrency near STRIPE_MAX_CONNECTIONS: httpcore hands out pooled connections
+in time proportional to pool size times queued requests, so very large pools get slower.
+"""
+import os
+import time
+import asyncio
+import argparse
+import statistics
+
+os.environ.setdefault("STRIPE_SECRET_KEY", "sk_test_benchmark")
+os.environ.setdefault("STRIPE_RATE_LIMIT_PER_SECOND", "100000")  # measure the transport, not the governor
+os.environ.setdefault("STRIPE_RATE_LIMIT_BURST", "100000")
+
+import stripe
+from fastapi.concurrency import run_in_threadpool
+from benchmarks.fake_stripe import FakeStripeServer
+from src.config import settings
+from src.billing import stripe_client
+
+
+PARAMS = {
+    "mode": "subscription",
+    "customer": "cus_benchmark",
+    "line_items": [{"price": "price_benchmark", "quantity": 1}],
+    "success_url": "https://yourapp.com/success?session_id={CHECKOUT_SESSION_ID}",
+    "cancel_url": "https://yourapp.com/cancel",
+}
+
+
+async def _threadpool_call():
+    return await run_in_threadpool(stripe.checkout.Session.create, **PARAMS)
+
+
+async def _async_client_call():
+    return await stripe_client.get_stripe_client().v1.checkout.sessions.create_async(PARAMS)  # type: ignore
+
+
+async def _probe_threadpool(waits: list[float], stop: asyncio.Event) -> None:
+    while not stop.is_set():
+        start = time.perf_counter()
+        await run_in_threadpool(lambda: None)
+        waits.append(time.perf_counter() - start)
+        await asyncio.sleep(0.01)
+
+
+async def _run(call, requests: int, concurrency: int) -> tuple[float, list[float], list[float]]:
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies: list[float] = []
+    probe_waits: list[float] = []
+    stop = asyncio.Event()
+
+    async def _one():
+        async with semaphore:
+            start = time.perf_counter()
+            await call()
+            latencies.append(time.perf_counter() - start)
+
+    probe = asyncio.create_task(_probe_threadpool(probe_waits, stop))
+    start = time.perf_counter()
+    await asyncio.gather(*(_one() for _ in range(requests)))
+    elapsed = time.perf_counter() - start
+    stop.set()
+    await probe
+    return elapsed, latencies, probe_waits
+
+
+def _p95(values: list[float]) -> float:
+    values = sorted(values)
+    return values[max(int(len(values) * 0.95) - 1, 0)]
+
+
+def _report(name: str, requests: int, elapsed: float, latencies: list[float], probe_waits: list[float]) -> None:
+    print(
+        f"{name:<12} {requests / elapsed:>8.1f} req/s  "
+        f"p50={statistics.median(latencies) * 1000:.1f}ms  p95={_p95(latencies) * 1000:.1f}ms  "
+        f"threadpool wait p95={_p95(probe_waits) * 1000:.1f}ms  total={elapsed:.2f}s"
+    )
+
+
+async def main(requests: int, concurrency: int) -> None:
+    for name, call in (("threadpool", _threadpool_call), ("async", _async_client_call)):
+        await _run(call, min(concurrency, requests), concurrency)  # warm up connections
+        elapsed, latencies, probe_waits = await _run(call, requests, concurrency)
+        _report(name, requests, elapsed, latencies, probe_waits)
+    await stripe_client.close_stripe_client()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--latency", type=float, default=0.05)
+    args = parser.parse_args()
+
+    with FakeStripeServer(latency=args.latency) as server:
+        stripe.api_key = settings.stripe_secret_key
+        stripe.api_base = server.url
+        settings.stripe_api_base = server.url
+        asyncio.run(main(args.requests, args.concurrency))
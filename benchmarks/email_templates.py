@@ -0,0 +1,47 @@
+"""
+Email body renders per second: what fastapi_mail does per message (a new Environment, so the
+template is loaded and compiled again), a cached compiled Jinja template, and the registry in
+src.email_templates with the shared context rendered in ahead of time.
+
+    python -m benchmarks.email_templates --renders 2000
+"""
+import time
+import argparse
+from jinja2 import Environment, FileSystemLoader
+from src.email_templates import TEMPLATE_FOLDER, EmailTemplates, static_context
+
+
+CONTEXT = {
+    "plan": "Pro", "price": 10, "start_date": "2026-01-01", "end_date": "2026-02-01",
+    "next_billing_date": "2026-02-01", "email_type": "Renewed", "user_name": "benchmark",
+}
+
+
+def _per_message(name: str) -> str:
+    template = Environment(loader=FileSystemLoader(TEMPLATE_FOLDER)).get_template(name)
+    return template.render(**static_context(), **CONTEXT)
+
+
+def main(renders: int, name: str) -> None:
+    cached = Environment(loader=FileSystemLoader(TEMPLATE_FOLDER)).get_template(name)
+    registry = EmailTemplates(TEMPLATE_FOLDER)
+    paths = (
+        ("per-message", lambda: _per_message(name)),
+        ("cached", lambda: cached.render(**static_context(), **CONTEXT)),
+        ("registry", lambda: registry.render(name, CONTEXT)),
+    )
+    for label, render in paths:
+        render()
+        start = time.perf_counter()
+        for _ in range(renders):
+            render()
+        elapsed = time.perf_counter() - start
+        print(f"{label:<12} {renders / elapsed:>10.0f} renders/s  {elapsed / renders * 1e6:>8.1f}us/render")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--renders", type=int, default=2000)
+    parser.add_argument("--template", default="update_subscribe_email.html")
+    args = parser.parse_args()
+    main(args.renders, args.template)
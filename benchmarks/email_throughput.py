@@ -0,0 +1,99 @@
+"""
+Sequential email sends the way a Celery worker process runs them, one task after another,
+against benchmarks/smtp_sink.py: the old task path (async_to_sync per task, a new FastMail
+connection per message) against run_async with the pooled Mailer.
+
+    python -m benchmarks.email_throughput --messages 200 --handshake 0.05
+
+--handshake is the per-connection setup cost the pool saves (STARTTLS and login to a real
+provider are typically 50-300ms); the old path pays it on every message.
+"""
+import time
+import argparse
+import statistics
+from datetime import datetime
+from asgiref.sync import async_to_sync
+from fastapi_mail import ConnectionConfig, FastMail, MessageSchema, MessageType
+from benchmarks.smtp_sink import SMTPSink
+from src.mailer import Mailer, SMTPPool
+from src.worker import run_async
+
+
+TEMPLATE = "subscribe_email.html"
+
+
+def _config(port: int) -> ConnectionConfig:
+    return ConnectionConfig(
+        MAIL_USERNAME="benchmark",
+        MAIL_PASSWORD="benchmark",  # type: ignore
+        MAIL_FROM="billing@example.com",
+        MAIL_PORT=port,
+        MAIL_SERVER="127.0.0.1",
+        MAIL_STARTTLS=False,
+        MAIL_SSL_TLS=False,
+        USE_CREDENTIALS=False,
+        VALIDATE_CERTS=False,
+        TEMPLATE_FOLDER="templates/email",  # type: ignore
+    )
+
+
+def _message() -> MessageSchema:
+    return MessageSchema(
+        subject="Subscription Confirmation",
+        recipients=["user@example.com"],  # type: ignore
+        template_body={
+            "plan": "Pro", "start_date": "2026-01-01", "end_date": "2026-02-01", "price": 10,
+            "user_name": "benchmark", "dashboard_url": "https://app.test", "app_name": "app",
+            "app_url": "https://app.test", "support_email": "support@app.test",
+            "company_address": "1234 Street", "year": datetime.now().year,
+        },
+        subtype=MessageType.html,
+    )
+
+
+def _run(send, messages: int) -> tuple[float, list[float]]:
+    latencies = []
+    start = time.perf_counter()
+    for _ in range(messages):
+        sent = time.perf_counter()
+        send()
+        latencies.append(time.perf_counter() - sent)
+    return time.perf_counter() - start, latencies
+
+
+def _p95(values: list[float]) -> float:
+    values = sorted(values)
+    return values[max(int(len(values) * 0.95) - 1, 0)]
+
+
+def _report(name: str, messages: int, elapsed: float, latencies: list[float]) -> None:
+    print(
+        f"{name:<12} {messages / elapsed:>8.1f} msg/s  "
+        f"p50={statistics.median(latencies) * 1000:.1f}ms  p95={_p95(latencies) * 1000:.1f}ms  total={elapsed:.2f}s"
+    )
+
+
+def main(messages: int, port: int) -> None:
+    config = _config(port)
+    mailer = Mailer(config, SMTPPool(config, size=1, idle_timeout_seconds=60))
+    paths = (
+        ("per-message", lambda: async_to_sync(FastMail(config).send_message)(_message(), template_name=TEMPLATE)),
+        ("pooled", lambda: run_async(mailer.send_message(_message(), template_name=TEMPLATE))),
+    )
+    for name, send in paths:
+        _run(send, 3)  # warm up templates and the pooled connection
+        elapsed, latencies = _run(send, messages)
+        _report(name, messages, elapsed, latencies)
+    run_async(mailer.pool.close())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=200)
+    parser.add_argument("--handshake", type=float, default=0.05)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--port", type=int, default=12525)
+    args = parser.parse_args()
+
+    with SMTPSink(port=args.port, handshake=args.handshake, latency=args.latency):
+        main(args.messages, args.port)
@@ -0,0 +1,61 @@
+"""
+Minimal stand-in for the Stripe API, enough for the calls the billing gateway makes.
+Every request waits `latency` seconds to mimic the network round trip.
+"""
+import time
+import asyncio
+import socket
+import multiprocessing
+import uvicorn
+from uuid import uuid4
+from urllib.parse import parse_qs
+from fastapi import FastAPI, Request
+
+
+def create_app(latency: float) -> FastAPI:
+    app = FastAPI()
+
+    @app.post("/v1/checkout/sessions")
+    async def create_checkout_session(request: Request):
+        form = {key: values[0] for key, values in parse_qs((await request.body()).decode()).items()}
+        await asyncio.sleep(latency)
+        session_id = f"cs_test_{uuid4().hex}"
+        return {
+            "id": session_id,
+            "object": "checkout.session",
+            "mode": form.get("mode"),
+            "customer": form.get("customer"),
+            "url": f"https://checkout.stripe.test/{session_id}",
+        }
+
+    return app
+
+
+def _serve(latency: float, port: int) -> None:
+    uvicorn.run(create_app(latency), port=port, log_level="warning")
+
+
+class FakeStripeServer:
+    """
+    Runs the fake in its own process, so serving requests does not compete with
+    the client being measured for the GIL; use as a context manager.
+    """
+    def __init__(self, latency: float = 0.05, port: int = 12111) -> None:
+        self.url = f"http://127.0.0.1:{port}"
+        self._port = port
+        self._process = multiprocessing.Process(target=_serve, args=(latency, port), daemon=True)
+
+
+    def __enter__(self) -> "FakeStripeServer":
+        self._process.start()
+        while True:
+            try:
+                socket.create_connection(("127.0.0.1", self._port), timeout=0.1).close()
+                return self
+            except OSError:
+                time.sleep(0.05)
+
+
+    def __exit__(self, *exc) -> None:
+        self._process.terminate()
+        self._process.join()
@@ -0,0 +1,65 @@
+"""
+SMTP server that accepts and drops every message, enough for aiosmtplib without TLS or AUTH.
+`handshake` delays the greeting to stand in for the TCP, STARTTLS and login round trips a real
+provider costs on every new connection; `latency` delays each accepted message.
+"""
+import time
+import asyncio
+import socket
+import multiprocessing
+
+
+async def _handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter, handshake: float, latency: float) -> None:
+    await asyncio.sleep(handshake)
+    writer.write(b"220 sink ESMTP\r\n")
+    while line := await reader.readline():
+        command = line[:4].upper()
+        if command == b"EHLO":
+            writer.write(b"250-sink\r\n250 8BITMIME\r\n")
+        elif command == b"DATA":
+            writer.write(b"354 end with <CRLF>.<CRLF>\r\n")
+            await writer.drain()
+            while (await reader.readline()) != b".\r\n":
+                pass
+            await asyncio.sleep(latency)
+            writer.write(b"250 queued\r\n")
+        elif command == b"QUIT":
+            writer.write(b"221 bye\r\n")
+            await writer.drain()
+            break
+        else:  # HELO, MAIL, RCPT, RSET, NOOP
+            writer.write(b"250 ok\r\n")
+        await writer.drain()
+    writer.close()
+
+
+def _serve(port: int, handshake: float, latency: float) -> None:
+    async def main():
+        server = await asyncio.start_server(
+            lambda reader, writer: _handle(reader, writer, handshake, latency), "127.0.0.1", port
+        )
+        async with server:
+            await server.serve_forever()
+    asyncio.run(main())
+
+
+class SMTPSink:
+    """Runs the sink in its own process; use as a context manager."""
+    def __init__(self, port: int = 12525, handshake: float = 0.05, latency: float = 0.0) -> None:
+        self.port = port
+        self._process = multiprocessing.Process(target=_serve, args=(port, handshake, latency), daemon=True)
+
+
+    def __enter__(self) -> "SMTPSink":
+        self._process.start()
+        while True:
+            try:
+                socket.create_connection(("127.0.0.1", self.port), timeout=0.1).close()
+                return self
+            except OSError:
+                time.sleep(0.05)
+
+
+    def __exit__(self, *exc) -> None:
+        self._process.terminate()
+        self._process.join()
@@ -8,4 +8,17 @@ class AiSettings(BaseSettings):
     groq_api_key: str
     groq_base_url: str
 
-    ai_model: str = Field(default="openai/gpt-oss-120b")  
\ No newline at end of file
+    ai_model: str = Field(default="openai/gpt-oss-120b")  
+
+
+
+class CampaignSettings(BaseSettings):
+    campaign_chunk_size: int = Field(default=200)
+    campaign_max_retries: int = Field(default=3)
+
+
+
+class AnalyticsSettings(BaseSettings):
+    # rows committed this long after their updated_at was stamped are still picked up by the next rollup run
+    analytics_rollup_lookback_seconds: int = Field(default=600)
+    analytics_max_range_days: int = Field(default=366)
@@ -3,8 +3,9 @@ from typing import Annotated
 from src.admin import repository
 from src.admin.ai_repo import ai_repo
 from src.database import db_dependency
+from src.repository import DashboardCounterRepository
 from src.admin.services import (UsersService, PaymentsServices,
-        SubscriptionsServices, AnalyticsService, AiSerivce)
+        SubscriptionsServices, AnalyticsService, AiSerivce, CampaignService)
 from src.admin.ai_settings import get_ai_client, ai_model, ai_tools, system
 
 
@@ -78,11 +79,38 @@ PaymentsServceDep = Annotated[PaymentsServices,Depends(get_payments_service)]
 
 
 
-def get_analytis_service(users_repo: user_dependency,
-        subscriptions_repo: subscription_dependency,
-        payments_repo: payment_dependency) -> AnalyticsService:
-    
-    return AnalyticsService(users_repo, subscriptions_repo, payments_repo)
+def get_dashboard_counter_dependency(db: db_dependency) -> DashboardCounterRepository:
+    return DashboardCounterRepository(db)
 
 
-AnalyiticsServiceDep = Annotated[AnalyticsService, Depends(get_analytis_service)]
\ No newline at end of file
+dashboard_counter_dependency = Annotated[DashboardCounterRepository, Depends(get_dashboard_counter_dependency)]
+
+
+def get_admin_analytics_dependency(db: db_dependency) -> repository.AdminAnalyticsRepository:
+    return repository.AdminAnalyticsRepository(db)
+
+
+analytics_dependency = Annotated[repository.AdminAnalyticsRepository, Depends(get_admin_analytics_dependency)]
+
+
+def get_analytis_service(counters_repo: dashboard_counter_dependency,
+        analytics_repo: analytics_dependency) -> AnalyticsService:
+    return AnalyticsService(counters_repo, analytics_repo)
+
+
+AnalyiticsServiceDep = Annotated[AnalyticsService, Depends(get_analytis_service)]
+
+
+
+def get_admin_campaign_dependency(db: db_dependency) -> repository.AdminCampaignRepository:
+    return repository.AdminCampaignRepository(db)
+
+
+campaign_dependency = Annotated[repository.AdminCampaignRepository, Depends(get_admin_campaign_dependency)]
+
+
+def get_campaign_service(campaign_repo: campaign_dependency, auditlog_repo: auditlog_dependency) -> CampaignService:
+    return CampaignService(campaign_repo, auditlog_repo)
+
+
+CampaignServiceDep = Annotated[CampaignService, Depends(get_campaign_service)]
@@ -0,0 +1,19 @@
+from fastapi_mail import MessageSchema, MessageType
+from src.mailer import get_mailer
+
+
+class CampaignEmails:
+    @staticmethod
+    async def send_campaign_email(*, subject: str, body: str, plan: str, email: str, user_name: str):
+        message = MessageSchema(
+            subject=subject,
+            recipients=[email],  # type: ignore
+            template_body={
+                "subject": subject,
+                "body": body,
+                "plan": plan,
+                "user_name": user_name,
+            },
+            subtype=MessageType.html,
+        )
+        await get_mailer().send_message(message, template_name="campaign.html")
@@ -1,9 +1,10 @@
 from __future__ import annotations
 
 from uuid import uuid4, UUID as PyUUID
+from enum import Enum
 from typing import Optional, Any
-from datetime import datetime, timezone
-from sqlalchemy import DateTime, ForeignKey, Index, Index, String
+from datetime import date, datetime, timezone
+from sqlalchemy import BigInteger, Boolean, Date, DateTime, ForeignKey, Index, Index, Integer, String, Text, Enum as SAEnum
 from sqlalchemy.orm import Mapped, mapped_column
 from sqlalchemy.dialects.postgresql import UUID, JSONB
 from src.database import Base
@@ -31,4 +32,71 @@ class AdminAuditLog(Base):
     
 
 Index("ix_admin_audit_target", AdminAuditLog.target_type, AdminAuditLog.target_id)
-Index("ix_admin_audit_admin_action", AdminAuditLog.admin_id, AdminAuditLog.action)
\ No newline at end of file
+Index("ix_admin_audit_admin_action", AdminAuditLog.admin_id, AdminAuditLog.action)
+
+
+
+class CampaignStatus(str, Enum):
+    QUEUED = "queued"
+    SENDING = "sending"
+    COMPLETED = "completed"
+
+
+class EmailCampaign(Base):
+    """
+    An email to every subscriber of a plan. Recipients are handed to send tasks in user id order;
+    `fanout_cursor` is the last user id handed out, so a fan-out that died resumes after it.
+    """
+    __tablename__ = "email_campaigns"
+
+    id: Mapped[PyUUID] = mapped_column(UUID(as_uuid=True), primary_key=True, default=uuid4)
+    plan_id: Mapped[PyUUID] = mapped_column(UUID(as_uuid=True),
+        ForeignKey("plans.id", ondelete="CASCADE"), nullable=False, index=True)
+    created_by: Mapped[PyUUID] = mapped_column(UUID(as_uuid=True),
+        ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+
+    subject: Mapped[str] = mapped_column(String(200), nullable=False)
+    body: Mapped[str] = mapped_column(Text(), nullable=False)
+
+    status: Mapped[CampaignStatus] = mapped_column(SAEnum(CampaignStatus), nullable=False,
+                                    default=CampaignStatus.QUEUED)
+    fanout_cursor: Mapped[Optional[PyUUID]] = mapped_column(UUID(as_uuid=True), nullable=True)
+    fanout_done: Mapped[bool] = mapped_column(Boolean(), nullable=False, default=False)
+    recipients: Mapped[int] = mapped_column(Integer(), nullable=False, default=0)
+    sent: Mapped[int] = mapped_column(Integer(), nullable=False, default=0)
+    failed: Mapped[int] = mapped_column(Integer(), nullable=False, default=0)
+
+    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True),
+                                    default=lambda: datetime.now(timezone.utc))
+    completed_at: Mapped[Optional[datetime]] = mapped_column(DateTime(timezone=True), nullable=True)
+
+
+
+class DailyRevenue(Base):
+    """Succeeded payments of one UTC day per plan and currency; `plan_id` is null for payments without a subscription."""
+    __tablename__ = "daily_revenue"
+
+    id: Mapped[int] = mapped_column(BigInteger(), primary_key=True, autoincrement=True)
+    day: Mapped[date] = mapped_column(Date(), nullable=False, index=True)
+    plan_id: Mapped[Optional[PyUUID]] = mapped_column(UUID(as_uuid=True),
+        ForeignKey("plans.id", ondelete="SET NULL"), nullable=True)
+    currency: Mapped[str] = mapped_column(String(10), nullable=False)
+    payments: Mapped[int] = mapped_column(Integer(), nullable=False)
+    amount_cents: Mapped[int] = mapped_column(BigInteger(), nullable=False)
+
+
+
+class DailySubscriptionStats(Base):
+    """
+    Subscriptions started and canceled during one UTC day, and the ones active at its end with
+    their monthly recurring revenue, per plan currency.
+    """
+    __tablename__ = "daily_subscription_stats"
+
+    day: Mapped[date] = mapped_column(Date(), primary_key=True)
+    currency: Mapped[str] = mapped_column(String(10), primary_key=True)
+    new_subscriptions: Mapped[int] = mapped_column(Integer(), nullable=False)
+    canceled_subscriptions: Mapped[int] = mapped_column(Integer(), nullable=False)
+    active_subscriptions: Mapped[int] = mapped_column(Integer(), nullable=False)
+    mrr_cents: Mapped[int] = mapped_column(BigInteger(), nullable=False)
+
@@ -1,12 +1,28 @@
 from uuid import UUID
-from sqlalchemy import select, func
+from datetime import date, datetime, time, timedelta, timezone
+from typing import AsyncIterator
+from sqlalchemy import select, func, update, delete, insert, case, and_, or_, literal, Date
 from sqlalchemy.orm import selectinload
 from sqlalchemy.ext.asyncio import AsyncSession
 from src.paginate import paginate
 
-from src.admin.models import AdminAuditLog
+from src.admin.models import AdminAuditLog, EmailCampaign, CampaignStatus, DailyRevenue, DailySubscriptionStats
 from src.auth.models import User
-from src.billing.models import Subscription, Payment
+from src.billing.models import Subscription, SubscriptionStatus, Payment, PaymentStatus, Plan, BillingPeriod
+
+
+# what the dashboard counters count, for their periodic exact recount
+DASHBOARD_COUNT_QUERIES = {
+    "users": select(func.count()).select_from(User),
+    "subscriptions": select(func.count()).select_from(Subscription),
+    "payments": select(func.count()).select_from(Payment),
+}
+
+# everyone still inside a period of the plan, including subscriptions canceled at period end
+CAMPAIGN_AUDIENCE_STATUSES = (
+    SubscriptionStatus.ACTIVE, SubscriptionStatus.TRIALING,
+    SubscriptionStatus.PAST_DUE, SubscriptionStatus.CANCELED,
+)
 
 
 
@@ -220,5 +236,259 @@ class AdminAuditLogRepository:
         )
 
         return result.scalar_one_or_none()
-    
+
+
+
+class AdminCampaignRepository:
+    def __init__(self, db: AsyncSession) -> None:
+        self.db = db
+
+
+    async def create(self, campaign: EmailCampaign) -> EmailCampaign:
+        self.db.add(campaign)
+        await self.db.commit()
+        await self.db.refresh(campaign)
+        return campaign
+
+
+    async def get_by_id(self, campaign_id: UUID) -> EmailCampaign | None:
+        result = await self.db.execute(select(EmailCampaign).where(EmailCampaign.id == campaign_id))
+        return result.scalar_one_or_none()
+
+
+    async def get_with_plan_name(self, campaign_id: UUID) -> tuple[EmailCampaign, str] | None:
+        result = await self.db.execute(
+            select(EmailCampaign, Plan.name)
+            .join(Plan, Plan.id == EmailCampaign.plan_id)
+            .where(EmailCampaign.id == campaign_id)
+        )
+        row = result.one_or_none()
+        return (row[0], row[1]) if row else None
+
+
+    async def plan_exists(self, plan_id: UUID) -> bool:
+        result = await self.db.execute(select(Plan.id).where(Plan.id == plan_id))
+        return result.scalar_one_or_none() is not None
+
+
+    async def try_lock_fanout(self, campaign_id: UUID) -> bool:
+        """
+        Transaction-scoped advisory lock, so only one fan-out of a campaign runs at a time; Postgres
+        releases it when the transaction ends or the worker's connection drops.
+        """
+        key = campaign_id.int & 0x7FFF_FFFF_FFFF_FFFF
+        result = await self.db.execute(select(func.pg_try_advisory_xact_lock(key)))
+        return bool(result.scalar_one())
+
+
+    async def stream_recipient_ids(
+        self, plan_id: UUID, after_user_id: UUID | None, chunk_size: int
+    ) -> AsyncIterator[list[UUID]]:
+        """
+        Ids of the plan's active users in id order, after `after_user_id`, read through a
+        server-side cursor `chunk_size` rows at a time.
+        """
+        query = (
+            select(User.id)
+            .join(Subscription, Subscription.user_id == User.id)
+            .where(
+                Subscription.plan_id == plan_id,
+                Subscription.status.in_(CAMPAIGN_AUDIENCE_STATUSES),
+                Subscription.current_period_end > datetime.now(timezone.utc),
+                User.is_active.is_(True),
+            )
+            .distinct()
+            .order_by(User.id)
+            .execution_options(yield_per=chunk_size)
+        )
+        if after_user_id is not None:
+            query = query.where(User.id > after_user_id)
+
+        result = await self.db.stream_scalars(query)
+        async for partition in result.partitions():
+            yield list(partition)
+
+
+    def _completion(self, sent: int, failed: int, fanout_done) -> dict:
+        """SET values that complete the campaign once every recipient handed out is accounted for."""
+        done = and_(fanout_done, EmailCampaign.sent + sent + EmailCampaign.failed + failed >= EmailCampaign.recipients)
+        return {
+            "status": case((done, literal(CampaignStatus.COMPLETED, EmailCampaign.status.type)), else_=EmailCampaign.status),
+            "completed_at": case((done, datetime.now(timezone.utc)), else_=EmailCampaign.completed_at),
+        }
+
+
+    async def advance_fanout(self, campaign_id: UUID, last_user_id: UUID, recipients: int) -> None:
+        """Moves the cursor past a chunk; commits together with the chunk's staged send task."""
+        await self.db.execute(
+            update(EmailCampaign)
+            .where(EmailCampaign.id == campaign_id)
+            .values(
+                fanout_cursor=last_user_id,
+                recipients=EmailCampaign.recipients + recipients,
+                status=CampaignStatus.SENDING,
+            )
+        )
+        await self.db.commit()
+
+
+    async def finish_fanout(self, campaign_id: UUID) -> None:
+        await self.db.execute(
+            update(EmailCampaign)
+            .where(EmailCampaign.id == campaign_id)
+            .values(fanout_done=True, **self._completion(0, 0, True))
+        )
+        await self.db.commit()
+
+
+    async def record_sends(self, campaign_id: UUID, sent: int, failed: int) -> None:
+        await self.db.execute(
+            update(EmailCampaign)
+            .where(EmailCampaign.id == campaign_id)
+            .values(
+                sent=EmailCampaign.sent + sent,
+                failed=EmailCampaign.failed + failed,
+                **self._completion(sent, failed, EmailCampaign.fanout_done),
+            )
+        )
+        await self.db.commit()
+
+
+    async def list_unfinished_fanouts(self) -> list[UUID]:
+        result = await self.db.execute(
+            select(EmailCampaign.id)
+            .where(EmailCampaign.fanout_done.is_(False))
+            .order_by(EmailCampaign.created_at)
+        )
+        return list(result.scalars().all())
+
+
+    async def get_recipients(self, user_ids: list[UUID]) -> list[tuple[UUID, str, str]]:
+        """`(id, email, username)` of the users still active, in one query."""
+        result = await self.db.execute(
+            select(User.id, User.email, User.username)
+            .where(User.id.in_(user_ids), User.is_active.is_(True))
+        )
+        return [tuple(row) for row in result.all()]
+
+
+
+_ROLLUP_LOCK = 0x524F4C4C  # advisory lock namespace of the daily rollups
+
+
+def _utc_day(column):
+    return func.date(func.timezone("UTC", column))
+
+
+class AdminAnalyticsRepository:
+    def __init__(self, db: AsyncSession) -> None:
+        self.db = db
+
+
+    async def first_day(self) -> date | None:
+        """The earliest day with a payment or a new subscription, where a full rollup begins."""
+        result = await self.db.execute(
+            select(func.least(
+                select(func.min(_utc_day(Payment.created_at))).scalar_subquery(),
+                select(func.min(_utc_day(Subscription.created_at))).scalar_subquery(),
+            ))
+        )
+        return result.scalar_one_or_none()
+
+
+    async def days_touched_since(self, since: datetime) -> set[date]:
+        """Days holding a payment, new subscription or cancellation written since `since`."""
+        days = set()
+        for query in (
+            select(_utc_day(Payment.created_at)).where(Payment.updated_at >= since),
+            select(_utc_day(Subscription.created_at)).where(Subscription.updated_at >= since),
+            select(_utc_day(Subscription.canceled_at))
+                .where(Subscription.updated_at >= since, Subscription.canceled_at.is_not(None)),
+        ):
+            result = await self.db.execute(query.distinct())
+            days.update(result.scalars().all())
+        return days
+
+
+    async def refresh_day(self, day: date) -> None:
+        """Recomputes both rollups of `day` from the source tables, without committing."""
+        start = datetime.combine(day, time.min, tzinfo=timezone.utc)
+        end = start + timedelta(days=1)
+        # overlapping runs take turns on a day instead of both inserting its rows
+        await self.db.execute(select(func.pg_advisory_xact_lock(_ROLLUP_LOCK, day.toordinal())))
+        await self.db.execute(delete(DailyRevenue).where(DailyRevenue.day == day))
+        await self.db.execute(delete(DailySubscriptionStats).where(DailySubscriptionStats.day == day))
+
+        revenue = (
+            select(literal(day, Date), Subscription.plan_id, Payment.currency,
+                   func.count(), func.sum(Payment.amount_cents))
+            .select_from(Payment)
+            .outerjoin(Subscription, Subscription.id == Payment.subscription_id)
+            .where(Payment.status == PaymentStatus.SUCCEEDED, Payment.created_at >= start, Payment.created_at < end)
+            .group_by(Subscription.plan_id, Payment.currency)
+        )
+        await self.db.execute(
+            insert(DailyRevenue).from_select(["day", "plan_id", "currency", "payments", "amount_cents"], revenue)
+        )
+
+        # paid for past the end of the day and not canceled by then; a cancellation at period end churns the day it is made.
+        # Rows canceled before canceled_at was recorded have no date to go by and count as canceled throughout
+        active = and_(
+            Subscription.current_period_end >= end,
+            or_(
+                Subscription.canceled_at >= end,
+                and_(Subscription.canceled_at.is_(None), Subscription.status != SubscriptionStatus.CANCELED),
+            ),
+        )
+        monthly_cents = case(
+            (Plan.billing_period == BillingPeriod.YEARLY, func.round(Plan.price_cents / 12.0)),
+            else_=Plan.price_cents,
+        )
+        stats = (
+            select(
+                literal(day, Date),
+                Plan.currency,
+                # started_at moves to the current period on every renewal; created_at stays put
+                func.count().filter(Subscription.created_at >= start),
+                # an upgrade cancels the old subscription but the customer stays: not churn
+                func.count().filter(Subscription.canceled_at >= start, Subscription.canceled_at < end,
+                                    Subscription.replaced_by_id.is_(None)),
+                func.count().filter(active),
+                func.coalesce(func.sum(monthly_cents).filter(active), 0),
+            )
+            .select_from(Subscription)
+            .join(Plan, Plan.id == Subscription.plan_id)
+            .where(Subscription.status != SubscriptionStatus.PENDING, Subscription.created_at < end)
+            .group_by(Plan.currency)
+        )
+        await self.db.execute(
+            insert(DailySubscriptionStats).from_select(
+                ["day", "currency", "new_subscriptions", "canceled_subscriptions", "active_subscriptions", "mrr_cents"],
+                stats,
+            )
+        )
+
+
+    async def revenue_series(self, start: date, end: date, plan_id: UUID | None = None) -> list[DailyRevenue]:
+        query = (
+            select(DailyRevenue)
+            .where(DailyRevenue.day >= start, DailyRevenue.day <= end)
+            .order_by(DailyRevenue.day, DailyRevenue.currency)
+        )
+        if plan_id is not None:
+            query = query.where(DailyRevenue.plan_id == plan_id)
+        result = await self.db.execute(query)
+        return list(result.scalars().all())
+
+
+    async def subscription_series(self, start: date, end: date, currency: str | None = None) -> list[DailySubscriptionStats]:
+        query = (
+            select(DailySubscriptionStats)
+            .where(DailySubscriptionStats.day >= start, DailySubscriptionStats.day <= end)
+            .order_by(DailySubscriptionStats.day, DailySubscriptionStats.currency)
+        )
+        if currency is not None:
+            query = query.where(DailySubscriptionStats.currency == currency)
+        result = await self.db.execute(query)
+        return list(result.scalars().all())
 
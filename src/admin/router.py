@@ -1,4 +1,5 @@
 from uuid import UUID
+from datetime import date
 from typing import Optional
 from fastapi import APIRouter, Query
 from src.admin import dependencies
@@ -17,6 +18,28 @@ router = APIRouter()
 async def get_dashboard_stats(analytics_depenency: dependencies.AnalyiticsServiceDep,):
     stats = await analytics_depenency.get_stats()
     return stats
+
+
+@router.get("/dashboard/metrics")
+async def get_dashboard_metrics(admin: admin_required, analytics_depenency: dependencies.AnalyiticsServiceDep):
+    return await analytics_depenency.get_metrics()
+    
+
+
+@router.get("/analytics/revenue")
+async def get_revenue(admin: admin_required, analytics_depenency: dependencies.AnalyiticsServiceDep,
+    start: Optional[date] = Query(None),
+    end: Optional[date] = Query(None),
+    plan_id: Optional[UUID] = Query(None)):
+    return await analytics_depenency.get_revenue(start, end, plan_id)
+
+
+@router.get("/analytics/subscriptions")
+async def get_subscription_metrics(admin: admin_required, analytics_depenency: dependencies.AnalyiticsServiceDep,
+    start: Optional[date] = Query(None),
+    end: Optional[date] = Query(None),
+    currency: Optional[str] = Query(None)):
+    return await analytics_depenency.get_subscription_metrics(start, end, currency)
     
 
 
@@ -110,6 +133,20 @@ async def get_subscription_by_id(subscription_dependency: dependencies.SubScript
     return subscription
 
 
+@router.post("/campaigns", status_code=202)
+async def create_campaign(admin: admin_required, campaign_service: dependencies.CampaignServiceDep,
+    data: schemas.CampaignCreateIn):
+    campaign = await campaign_service.create_campaign(admin.id, data)
+    return campaign
+
+
+@router.get("/campaigns/{campaign_id}")
+async def get_campaign(admin: admin_required, campaign_service: dependencies.CampaignServiceDep,
+    campaign_id: UUID):
+    campaign = await campaign_service.get_campaign(campaign_id)
+    return campaign
+
+
 @router.post("/ai/chat")
 async def ai_chat(ai_service: dependencies.AiServiceDep, prompt: str):
     response = await ai_service.call_ai_model(prompt)
@@ -1,4 +1,5 @@
-from pydantic import BaseModel
+from uuid import UUID
+from pydantic import BaseModel, Field
 
 
 
@@ -7,3 +8,8 @@ class UpdateUserStatusIn(BaseModel):
 
 class UpdateUserRoleIn(BaseModel):
     is_admin: bool
+
+class CampaignCreateIn(BaseModel):
+    plan_id: UUID
+    subject: str = Field(min_length=1, max_length=200)
+    body: str = Field(min_length=1)
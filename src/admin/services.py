@@ -1,9 +1,29 @@
 import json
-from uuid import UUID
+import asyncio
+import aiosmtplib
+from uuid import UUID, uuid4
+from datetime import date, datetime, timedelta, timezone
+from fastapi import HTTPException, status
+from sqlalchemy.orm import sessionmaker
+from src import metrics
 from src.admin.utils import json_safe
 from src.admin.ai_repo import ai_repo
+from src.admin.emails import CampaignEmails
+from src.admin.models import EmailCampaign
 from src.admin.repository import (AdminUserRepository, AdminPaymentRepository, 
-        AdminSubscriptionRepository, AdminAuditLogRepository)
+        AdminSubscriptionRepository, AdminAuditLogRepository, AdminCampaignRepository, AdminAnalyticsRepository,
+        DASHBOARD_COUNT_QUERIES)
+from src.billing.repository import SyncCursorRepository
+from src.admin.schemas import CampaignCreateIn
+from src.admin.tasks import fan_out_campaign_task, send_campaign_chunk_task
+from src.config import settings
+from src.logging import get_logger
+from src.mailer import domain_throttle
+from src.outbox import stage_task
+from src.repository import DashboardCounterRepository
+
+
+logger = get_logger()
 
 
 
@@ -12,25 +32,63 @@ from src.admin.repository import (AdminUserRepository, AdminPaymentRepository,
 
 
 class AnalyticsService:
-    def __init__(self,
-                users_repo: AdminUserRepository,
-                subscriptions_repo: AdminSubscriptionRepository,
-                payments_repo: AdminPaymentRepository) -> None:
-        self.users_repo = users_repo
-        self.subscriptions_repo = subscriptions_repo
-        self.payments_repo = payments_repo
+    def __init__(self, counters_repo: DashboardCounterRepository, analytics_repo: AdminAnalyticsRepository) -> None:
+        self.counters_repo = counters_repo
+        self.analytics_repo = analytics_repo
 
 
     async def get_stats(self):
-        users = await self.users_repo.list_users()
-        subscriptions = await self.subscriptions_repo.list_subscriptions()
-        payments = await self.payments_repo.list_payments()
-
-        return {
-            "users": users['total'] if users else 0,
-            "subscriptions": subscriptions['total'] if subscriptions else 0,
-            "payments": payments['total'] if payments else 0
-        }
+        # maintained by the writes themselves, see DashboardCounterRepository
+        counters = await self.counters_repo.get_all()
+        return {name: counters.get(name, 0) for name in DASHBOARD_COUNT_QUERIES}
+
+
+    @staticmethod
+    def _date_range(start: date | None, end: date | None) -> tuple[date, date]:
+        end = end or datetime.now(timezone.utc).date()
+        start = start or end - timedelta(days=29)
+        if start > end or (end - start).days >= settings.analytics_max_range_days:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"start must not be after end, and the range at most {settings.analytics_max_range_days} days",
+            )
+        return start, end
+
+
+    async def get_revenue(self, start: date | None = None, end: date | None = None, plan_id: UUID | None = None):
+        start, end = self._date_range(start, end)
+        rows = await self.analytics_repo.revenue_series(start, end, plan_id)
+        return [
+            {"day": row.day, "plan_id": row.plan_id, "currency": row.currency,
+             "payments": row.payments, "amount_cents": row.amount_cents}
+            for row in rows
+        ]
+
+
+    async def get_subscription_metrics(self, start: date | None = None, end: date | None = None, currency: str | None = None):
+        """Daily series per currency; churn is the day's cancellations over the previous day's active subscriptions."""
+        start, end = self._date_range(start, end)
+        rows = await self.analytics_repo.subscription_series(start - timedelta(days=1), end, currency)
+        active_before = {(row.day, row.currency): row.active_subscriptions for row in rows}
+        series = []
+        for row in rows:
+            if row.day < start:
+                continue
+            previous_active = active_before.get((row.day - timedelta(days=1), row.currency))
+            series.append({
+                "day": row.day,
+                "currency": row.currency,
+                "new": row.new_subscriptions,
+                "canceled": row.canceled_subscriptions,
+                "active": row.active_subscriptions,
+                "mrr_cents": row.mrr_cents,
+                "churn_rate": row.canceled_subscriptions / previous_active if previous_active else None,
+            })
+        return series
+
+
+    async def get_metrics(self):
+        return await metrics.get_counters()
     
     
 class SubscriptionsServices:
@@ -147,6 +205,166 @@ class UsersService:
         return updated_user  
 
 
+class CampaignService:
+    def __init__(self, campaign_repo: AdminCampaignRepository, auditlog_repo: AdminAuditLogRepository) -> None:
+        self.campaign_repo = campaign_repo
+        self.auditlog_repo = auditlog_repo
+
+
+    async def create_campaign(self, admin_id: UUID, data: CampaignCreateIn) -> EmailCampaign:
+        if not await self.campaign_repo.plan_exists(data.plan_id):
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Plan not found")
+
+        campaign = EmailCampaign(id=uuid4(), plan_id=data.plan_id, created_by=admin_id,
+                                 subject=data.subject, body=data.body)
+        # the fan-out is staged in the campaign's own transaction
+        stage_task(self.campaign_repo.db, fan_out_campaign_task, str(campaign.id))
+        campaign = await self.campaign_repo.create(campaign)
+
+        await self.auditlog_repo.log(admin_id=admin_id, target_type="email_campaign", target_id=campaign.id,
+            action="campaign.create", after={"plan_id": str(data.plan_id), "subject": data.subject})
+        return campaign
+
+
+    async def get_campaign(self, campaign_id: UUID) -> EmailCampaign:
+        campaign = await self.campaign_repo.get_by_id(campaign_id)
+        if not campaign:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Campaign not found")
+        return campaign
+
+
+
+async def fan_out_campaign(session_factory: sessionmaker, campaign_id: UUID) -> int:
+    """
+    Hands the campaign's recipients to send tasks, a chunk of user ids per task, and returns how
+    many it handed out. Recipients are streamed from one session while each chunk's task is staged
+    and the cursor moved in a single commit on another, so a fan-out that dies resumes where its
+    last chunk left off. Returns 0 without doing anything when another fan-out holds the campaign.
+    """
+    handed_out = 0
+    async with session_factory() as reader, session_factory() as writer:
+        reader_repo = AdminCampaignRepository(reader)
+        writer_repo = AdminCampaignRepository(writer)
+        if not await reader_repo.try_lock_fanout(campaign_id):
+            logger.info(f"Campaign fan-out already running campaign_id={campaign_id}")
+            return 0
+        # read under the lock: a fan-out that just released it may have moved the cursor
+        campaign = await reader_repo.get_by_id(campaign_id)
+        if campaign is None or campaign.fanout_done:
+            return 0
+
+        async for user_ids in reader_repo.stream_recipient_ids(
+            campaign.plan_id, campaign.fanout_cursor, settings.campaign_chunk_size
+        ):
+            stage_task(writer, send_campaign_chunk_task, str(campaign_id), [str(user_id) for user_id in user_ids])
+            await writer_repo.advance_fanout(campaign_id, user_ids[-1], len(user_ids))
+            handed_out += len(user_ids)
+
+        await writer_repo.finish_fanout(campaign_id)
+    await metrics.incr("campaigns.recipients", handed_out)
+    logger.info(f"Campaign fan-out finished campaign_id={campaign_id}, recipients={handed_out}")
+    return handed_out
+
+
+async def send_campaign_chunk(
+    session_factory: sessionmaker, campaign_id: UUID, user_ids: list[UUID], final_attempt: bool
+) -> list[UUID]:
+    """
+    Emails one chunk of recipients, each domain at its throttled rate, and records the outcome.
+    Returns the recipients to retry; on the final attempt those are recorded as failed instead.
+    Users deactivated or deleted since the fan-out count as failed.
+    """
+    async with session_factory() as db:
+        campaign_repo = AdminCampaignRepository(db)
+        found = await campaign_repo.get_with_plan_name(campaign_id)
+        if found is None:
+            return []
+        campaign, plan_name = found
+        recipients = await campaign_repo.get_recipients(user_ids)
+
+    async def _send(email: str, user_name: str) -> None:
+        domain = email.rpartition("@")[2].lower()
+        await domain_throttle.acquire(domain)
+        try:
+            await CampaignEmails.send_campaign_email(subject=campaign.subject, body=campaign.body,
+                                                     plan=plan_name, email=email, user_name=user_name)
+        except aiosmtplib.SMTPResponseException as e:
+            if e.code == 421:
+                await domain_throttle.back_off(domain)
+            raise
+
+    results = await asyncio.gather(
+        *(_send(email, user_name) for _, email, user_name in recipients), return_exceptions=True
+    )
+    retry = [user_id for (user_id, _, _), result in zip(recipients, results) if isinstance(result, Exception)]
+    sent = len(recipients) - len(retry)
+    failed = len(user_ids) - len(recipients) + (len(retry) if final_attempt else 0)
+    if retry:
+        error = next(result for result in results if isinstance(result, Exception))
+        logger.warning(f"Campaign emails failed campaign_id={campaign_id}, failed={len(retry)}, error={str(error)}")
+
+    async with session_factory() as db:
+        await AdminCampaignRepository(db).record_sends(campaign_id, sent, failed)
+    await metrics.incr_many({"campaigns.sent": sent, "campaigns.failed": failed})
+    return [] if final_attempt else retry
+
+
+async def recount_dashboard_counters(session_factory: sessionmaker) -> dict[str, int]:
+    async with session_factory() as db:
+        counters_repo = DashboardCounterRepository(db)
+        before = await counters_repo.get_all()
+        exact = await counters_repo.recount(DASHBOARD_COUNT_QUERIES)
+    drift = {name: value - before.get(name, 0) for name, value in exact.items() if value != before.get(name, 0)}
+    if drift:
+        logger.warning(f"Dashboard counters drifted, corrected drift={drift}")
+    return exact
+
+
+ROLLUP_CURSOR = "analytics.daily_rollups"
+
+
+async def refresh_daily_rollups(session_factory: sessionmaker) -> int:
+    """
+    Recomputes the daily rollups of the days touched since the last run: days holding payments or
+    subscription starts and cancellations written since then, plus every day from the last run's
+    through today, whose end-of-day figures can still move. The first run covers all history.
+    A day is committed at a time; returns how many were refreshed.
+    """
+    run_started = datetime.now(timezone.utc)
+    today = run_started.date()
+    async with session_factory() as db:
+        cursor_repo = SyncCursorRepository(db)
+        analytics_repo = AdminAnalyticsRepository(db)
+        last_run_ms = await cursor_repo.get(ROLLUP_CURSOR)
+        if last_run_ms:
+            last_run = datetime.fromtimestamp(last_run_ms / 1000, tz=timezone.utc)
+            days = await analytics_repo.days_touched_since(
+                last_run - timedelta(seconds=settings.analytics_rollup_lookback_seconds)
+            )
+            first_open_day = last_run.date()
+        else:
+            days = set()
+            first_open_day = await analytics_repo.first_day() or today
+        days.update(first_open_day + timedelta(days=n) for n in range((today - first_open_day).days + 1))
+
+        for day in sorted(days):
+            await analytics_repo.refresh_day(day)
+            await db.commit()
+        await cursor_repo.advance(ROLLUP_CURSOR, int(run_started.timestamp() * 1000))
+    logger.info(f"Daily rollups refreshed days={len(days)}")
+    return len(days)
+
+
+async def resume_campaign_fanouts(session_factory: sessionmaker) -> int:
+    """Restarts fan-outs that died part way; the ones still running are skipped by their lock."""
+    async with session_factory() as db:
+        campaign_ids = await AdminCampaignRepository(db).list_unfinished_fanouts()
+    resumed = 0
+    for campaign_id in campaign_ids:
+        resumed += await fan_out_campaign(session_factory, campaign_id)
+    return resumed
+
+
 class AiSerivce:
     def __init__(self, ai_repo: ai_repo, client, model: str, tools, system_message: str) -> None:
         self.ai_repo = ai_repo
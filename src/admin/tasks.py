@@ -0,0 +1,84 @@
+from uuid import UUID
+from src.celery_app import celery_app, beat_app
+from src import load_models
+from src.config import settings
+from src.database import worker_async_session
+from src.logging import get_logger
+from src.worker import run_async
+
+
+logger = get_logger()
+
+
+async def _fan_out_campaign(campaign_id: str) -> int:
+    # imported here: src.admin.services imports this module for the tasks it stages
+    from src.admin.services import fan_out_campaign
+
+    return await fan_out_campaign(worker_async_session, UUID(campaign_id))
+
+
+@celery_app.task(name="fan_out_campaign_task")
+def fan_out_campaign_task(campaign_id: str):
+    run_async(_fan_out_campaign(campaign_id))
+
+
+async def _send_campaign_chunk(campaign_id: str, user_ids: list[str], final_attempt: bool) -> list[str]:
+    from src.admin.services import send_campaign_chunk
+
+    retry = await send_campaign_chunk(
+        worker_async_session, UUID(campaign_id), [UUID(user_id) for user_id in user_ids], final_attempt
+    )
+    return [str(user_id) for user_id in retry]
+
+
+@celery_app.task(
+        bind=True,
+        name="send_campaign_chunk_task",
+        max_retries=settings.campaign_max_retries,
+        # a chunk whose worker died is redelivered rather than lost; a few recipients may get it twice
+        acks_late=True,
+        reject_on_worker_lost=True,
+        )
+def send_campaign_chunk_task(self, campaign_id: str, user_ids: list[str]):
+    """A retry resends only the recipients whose email failed."""
+    final_attempt = self.request.retries >= self.max_retries
+    retry = run_async(_send_campaign_chunk(campaign_id, user_ids, final_attempt))
+    if retry:
+        raise self.retry(args=(campaign_id, retry), countdown=30 * 2 ** self.request.retries)
+
+
+async def _resume_campaign_fanouts() -> int:
+    from src.admin.services import resume_campaign_fanouts
+
+    return await resume_campaign_fanouts(worker_async_session)
+
+
+@beat_app.task(name="resume_campaign_fanouts_task")
+def resume_campaign_fanouts_task():
+    resumed = run_async(_resume_campaign_fanouts())
+    if resumed:
+        logger.info(f"Campaign fan-outs resumed recipients={resumed}")
+
+
+async def _recount_dashboard_counters() -> dict[str, int]:
+    from src.admin.services import recount_dashboard_counters
+
+    return await recount_dashboard_counters(worker_async_session)
+
+
+@beat_app.task(name="recount_dashboard_counters_task")
+def recount_dashboard_counters_task():
+    """Exact counts for the dashboard, correcting writes that bypassed the repositories."""
+    run_async(_recount_dashboard_counters())
+
+
+async def _refresh_daily_rollups() -> int:
+    from src.admin.services import refresh_daily_rollups
+
+    return await refresh_daily_rollups(worker_async_session)
+
+
+@beat_app.task(name="refresh_daily_rollups_task")
+def refresh_daily_rollups_task():
+    run_async(_refresh_daily_rollups())
+
@@ -0,0 +1 @@
+LOGIN_CODE_EXPIRE_MINUTES = 15
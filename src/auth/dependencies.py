@@ -2,7 +2,6 @@ from typing import Annotated
 from fastapi import Depends
 from src.auth.repository import UserRepository , LoginCodeRepository
 from src.database import db_dependency
-from src.auth.emails import Emails
 from src.auth.service import UserService
 from src.dependencies import token_depedency
 
@@ -19,12 +18,6 @@ def get_code_repo(db: db_dependency) -> LoginCodeRepository:
 code_dependency = Annotated[LoginCodeRepository, Depends(get_code_repo)]
 
 
-def get_email_service():
-    return Emails()
-
-email_dependency = Annotated[Emails, Depends(get_email_service)]
-
-
 def get_user_service(user_repo: repo_dependency, 
     login_code_repo: code_dependency, token_repo: token_depedency)-> UserService:
     return UserService(user_repo, token_repo, login_code_repo)
@@ -2,7 +2,7 @@ from uuid import uuid4, UUID as PyUUID
 from enum import Enum
 from datetime import timezone, datetime
 from src.database import Base
-from sqlalchemy import String, Boolean, DateTime, ForeignKey, Enum as SAENUM
+from sqlalchemy import String, Boolean, DateTime, ForeignKey, Enum as SAENUM, Index
 from sqlalchemy.orm import relationship, mapped_column, Mapped
 from sqlalchemy.dialects.postgresql import UUID
 
@@ -24,10 +24,10 @@ class User(Base):
     is_admin: Mapped[bool] = mapped_column(Boolean(), default=False)
     is_active: Mapped[bool] = mapped_column(Boolean(), default=True) 
     is_verified: Mapped[bool] = mapped_column(Boolean(), default=False) 
-    stripe_customer_id: Mapped[str] = mapped_column(String(), nullable=True)
+    stripe_customer_id: Mapped[str] = mapped_column(String(), nullable=True, index=True)
     provider: Mapped[Provider] = mapped_column(SAENUM(Provider), nullable=False)
     created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True),
-                                    default=lambda: datetime.now(timezone.utc))
+                                    default=lambda: datetime.now(timezone.utc), index=True)
     updated_at: Mapped[datetime] = mapped_column(DateTime(timezone=True),
                 default=lambda: datetime.now(timezone.utc),onupdate=lambda: datetime.now(timezone.utc))
     
@@ -49,4 +49,4 @@ class LoginCode(Base):
     )
 
 
-    
\ No newline at end of file
+Index("ix_login_codes_user_created", LoginCode.user_id, LoginCode.created_at)
@@ -2,6 +2,7 @@ from uuid import UUID
 from sqlalchemy import select, delete
 from sqlalchemy.ext.asyncio import AsyncSession
 from src.auth.models import User, LoginCode
+from src.repository import DashboardCounterRepository
 
 class UserRepository:
     def __init__(self, db: AsyncSession) -> None:
@@ -32,6 +33,7 @@ class UserRepository:
     async def create(self, user: User) -> User: 
         self.db.add(user)
         await self.db.flush()  
+        await DashboardCounterRepository(self.db).add(users=1)
 
         await self.db.commit()
         await self.db.refresh(user)
@@ -40,6 +42,36 @@ class UserRepository:
 
 
 
+    async def list_ids_without_stripe_customer(self, after_id: UUID | None, limit: int) -> list[UUID]:
+        """Verified, active users that have no Stripe customer yet, in id order for keyset paging."""
+        query = (
+            select(User.id)
+            .where(User.stripe_customer_id.is_(None), User.is_verified.is_(True), User.is_active.is_(True))
+            .order_by(User.id)
+            .limit(limit)
+        )
+        if after_id is not None:
+            query = query.where(User.id > after_id)
+        result = await self.db.execute(query)
+        return list(result.scalars().all())
+
+
+    async def get_existing_ids(self, user_ids: list[UUID]) -> set[UUID]:
+        if not user_ids:
+            return set()
+        result = await self.db.execute(select(User.id).where(User.id.in_(user_ids)))
+        return set(result.scalars().all())
+
+
+    async def get_ids_by_stripe_customer_ids(self, stripe_customer_ids: list[str]) -> dict[str, UUID]:
+        if not stripe_customer_ids:
+            return {}
+        result = await self.db.execute(
+            select(User.stripe_customer_id, User.id).where(User.stripe_customer_id.in_(stripe_customer_ids))
+        )
+        return {customer_id: user_id for customer_id, user_id in result.all()}
+
+
     async def update(self, user: User, **kwargs) -> User:
         for key, value in kwargs.items():
             setattr(user, key, value)
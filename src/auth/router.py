@@ -1,19 +1,19 @@
-from fastapi import APIRouter, Response, BackgroundTasks, status, Request
+from fastapi import APIRouter, Response, status, Request
 from fastapi.responses import RedirectResponse
 from src.auth import schemas, utils
-from src.auth.dependencies import email_dependency
 from src.auth_bearer import  active_user_dep, non_active_user_dep
 from src.rate_limiter import limiter
 from src.auth.dependencies import UserServiceDep
+from src.logging import get_logger
 
 
 router = APIRouter()
+logger = get_logger("auth")
+
 
 @router.post("/register", response_model=schemas.UserRead, status_code=status.HTTP_201_CREATED)
-async def register_user(user_data: schemas.UserCreateRequest, UserService: UserServiceDep,
-                        background: BackgroundTasks, email: email_dependency):
+async def register_user(user_data: schemas.UserCreateRequest, UserService: UserServiceDep):
     user = await UserService.register_user(user_data)
-    background.add_task(email.send_verification_email, user.email, user.id) 
     return user
 
 
@@ -39,20 +39,15 @@ async def verify_email(token: str, UserService: UserServiceDep):
 
 
 @router.post("/request/verify", response_model=schemas.MessageResponse, status_code=status.HTTP_202_ACCEPTED)
-async def request_verify_email(current_user: non_active_user_dep, 
-                               background: BackgroundTasks, email: email_dependency):
-    if current_user.is_verified: 
+async def request_verify_email(current_user: non_active_user_dep, UserService: UserServiceDep):
+    if not await UserService.request_verification(current_user):
         return {"message": "Email is already verified"}
-    background.add_task(email.send_verification_email, current_user.email, current_user.id) 
     return {"message": "New Verification Email has been sent"}
 
 
 @router.post("/forget-password", response_model=schemas.MessageResponse, status_code=status.HTTP_202_ACCEPTED)
-async def forget_password(data: schemas.ForgetPasswordRequest, UserService: UserServiceDep,
-                          background: BackgroundTasks, email: email_dependency):
-    user = await UserService.forget_password(data)
-    if user:
-        background.add_task(email.send_password_reset_email, user.email, user.id) 
+async def forget_password(data: schemas.ForgetPasswordRequest, UserService: UserServiceDep):
+    await UserService.forget_password(data)
     return {"message": "If an account with this email exists, a password reset link has been sent."}
 
 
@@ -71,12 +66,8 @@ async def change_password(data: schemas.ChangePasswordRequest, UserService: User
 
 
 @router.post("/request/login-code")
-async def request_login_code(data: schemas.LoginCodeRequest, UserService: UserServiceDep,
-                            background: BackgroundTasks, email: email_dependency):
-    result = await UserService.login_code(data)
-    if result:
-        user, code = result
-        background.add_task(email.send_login_code, user.email, code) 
+async def request_login_code(data: schemas.LoginCodeRequest, UserService: UserServiceDep):
+    await UserService.login_code(data)
     return {"message": "If an account with this email exists, a login code has been sent."}
     
 
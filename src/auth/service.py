@@ -1,5 +1,5 @@
 from datetime import datetime, UTC, timezone
-from uuid import UUID
+from uuid import UUID, uuid4
 from fastapi import HTTPException, status, Request
 from src.config import settings
 from src.jwt import generate_token, verify_token
@@ -10,6 +10,9 @@ from src.repository import RefreshTokenRepository
 from src.auth import utils, schemas
 from src.auth.repository import UserRepository, LoginCodeRepository
 from src.auth.models import User, Provider
+from src.auth.tasks import send_verification_email_task, send_password_reset_email_task, send_login_code_task
+from src.billing.tasks import provision_stripe_customer_task
+from src.outbox import stage_task
 from src.logging import get_logger
 
 logger = get_logger("auth")
@@ -35,11 +38,14 @@ class UserService:
             raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Username already exists")
         
         new_user = User(
+            id = uuid4(),
             email = user_data.email,
             username = user_data.username,
             password = await hash_password(user_data.password),
             provider = Provider.LOCAL
         )
+        # the email is staged in the new user's own transaction
+        stage_task(self.user_repo.db, send_verification_email_task, new_user.email, str(new_user.id))
         logger.info(f"User registered user_id={str(new_user.id)} email={new_user.email} provider=LOCAL")
         return await self.user_repo.create(new_user)
     
@@ -113,14 +119,27 @@ class UserService:
         if user.is_verified :
             return False
         user.is_verified = True 
+        # the Stripe customer is created ahead of the first checkout, staged in the verification's own transaction
+        stage_task(self.user_repo.db, provision_stripe_customer_task, str(user.id))
         await self.user_repo.update(user)
         logger.info(f"User email verified user_id={str(user.id)} email={user.email}")
         return True
 
 
+    async def request_verification(self, current_user: User) -> bool:
+        if current_user.is_verified:
+            return False
+        stage_task(self.user_repo.db, send_verification_email_task, current_user.email, str(current_user.id))
+        await self.user_repo.db.commit()
+        return True
+
+
     async def forget_password(self, data: schemas.ForgetPasswordRequest) -> User | None:
         user = await self.user_repo.get_by_email(data.email)
         logger.info(f"Password reset requested email={data.email}")
+        if user:
+            stage_task(self.user_repo.db, send_password_reset_email_task, user.email, str(user.id))
+            await self.user_repo.db.commit()
         return user
 
 
@@ -164,6 +183,7 @@ class UserService:
             )
         login_code, code = await utils.generate_otp_code(user.id) 
         await self.login_code_repo.delete(user.id) 
+        stage_task(self.login_code_repo.db, send_login_code_task, user.email, code)
         await self.login_code_repo.create(login_code)
         logger.info(f"Login code generated and stored user_id={str(user.id)} email={user.email}")
         return user, code
@@ -227,11 +247,13 @@ class UserService:
         user = await self.user_repo.get_by_email(email)
         if not user:
             user = User(
+                id = uuid4(),
                 email = email,
                 username = username,
                 provider = Provider.GOOGLE,
                 is_verified = True
             ) 
+            stage_task(self.user_repo.db, provision_stripe_customer_task, str(user.id))
             user = await self.user_repo.create(user)
             logger.info(f"New user created via Google user_id={str(user.id)}, email={user.email}")
 
@@ -261,11 +283,13 @@ class UserService:
         user = await self.user_repo.get_by_email(email)
         if not user:
             user = User(
+                id = uuid4(),
                 email = email,
                 username = username,
                 provider = Provider.GITHUB,
                 is_verified = True
             ) 
+            stage_task(self.user_repo.db, provision_stripe_customer_task, str(user.id))
             user = await self.user_repo.create(user)
             logger.info(f"New user created via Github user_id={str(user.id)}, email={user.email}")
 
@@ -0,0 +1,41 @@
+from src.celery_app import celery_app
+from src.auth.constants import LOGIN_CODE_EXPIRE_MINUTES
+from src.auth.emails import Emails
+from src.worker import run_async
+
+
+email_service = Emails()
+
+
+@celery_app.task(
+        name="send_verification_email_task",
+        autoretry_for=(Exception,),
+        retry_backoff=True,
+        retry_kwargs={"max_retries": 5},
+        )
+def send_verification_email_task(email: str, user_id: str):
+    run_async(email_service.send_verification_email(email, user_id))
+
+
+# the user is waiting on these two: retry quickly, and never deliver a login code after it has expired
+@celery_app.task(
+        name="send_password_reset_email_task",
+        autoretry_for=(Exception,),
+        retry_backoff=2,
+        retry_backoff_max=30,
+        retry_kwargs={"max_retries": 5},
+        )
+def send_password_reset_email_task(email: str, user_id: str):
+    run_async(email_service.send_password_reset_email(email, user_id))
+
+
+@celery_app.task(
+        name="send_login_code_task",
+        autoretry_for=(Exception,),
+        retry_backoff=2,
+        retry_backoff_max=30,
+        retry_kwargs={"max_retries": 5},
+        expires=LOGIN_CODE_EXPIRE_MINUTES * 60,
+        )
+def send_login_code_task(email: str, code: str):
+    run_async(email_service.send_login_code(email, code))
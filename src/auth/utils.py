@@ -5,6 +5,7 @@ from datetime import datetime, timedelta, UTC
 from fastapi import HTTPException, status
 from src.hashing import hash_password
 from src.auth.models import LoginCode
+from src.auth.constants import LOGIN_CODE_EXPIRE_MINUTES
 from src.config import settings
 
 
@@ -12,7 +13,7 @@ from src.config import settings
 async def generate_otp_code(user_id: UUID) -> tuple[LoginCode, str]:
     code = f"{secrets.randbelow(1000000):06}"
     hashed_code = await hash_password(code)
-    expires_at = datetime.now(UTC) + timedelta(minutes=15)
+    expires_at = datetime.now(UTC) + timedelta(minutes=LOGIN_CODE_EXPIRE_MINUTES)
     return LoginCode(
         user_id = user_id,
         code_hash  = hashed_code,
@@ -0,0 +1,372 @@
+import time
+from enum import Enum
+from uuid import UUID
+from collections import OrderedDict
+from datetime import datetime
+from dataclasses import dataclass
+from typing import Iterable
+from src.billing.models import Plan, Subscription, SubscriptionStatus, BillingPeriod, PlanTier
+from src.cache import publish_invalidation, get_redis
+from src.logging import get_logger
+from src.config import settings
+
+logger = get_logger("billing")
+
+
+@dataclass(frozen=True, slots=True)
+class CachedPlan:
+    """Read-only copy of a Plan row, safe to share between requests and sessions."""
+    id: UUID
+    name: str
+    code: str
+    price_cents: int
+    currency: str
+    billing_period: BillingPeriod
+    is_active: bool
+    stripe_product_id: str | None
+    stripe_price_id: str | None
+    tier: PlanTier
+
+    @classmethod
+    def from_model(cls, plan: Plan) -> "CachedPlan":
+        return cls(
+            id=plan.id,
+            name=plan.name,
+            code=plan.code,
+            price_cents=plan.price_cents,
+            currency=plan.currency,
+            billing_period=plan.billing_period,
+            is_active=plan.is_active,
+            stripe_product_id=plan.stripe_product_id,
+            stripe_price_id=plan.stripe_price_id,
+            tier=plan.tier,
+        )
+
+
+class PlanCatalog:
+    """
+    Process-local copy of the plans table indexed by id and code.
+    Filled lazily by PlanRepository, dropped on plan writes (locally and on every
+    other worker through Redis pub/sub) and reloaded after `ttl_seconds` anyway.
+    """
+    def __init__(self, ttl_seconds: int) -> None:
+        self.ttl_seconds = ttl_seconds
+        self._by_id: dict[UUID, CachedPlan] = {}
+        self._by_code: dict[str, CachedPlan] = {}
+        self._loaded_at: float | None = None
+        self._version = 0
+
+
+    @property
+    def version(self) -> int:
+        return self._version
+
+
+    @property
+    def is_fresh(self) -> bool:
+        return self._loaded_at is not None and (time.monotonic() - self._loaded_at) < self.ttl_seconds
+
+
+    def load(self, plans: Iterable[Plan], version: int) -> None:
+        cached = [CachedPlan.from_model(plan) for plan in plans]
+        self._by_id = {plan.id: plan for plan in cached}
+        self._by_code = {plan.code: plan for plan in cached}
+        # An invalidation that arrived while we were querying wins: keep the data but reload next time.
+        self._loaded_at = time.monotonic() if version == self._version else None
+
+
+    def invalidate(self, _key: str = "") -> None:
+        self._version += 1
+        self._loaded_at = None
+
+
+    def get_by_id(self, plan_id: UUID | str) -> CachedPlan | None:
+        return self._by_id.get(UUID(str(plan_id)))
+
+
+    def get_by_code(self, code: str) -> CachedPlan | None:
+        plan = self._by_code.get(code)
+        if plan is None or not plan.is_active:
+            return None
+        return plan
+
+
+    def list_plans(self, active_only: bool = True) -> list[CachedPlan]:
+        plans = [plan for plan in self._by_id.values() if plan.is_active or not active_only]
+        return sorted(plans, key=lambda plan: plan.price_cents)
+
+
+
+plan_catalog = PlanCatalog(ttl_seconds=settings.plan_catalog_ttl_seconds)
+
+
+async def invalidate_plan_catalog() -> None:
+    plan_catalog.invalidate()
+    await publish_invalidation("plans")
+
+
+
+@dataclass(frozen=True, slots=True)
+class Entitlement:
+    """What a user is allowed to do right now, derived from their subscription with access."""
+    user_id: UUID
+    subscription_id: UUID
+    plan_id: UUID
+    tier: PlanTier
+    status: SubscriptionStatus
+    current_period_end: datetime | None
+
+    @classmethod
+    def from_subscription(cls, subscription: Subscription) -> "Entitlement":
+        return cls(
+            user_id=subscription.user_id,
+            subscription_id=subscription.id,
+            plan_id=subscription.plan_id,
+            tier=subscription.plan.tier,
+            status=subscription.status,
+            current_period_end=subscription.current_period_end,
+        )
+
+
+class EntitlementCache:
+    """
+    Process-local entitlement per user. A snapshot lives until its `current_period_end`,
+    "no subscription" answers only for `negative_ttl_seconds` (a checkout can complete any time).
+    Subscription writes drop the user's entry on every worker through invalidate_entitlement().
+    """
+    def __init__(self, negative_ttl_seconds: int, max_entries: int) -> None:
+        self.negative_ttl_seconds = negative_ttl_seconds
+        self.max_entries = max_entries
+        self._entries: dict[UUID, tuple[Entitlement | None, float]] = {}
+        self._version = 0
+
+
+    @property
+    def version(self) -> int:
+        return self._version
+
+
+    def get(self, user_id: UUID) -> tuple[bool, Entitlement | None]:
+        """Returns (hit, entitlement); a hit with None means the user has no access."""
+        entry = self._entries.get(user_id)
+        if entry is None:
+            return False, None
+        entitlement, expires_at = entry
+        if time.time() >= expires_at:
+            self._entries.pop(user_id, None)
+            return False, None
+        return True, entitlement
+
+
+    def set(self, user_id: UUID, entitlement: Entitlement | None, version: int) -> None:
+        # Same rule as the plan catalog: an invalidation during the query means the result may be stale.
+        if version != self._version:
+            return
+        if entitlement is None:
+            expires_at = time.time() + self.negative_ttl_seconds
+        elif entitlement.current_period_end is None:
+            return
+        else:
+            expires_at = entitlement.current_period_end.timestamp()
+
+        if user_id not in self._entries and len(self._entries) >= self.max_entries:
+            self._entries.pop(next(iter(self._entries)))
+        self._entries[user_id] = (entitlement, expires_at)
+
+
+    def invalidate(self, key: str = "") -> None:
+        self._version += 1
+        if not key:
+            self._entries.clear()
+            return
+        self._entries.pop(UUID(key), None)
+
+
+
+entitlement_cache = EntitlementCache(
+    negative_ttl_seconds=settings.entitlement_negative_ttl_seconds,
+    max_entries=settings.entitlement_cache_max_entries,
+)
+
+
+async def invalidate_entitlement(user_id: UUID | str) -> None:
+    entitlement_cache.invalidate(str(user_id))
+    await publish_invalidation("entitlement", str(user_id))
+
+
+
+class StripeEventState(str, Enum):
+    NEW = "new"
+    IN_FLIGHT = "in_flight"
+    DONE = "done"
+
+
+class StripeEventRegistry:
+    """
+    Cheap duplicate check in front of the stripe_events unique key. Event ids we stored
+    recently are remembered in process and in Redis, so redeliveries skip the database;
+    a short-lived Redis marker covers a delivery another worker is storing right now.
+    Redis being unavailable only means falling through to the database, which stays the source of truth.
+    """
+    def __init__(self, done_ttl_seconds: int, in_flight_ttl_seconds: int, local_size: int) -> None:
+        self.done_ttl_seconds = done_ttl_seconds
+        self.in_flight_ttl_seconds = in_flight_ttl_seconds
+        self.local_size = local_size
+        self._done: OrderedDict[str, None] = OrderedDict()
+
+
+    @staticmethod
+    def _key(stripe_event_id: str) -> str:
+        return f"stripe:event:{stripe_event_id}"
+
+
+    def _remember(self, stripe_event_id: str) -> None:
+        self._done[stripe_event_id] = None
+        self._done.move_to_end(stripe_event_id)
+        if len(self._done) > self.local_size:
+            self._done.popitem(last=False)
+
+
+    def clear(self) -> None:
+        self._done.clear()
+
+
+    async def begin(self, stripe_event_id: str) -> StripeEventState:
+        """Marks the event in flight unless it is already known; returns what we knew about it."""
+        if stripe_event_id in self._done:
+            return StripeEventState.DONE
+        try:
+            redis = get_redis()
+            if await redis.set(self._key(stripe_event_id), StripeEventState.IN_FLIGHT.value,
+                               nx=True, ex=self.in_flight_ttl_seconds):
+                return StripeEventState.NEW
+            state = await redis.get(self._key(stripe_event_id))
+        except Exception as e:
+            logger.warning(f"Stripe event registry unavailable stripe_event_id={stripe_event_id}, error={str(e)}")
+            return StripeEventState.NEW
+
+        if state == StripeEventState.DONE.value:
+            self._remember(stripe_event_id)
+            return StripeEventState.DONE
+        # the marker may have expired between SET and GET, let the database decide
+        return StripeEventState.IN_FLIGHT if state else StripeEventState.NEW
+
+
+    async def finish(self, stripe_event_id: str) -> None:
+        self._remember(stripe_event_id)
+        try:
+            await get_redis().set(self._key(stripe_event_id), StripeEventState.DONE.value, ex=self.done_ttl_seconds)
+        except Exception as e:
+            logger.warning(f"Stripe event registry update failed stripe_event_id={stripe_event_id}, error={str(e)}")
+
+
+    async def abort(self, stripe_event_id: str) -> None:
+        """Drops the in-flight marker so Stripe's retry of a delivery we failed to store goes through."""
+        try:
+            await get_redis().delete(self._key(stripe_event_id))
+        except Exception as e:
+            logger.warning(f"Stripe event registry cleanup failed stripe_event_id={stripe_event_id}, error={str(e)}")
+
+
+
+stripe_event_registry = StripeEventRegistry(
+    done_ttl_seconds=settings.stripe_event_dedupe_ttl_seconds,
+    in_flight_ttl_seconds=settings.stripe_event_in_flight_ttl_seconds,
+    local_size=settings.stripe_event_dedupe_local_size,
+)
+
+
+
+class StripeSubscriptionCache:
+    """
+    Short-lived, process-local copy of Stripe subscription objects keyed by id.
+    Webhook handlers read from the event payload first and only come here when it lacks
+    what they need; every retrieve (or modify) we do anyway refreshes the entry.
+    """
+    def __init__(self, ttl_seconds: int, max_entries: int) -> None:
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries: OrderedDict[str, tuple[dict, float]] = OrderedDict()
+
+
+    def get(self, stripe_subscription_id: str) -> dict | None:
+        entry = self._entries.get(stripe_subscription_id)
+        if entry is None:
+            return None
+        stripe_subscription, expires_at = entry
+        if time.monotonic() >= expires_at:
+            self._entries.pop(stripe_subscription_id, None)
+            return None
+        return stripe_subscription
+
+
+    def set(self, stripe_subscription) -> None:
+        stripe_subscription_id = stripe_subscription.get("id")
+        if not stripe_subscription_id:
+            return
+        self._entries[stripe_subscription_id] = (stripe_subscription, time.monotonic() + self.ttl_seconds)
+        self._entries.move_to_end(stripe_subscription_id)
+        if len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+
+    def invalidate(self, stripe_subscription_id: str = "") -> None:
+        if not stripe_subscription_id:
+            self._entries.clear()
+            return
+        self._entries.pop(stripe_subscription_id, None)
+
+
+
+stripe_subscription_cache = StripeSubscriptionCache(
+    ttl_seconds=settings.stripe_subscription_cache_ttl_seconds,
+    max_entries=settings.stripe_subscription_cache_max_entries,
+)
+
+
+
+class CheckoutSessionCache:
+    """
+    Remembers the open Stripe checkout session per (user, plan, subscription being upgraded),
+    so a repeated subscribe/upgrade hands out the same URL instead of creating another session.
+    Entries expire a little before the session does and are dropped once checkout completes.
+    """
+    def __init__(self, expiry_margin_seconds: int) -> None:
+        self.expiry_margin_seconds = expiry_margin_seconds
+
+
+    @staticmethod
+    def _key(user_id: UUID | str, plan_id: UUID | str, upgrade_from: str | None) -> str:
+        return f"checkout:{user_id}:{plan_id}:{upgrade_from or ''}"
+
+
+    async def get(self, user_id: UUID | str, plan_id: UUID | str, upgrade_from: str | None) -> str | None:
+        try:
+            return await get_redis().get(self._key(user_id, plan_id, upgrade_from))
+        except Exception as e:
+            logger.warning(f"Checkout session cache unavailable user_id={user_id}, error={str(e)}")
+            return None
+
+
+    async def set(self, user_id: UUID | str, plan_id: UUID | str, upgrade_from: str | None,
+                  url: str, expires_at: int | None) -> None:
+        if not expires_at:
+            return
+        ttl = int(expires_at - time.time()) - self.expiry_margin_seconds
+        if ttl <= 0:
+            return
+        try:
+            await get_redis().set(self._key(user_id, plan_id, upgrade_from), url, ex=ttl)
+        except Exception as e:
+            logger.warning(f"Checkout session cache update failed user_id={user_id}, error={str(e)}")
+
+
+    async def forget(self, user_id: UUID | str, plan_id: UUID | str, upgrade_from: str | None) -> None:
+        try:
+            await get_redis().delete(self._key(user_id, plan_id, upgrade_from))
+        except Exception as e:
+            logger.warning(f"Checkout session cache cleanup failed user_id={user_id}, error={str(e)}")
+
+
+
+checkout_session_cache = CheckoutSessionCache(expiry_margin_seconds=settings.checkout_session_expiry_margin_seconds)
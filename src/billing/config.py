@@ -0,0 +1,37 @@
+from pydantic_settings import BaseSettings
+from pydantic import Field
+
+
+class BillingSettings(BaseSettings):
+    #CACHES
+    plan_catalog_ttl_seconds: int = Field(default=300)
+    entitlement_negative_ttl_seconds: int = Field(default=30)
+    entitlement_cache_max_entries: int = Field(default=10000)
+    stripe_subscription_cache_ttl_seconds: int = Field(default=60)
+    stripe_subscription_cache_max_entries: int = Field(default=1000)
+    checkout_session_expiry_margin_seconds: int = Field(default=300)
+
+    #STRIPE WEBHOOK INBOX
+    stripe_event_batch_size: int = Field(default=50)
+    stripe_event_max_attempts: int = Field(default=8)
+    stripe_event_lock_timeout_seconds: int = Field(default=300)
+    stripe_event_dedupe_ttl_seconds: int = Field(default=3 * 24 * 3600)  # Stripe retries for up to 3 days
+    stripe_event_in_flight_ttl_seconds: int = Field(default=60)
+    stripe_event_dedupe_local_size: int = Field(default=10000)
+    stripe_event_retry_delay_seconds: int = Field(default=60)
+    stripe_event_concurrency: int = Field(default=8)
+
+    #STRIPE CUSTOMERS
+    stripe_customer_backfill_batch_size: int = Field(default=500)
+
+    #STRIPE RECONCILIATION
+    stripe_reconcile_batch_size: int = Field(default=100)
+
+    #SUBSCRIPTION EXPIRY
+    subscription_expiry_batch_size: int = Field(default=500)
+    # Stripe charges renewals about an hour after the period ends; don't flip those to EXPIRED in between
+    subscription_expiry_grace_seconds: int = Field(default=3 * 3600)
+
+    #SUBSCRIPTION EMAILS
+    # an upgrade's cancel, create and invoice events land within seconds; they go out as one email
+    subscription_email_coalesce_seconds: int = Field(default=15)
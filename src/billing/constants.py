@@ -0,0 +1,9 @@
+from enum import Enum
+
+
+class SubscriptionEmail(str, Enum):
+    """Which email `send_subscription_emails_task` sends for a subscription."""
+    CREATED = "created"
+    RENEWED = "renewed"
+    CANCELED = "canceled"
+    PAYMENT_FAILED = "payment_failed"
@@ -1,12 +1,14 @@
 from typing import Annotated, Tuple
 from fastapi import Depends, HTTPException, status
-from src.billing.repository import PlanRepository, SubscriptionRepoistory, PaymentRepository
+from src.billing.repository import PlanRepository, SubscriptionRepoistory, PaymentRepository, StripeEventRepository
 from src.database import db_dependency
 from typing import Tuple
 from src.auth.models import User
-from src.billing.models import Subscription, Plan, PlanTier
+from src.billing.models import PlanTier
+from src.billing.cache import Entitlement, CachedPlan
 from src.auth_bearer import user_dependency
-from src.billing.service import PlanService, SubscriptionService, PaymentService
+from src.billing.service import PlanService, SubscriptionService, PaymentService, StripeEventService
+from src.auth.dependencies import repo_dependency
 
 
 def get_plan_repo(db: db_dependency) -> PlanRepository:
@@ -46,14 +48,28 @@ subscription_dependency = Annotated[SubscriptionRepoistory, Depends(get_subscrip
 
 
 def get_subscription_service(subscription_dep: subscription_dependency, plan_dep: plan_dependency,
-                payment_dep: payment_dependency, user_dep: user_dependency) -> SubscriptionService:
-    return SubscriptionService(subscription_dep, plan_dep, user_dep, payment_dep)
+                payment_dep: payment_dependency, user_repo: repo_dependency) -> SubscriptionService:
+    return SubscriptionService(subscription_dep, plan_dep, user_repo, payment_dep)
 
 
 SubscriptionServiceDep = Annotated[SubscriptionService, Depends(get_subscription_service)]
 
 
 
+def get_stripe_event_repo(db: db_dependency) -> StripeEventRepository:
+    return StripeEventRepository(db)
+
+stripe_event_dependency = Annotated[StripeEventRepository, Depends(get_stripe_event_repo)]
+
+
+def get_stripe_event_service(stripe_event_dep: stripe_event_dependency) -> StripeEventService:
+    return StripeEventService(stripe_event_dep)
+
+
+StripeEventServiceDep = Annotated[StripeEventService, Depends(get_stripe_event_service)]
+
+
+
 
 
 
@@ -63,17 +79,17 @@ def require_plan(min_plan: PlanTier):
         user: user_dependency,
         sub_repo: subscription_dependency,
         plan_repo: plan_dependency,
-    ) -> Tuple["User", "Subscription", "Plan"]:  # adjust types/imports as needed
-        # 1) get active subscription for user
-        subscription = await sub_repo.get_subscription_with_access(user.id)
-        if not subscription:
+    ) -> Tuple["User", "Entitlement", "CachedPlan"]:
+        # 1) get the user's entitlement (cached until the paid period ends)
+        entitlement = await sub_repo.get_entitlement(user.id)
+        if not entitlement:
             raise HTTPException(
                 status_code=status.HTTP_403_FORBIDDEN,
                 detail="You need an active subscription to access this resource.",
             )
 
-        # 2) get the plan for that subscription
-        plan = await plan_repo.get_by_id(subscription.plan_id)
+        # 2) get the plan for that subscription (served by the plan catalog)
+        plan = await plan_repo.get_by_id(entitlement.plan_id)
         if not plan:
             raise HTTPException(
                 status_code=status.HTTP_403_FORBIDDEN,
@@ -81,19 +97,13 @@ def require_plan(min_plan: PlanTier):
             )
 
         # 3) check the tier (FREE < PRO < VIP)
-        if plan.tier < min_plan:
+        if entitlement.tier < min_plan:
             # e.g. endpoint requires PRO, user has FREE
             raise HTTPException(
                 status_code=status.HTTP_403_FORBIDDEN,
                 detail=f"This action requires {min_plan.name} plan or higher.",
             )
 
-        return user, subscription, plan
+        return user, entitlement, plan
 
     return _dep
-
-
-
-
-
-
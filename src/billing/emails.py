@@ -1,7 +1,5 @@
-from datetime import datetime
-from fastapi_mail import FastMail, MessageSchema, MessageType
-from src.utils import conf
-from src.config import settings
+from fastapi_mail import MessageSchema, MessageType
+from src.mailer import get_mailer
 import logging
 
 logger = logging.getLogger(__name__)
@@ -16,17 +14,11 @@ class Emails:
                 "plan": subscription["plan"]["name"], "start_date": subscription["start_date"],
                 "price": subscription["price"],
                 "end_date": subscription["end_date"] if subscription["end_date"] else "N/A", 
-                "user_name": subscription["user"]["username"], 
-                "dashboard_url": settings.app_url,
-                "app_name": settings.app_name, "expires_in": settings.validation_token_expire,
-                "app_url": settings.app_url,
-                "support_email": "support@fast_api.com", "company_address": "1234 Street, City, Country",
-                "year": datetime.now().year
+                "user_name": subscription["user"]["username"],
                 },
             subtype=MessageType.html
         )
-        fm = FastMail(conf)
-        await fm.send_message(message, template_name="subscribe_email.html")
+        await get_mailer().send_message(message, template_name="subscribe_email.html")
 
 
     @staticmethod
@@ -48,22 +40,13 @@ class Emails:
 
                 "user_name": subscription["user"]["username"],
 
-                "dashboard_url": settings.app_url,
-                "app_name": settings.app_name,
-                "app_url": settings.app_url,
-
-                "support_email": "support@fast_api.com",
-                "company_address": "1234 Street, City, Country",
-                "year": datetime.now().year,
-
                 # Used in header & title: "Subscription {{email_type}}"
                 "email_type": email_type,
             },
             subtype=MessageType.html,
         )
 
-        fm = FastMail(conf)
-        await fm.send_message(message, template_name="update_subscribe_email.html")
+        await get_mailer().send_message(message, template_name="update_subscribe_email.html")
 
 
     @staticmethod
@@ -75,17 +58,11 @@ class Emails:
                 "plan": subscription["plan"]["name"], "start_date": subscription["start_date"],
                 "price": subscription["price"],
                 "end_date": subscription["end_date"] if subscription["end_date"] else "N/A", 
-                "user_name": subscription["user"]["username"], 
-                "dashboard_url": settings.app_url,
-                "app_name": settings.app_name, "expires_in": settings.validation_token_expire,
-                "app_url": settings.app_url,
-                "support_email": "support@fast_api.com", "company_address": "1234 Street, City, Country",
-                "year": datetime.now().year
+                "user_name": subscription["user"]["username"],
                 },
             subtype=MessageType.html
         )
-        fm = FastMail(conf)
-        await fm.send_message(message, template_name="delete_subscripe.html")
+        await get_mailer().send_message(message, template_name="delete_subscripe.html")
 
 
 
@@ -98,14 +75,31 @@ class Emails:
                 "plan": subscription["plan"]["name"], "start_date": subscription["start_date"],
                 "price": subscription["price"],
                 "end_date": subscription["end_date"] if subscription["end_date"] else "N/A", 
-                "user_name": subscription["user"]["username"], 
-                "dashboard_url": settings.app_url,
-                "app_name": settings.app_name, "expires_in": settings.validation_token_expire,
-                "app_url": settings.app_url,
-                "support_email": "support@fast_api.com", "company_address": "1234 Street, City, Country",
-                "year": datetime.now().year
+                "user_name": subscription["user"]["username"],
                 },
             subtype=MessageType.html
         )
-        fm = FastMail(conf)
-        await fm.send_message(message, template_name="payment_failed.html")
+        await get_mailer().send_message(message, template_name="payment_failed.html")
+
+
+
+    @staticmethod
+    async def send_subscription_summary_email(changes: list[dict]):
+        """One email for several changes to a user's subscriptions; `changes` are serialized subscriptions with a `title`."""
+        message = MessageSchema(
+            subject="Subscription Updates",
+            recipients=[changes[0]["user"]["email"]],  # type: ignore
+            template_body={
+                "changes": [
+                    {
+                        "title": change["title"], "plan": change["plan"]["name"], "price": change["price"],
+                        "start_date": change["start_date"], "end_date": change["end_date"] or "N/A",
+                    }
+                    for change in changes
+                ],
+                "user_name": changes[0]["user"]["username"],
+            },
+            subtype=MessageType.html,
+        )
+        await get_mailer().send_message(message, template_name="subscription_summary.html")
+
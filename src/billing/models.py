@@ -1,10 +1,11 @@
 from uuid import uuid4, UUID as PyUUID
 from enum import Enum, IntEnum
+from typing import Any
 from datetime import timezone, datetime
 from src.database import Base
-from sqlalchemy import String, DateTime, ForeignKey, Integer, Enum as SAEnum, Boolean, UniqueConstraint
+from sqlalchemy import String, DateTime, ForeignKey, Integer, BigInteger, Enum as SAEnum, Boolean, UniqueConstraint, Index, Text, text
 from sqlalchemy.orm import Mapped, mapped_column, relationship
-from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy.dialects.postgresql import UUID, JSONB
 
 
 class SubscriptionStatus(str, Enum):
@@ -13,6 +14,7 @@ class SubscriptionStatus(str, Enum):
     PENDING = "pending"
     CANCELED = "canceled"
     PAST_DUE = "past_due"
+    EXPIRED = "expired"
 
 class BillingPeriod(str, Enum):
     MONTHLY = "monthly"
@@ -31,6 +33,13 @@ class PaymentProvider(str, Enum):
     PAYMOB = "paymob"
 
 
+class StripeEventStatus(str, Enum):
+    PENDING = "pending"
+    PROCESSING = "processing"
+    PROCESSED = "processed"
+    FAILED = "failed"
+
+
 class PlanTier(IntEnum):
     FREE = 0
     PRO = 1
@@ -68,7 +77,7 @@ class Subscription(Base):
 
     id: Mapped[PyUUID] = mapped_column(UUID(as_uuid=True), primary_key=True, default= uuid4)
     user_id: Mapped[PyUUID] = mapped_column(UUID(as_uuid=True),
-            ForeignKey("users.id", ondelete="CASCADE"), index=True)
+            ForeignKey("users.id", ondelete="CASCADE"))
     plan_id: Mapped[PyUUID] = mapped_column(UUID(as_uuid=True),
             ForeignKey("plans.id", ondelete="CASCADE"), index=True)
     status: Mapped[SubscriptionStatus] = mapped_column(SAEnum(SubscriptionStatus))
@@ -76,10 +85,19 @@ class Subscription(Base):
     provider_subscription_id: Mapped[str] = mapped_column(String(), nullable=True, unique=True)
     provider_customer_id: Mapped[str] = mapped_column(String(), nullable=True)
     started_at: Mapped[datetime] = mapped_column(DateTime(timezone=True),
-                                    default=lambda: datetime.now(timezone.utc))
+                                    default=lambda: datetime.now(timezone.utc), index=True)
     current_period_end: Mapped[datetime | None] = mapped_column(DateTime(timezone=True), nullable=True)
+    # unlike started_at, which moves to each renewal's period start, this is when the subscription began
+    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True),
+                                    default=lambda: datetime.now(timezone.utc))
     canceled_at: Mapped[datetime | None] = mapped_column(DateTime(timezone=True), nullable=True)
     cancel_at_period_end: Mapped[bool] = mapped_column(Boolean, default=False)
+    # the subscription an upgrade moved the user to; the rollups don't count those cancellations as churn
+    replaced_by_id: Mapped[PyUUID | None] = mapped_column(UUID(as_uuid=True),
+            ForeignKey("subscriptions.id", ondelete="SET NULL"), nullable=True)
+    # lets the daily rollups find what changed since their last run
+    updated_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), index=True,
+                default=lambda: datetime.now(timezone.utc), onupdate=lambda: datetime.now(timezone.utc))
 
 
     user = relationship("User", back_populates="subscriptions")
@@ -87,20 +105,49 @@ class Subscription(Base):
     payments = relationship("Payment", back_populates="subscription")
 
 
+# Serves get_subscription_with_access: newest period first among the statuses that can grant access.
+Index(
+    "ix_subscriptions_user_access",
+    Subscription.user_id,
+    Subscription.current_period_end.desc(),
+    postgresql_where=text("status IN ('ACTIVE', 'CANCELED')"),
+)
+# At most one ACTIVE subscription per user. Canceled rows keep their period end as history,
+# so "canceled but still paid for" can't be part of an index predicate (it depends on now()).
+Index(
+    "uq_subscriptions_user_active",
+    Subscription.user_id,
+    unique=True,
+    postgresql_where=text("status = 'ACTIVE'"),
+)
+# The expiry sweep: lapsed rows in period order among the statuses it moves to EXPIRED.
+Index(
+    "ix_subscriptions_expiry",
+    Subscription.current_period_end,
+    postgresql_where=text("status IN ('ACTIVE', 'CANCELED', 'TRIALING')"),
+)
+# Admin listing of a user's subscriptions; also covers plain user_id lookups.
+Index("ix_subscriptions_user_started", Subscription.user_id, Subscription.started_at)
+# Campaign fan-out walks a plan's subscribers in user id order.
+Index("ix_subscriptions_plan_user", Subscription.plan_id, Subscription.user_id)
+
+
 
 class Payment(Base):
     __tablename__ = "payments"
 
     id: Mapped[PyUUID] = mapped_column(UUID(as_uuid=True), primary_key=True, default= uuid4)
-    user_id: Mapped[PyUUID] = mapped_column(UUID(as_uuid=True), ForeignKey("users.id", ondelete="CASCADE"), index=True)
-    subscription_id: Mapped[PyUUID | None] = mapped_column(UUID(as_uuid=True), ForeignKey("subscriptions.id", ondelete="SET NULL"))
+    user_id: Mapped[PyUUID] = mapped_column(UUID(as_uuid=True), ForeignKey("users.id", ondelete="CASCADE"))
+    subscription_id: Mapped[PyUUID | None] = mapped_column(UUID(as_uuid=True), ForeignKey("subscriptions.id", ondelete="SET NULL"), index=True)
     provider: Mapped[PaymentProvider] = mapped_column(SAEnum(PaymentProvider))
     provider_invoice_id: Mapped[str] = mapped_column(String(), index=True)
     amount_cents: Mapped[int] = mapped_column(Integer())
     currency: Mapped[str] = mapped_column(String(10), default="USD")
     status: Mapped[PaymentStatus] = mapped_column(SAEnum(PaymentStatus))
     created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True),
-                                    default=lambda: datetime.now(timezone.utc))
+                                    default=lambda: datetime.now(timezone.utc), index=True)
+    updated_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), index=True,
+                default=lambda: datetime.now(timezone.utc), onupdate=lambda: datetime.now(timezone.utc))
     
 
 
@@ -113,5 +160,51 @@ class Payment(Base):
     )
 
 
+# /payments/me and the admin user transactions page; also covers plain user_id lookups.
+Index("ix_payments_user_created", Payment.user_id, Payment.created_at)
+
 
 
+class StripeEvent(Base):
+    """Inbox of verified Stripe webhook events, drained by the billing Celery workers."""
+    __tablename__ = "stripe_events"
+
+    id: Mapped[PyUUID] = mapped_column(UUID(as_uuid=True), primary_key=True, default= uuid4)
+    stripe_event_id: Mapped[str] = mapped_column(String(), unique=True, nullable=False)
+    event_type: Mapped[str] = mapped_column(String(100), nullable=False)
+    ordering_key: Mapped[str | None] = mapped_column(String(), nullable=True)
+    payload: Mapped[dict[str, Any]] = mapped_column(JSONB, nullable=False)
+    status: Mapped[StripeEventStatus] = mapped_column(SAEnum(StripeEventStatus), nullable=False,
+                                    default=StripeEventStatus.PENDING)
+    attempts: Mapped[int] = mapped_column(Integer(), nullable=False, default=0)
+    last_error: Mapped[str | None] = mapped_column(Text(), nullable=True)
+    locked_at: Mapped[datetime | None] = mapped_column(DateTime(timezone=True), nullable=True)
+    received_at: Mapped[datetime] = mapped_column(DateTime(timezone=True),
+                                    default=lambda: datetime.now(timezone.utc))
+    processed_at: Mapped[datetime | None] = mapped_column(DateTime(timezone=True), nullable=True)
+
+
+# Workers claim the oldest unfinished events; processed rows stay out of the index.
+Index(
+    "ix_stripe_events_unprocessed",
+    StripeEvent.received_at,
+    postgresql_where=text("status <> 'PROCESSED'"),
+)
+# Claiming checks for earlier unfinished events of the same subscription.
+Index(
+    "ix_stripe_events_ordering_unprocessed",
+    StripeEvent.ordering_key,
+    StripeEvent.received_at,
+    postgresql_where=text("status <> 'PROCESSED'"),
+)
+
+
+
+class SyncCursor(Base):
+    """High-water mark of an incremental pull from Stripe: the newest `created` timestamp already applied."""
+    __tablename__ = "sync_cursors"
+
+    name: Mapped[str] = mapped_column(String(100), primary_key=True)
+    position: Mapped[int] = mapped_column(BigInteger(), nullable=False, default=0)
+    updated_at: Mapped[datetime] = mapped_column(DateTime(timezone=True),
+                default=lambda: datetime.now(timezone.utc), onupdate=lambda: datetime.now(timezone.utc))
@@ -1,10 +1,19 @@
 from uuid import UUID
 from typing import List, Optional
 from datetime import datetime, timedelta, timezone
-from sqlalchemy import select
-from sqlalchemy.orm import selectinload
+from sqlalchemy import select, update, or_, and_, func, bindparam, literal_column, Boolean
+from sqlalchemy.orm import selectinload, contains_eager, aliased
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from sqlalchemy.ext.asyncio import AsyncSession
-from src.billing.models import Plan, Subscription, SubscriptionStatus, BillingPeriod, PaymentStatus, Payment, PaymentProvider
+from src.billing.models import (Plan, Subscription, SubscriptionStatus, BillingPeriod, PaymentStatus, Payment,
+    PaymentProvider, StripeEvent, StripeEventStatus, SyncCursor)
+from src.billing.cache import plan_catalog, CachedPlan, entitlement_cache, Entitlement
+from src.repository import DashboardCounterRepository
+
+
+# RETURNING this on an upsert tells inserted rows (true) from updated ones: only a row the
+# statement inserted has no deleting/locking transaction id yet
+_INSERTED = literal_column("xmax = 0", Boolean)
 
 
 class PlanRepository:
@@ -12,26 +21,34 @@ class PlanRepository:
         self.db = db
 
 
-    async def list_plans(self, active_only: bool = True) -> List[Plan]:
-        stmt = select(Plan)
-        if active_only:
-            stmt = stmt.where(Plan.is_active.is_(True))
-        result = await self.db.execute(stmt.order_by(Plan.price_cents))
-        return list(result.scalars().all())
+    async def _ensure_catalog(self) -> None:
+        if plan_catalog.is_fresh:
+            return
+        version = plan_catalog.version
+        result = await self.db.execute(select(Plan))
+        plan_catalog.load(result.scalars().all(), version)
+
+
+    async def list_plans(self, active_only: bool = True) -> List[CachedPlan]:
+        await self._ensure_catalog()
+        return plan_catalog.list_plans(active_only)
     
 
-    async def get_by_id(self, plan_id: UUID) -> Optional[Plan]:
+    async def get_by_id(self, plan_id: UUID, *, cached: bool = True) -> Optional[Plan | CachedPlan]:
+        """Use cached=False when the plan is going to be modified."""
+        if cached:
+            await self._ensure_catalog()
+            return plan_catalog.get_by_id(plan_id)
+
         result = await self.db.execute(
             select(Plan).where(Plan.id == plan_id)
         )
         return result.scalar_one_or_none()
     
 
-    async def get_by_code(self, code: str) -> Optional[Plan]:
-        result = await self.db.execute(
-            select(Plan).where(Plan.code == code, Plan.is_active.is_(True))
-        )
-        return result.scalar_one_or_none()
+    async def get_by_code(self, code: str) -> Optional[CachedPlan]:
+        await self._ensure_catalog()
+        return plan_catalog.get_by_code(code)
     
 
     async def create(self, data: dict) -> Plan:
@@ -57,6 +74,10 @@ class PlanRepository:
     
 
 
+# statuses whose period ending means the subscription is over; matches ix_subscriptions_expiry
+EXPIRABLE_STATUSES = (SubscriptionStatus.ACTIVE, SubscriptionStatus.CANCELED, SubscriptionStatus.TRIALING)
+
+
 class SubscriptionRepoistory:
     def __init__(self, db: AsyncSession) -> None:
         self.db = db
@@ -95,6 +116,8 @@ class SubscriptionRepoistory:
 
         result = await self.db.execute(
             select(Subscription)
+            .join(Subscription.plan)
+            .join(Subscription.user)
             .where(
                 Subscription.user_id == user_id,
                 Subscription.current_period_end > now,
@@ -106,21 +129,54 @@ class SubscriptionRepoistory:
                 ),
             )
             .order_by(Subscription.current_period_end.desc())
+            .limit(1)
             .options(
-                selectinload(Subscription.user),
-                selectinload(Subscription.plan),
+                contains_eager(Subscription.user),
+                contains_eager(Subscription.plan),
             )
         )
         return result.scalar_one_or_none()
+
+
+    async def get_entitlement(self, user_id: UUID) -> Entitlement | None:
+        hit, entitlement = entitlement_cache.get(user_id)
+        if hit:
+            return entitlement
+
+        version = entitlement_cache.version
+        subscription = await self.get_subscription_with_access(user_id)
+        entitlement = Entitlement.from_subscription(subscription) if subscription else None
+        entitlement_cache.set(user_id, entitlement, version)
+        return entitlement
     
 
+    async def _cancel_other_active(self, user_id: UUID, keep_id: UUID | None = None) -> None:
+        """
+        uq_subscriptions_user_active allows one ACTIVE row per user: cancels the others, lapsed
+        ones the expiry sweep hasn't reached included, before a row becomes ACTIVE. With `keep_id`
+        they are recorded as replaced by that row.
+        """
+        query = update(Subscription).where(
+            Subscription.user_id == user_id,
+            Subscription.status == SubscriptionStatus.ACTIVE,
+        )
+        if keep_id is not None:
+            query = query.where(Subscription.id != keep_id)
+        await self.db.execute(
+            query.values(status=SubscriptionStatus.CANCELED, canceled_at=datetime.now(timezone.utc),
+                         replaced_by_id=keep_id)
+        )
+
+
     async def create_subscription(self, user_id: UUID, plan_id: UUID, provider: str, 
             provider_subscription_id: str, provider_customer_id: str, status: SubscriptionStatus) -> Subscription:
+        now = datetime.now(timezone.utc)
         old_sub = await self.get_subscription_with_access(user_id)
         if old_sub:
             old_sub.status = SubscriptionStatus.CANCELED
-
-        now = datetime.now(timezone.utc)
+            old_sub.canceled_at = old_sub.canceled_at or now
+        if status == SubscriptionStatus.ACTIVE:
+            await self._cancel_other_active(user_id)
 
         sub = Subscription(
             user_id=user_id,
@@ -136,6 +192,11 @@ class SubscriptionRepoistory:
         )
 
         self.db.add(sub)
+        if old_sub:
+            # the new row has to exist before the old one can point at it
+            await self.db.flush()
+            old_sub.replaced_by_id = sub.id
+        await DashboardCounterRepository(self.db).add(subscriptions=1)
         await self.db.commit()
         await self.db.refresh(sub)
 
@@ -159,7 +220,7 @@ class SubscriptionRepoistory:
 
     async def cancel_immediately(self, subscription: Subscription) -> Subscription:
         subscription.status = SubscriptionStatus.CANCELED
-        subscription.current_period_end = datetime.now(timezone.utc)
+        subscription.canceled_at = subscription.current_period_end = datetime.now(timezone.utc)
         await self.db.commit()
         await self.db.refresh(subscription)
         return subscription
@@ -182,6 +243,7 @@ class SubscriptionRepoistory:
         if not sub:
             return None
 
+        await self._cancel_other_active(sub.user_id, keep_id=sub.id)
         sub.status = SubscriptionStatus.ACTIVE  
         sub.started_at = current_period_start
         sub.current_period_end = current_period_end
@@ -205,6 +267,7 @@ class SubscriptionRepoistory:
         provider_subscription_id: str,
         canceled_at: datetime,
         current_period_end: datetime | None = None,
+        replaced_by_id: UUID | None = None,
     ) -> Subscription | None:
         result = await self.db.execute(
             select(Subscription).where(
@@ -219,6 +282,8 @@ class SubscriptionRepoistory:
 
         sub.status = SubscriptionStatus.CANCELED
         sub.canceled_at = canceled_at
+        if replaced_by_id is not None:
+            sub.replaced_by_id = replaced_by_id
 
         
         if current_period_end is not None:
@@ -269,6 +334,125 @@ class SubscriptionRepoistory:
         
 
 
+    async def get_many_with_user_and_plan(self, subscription_ids: list[UUID]) -> dict[UUID, Subscription]:
+        """Subscriptions with the user and plan their emails render from, in one joined query."""
+        if not subscription_ids:
+            return {}
+        result = await self.db.execute(
+            select(Subscription)
+            .join(Subscription.plan)
+            .join(Subscription.user)
+            .where(Subscription.id.in_(subscription_ids))
+            .options(
+                contains_eager(Subscription.user),
+                contains_eager(Subscription.plan),
+            )
+        )
+        return {sub.id: sub for sub in result.scalars().all()}
+
+
+    async def get_many_by_provider_subscription_ids(
+        self, provider: PaymentProvider, provider_subscription_ids: list[str]
+    ) -> dict[str, Subscription]:
+        if not provider_subscription_ids:
+            return {}
+        result = await self.db.execute(
+            select(Subscription).where(
+                Subscription.provider == provider,
+                Subscription.provider_subscription_id.in_(provider_subscription_ids),
+            )
+        )
+        return {sub.provider_subscription_id: sub for sub in result.scalars().all()}
+
+
+    async def upsert_provider_subscriptions(self, rows: list[dict]) -> None:
+        """
+        Inserts or overwrites subscriptions by provider_subscription_id in one statement.
+        Like create_subscription, a row becoming ACTIVE cancels the user's other ACTIVE subscription first.
+        """
+        if not rows:
+            return
+        now = datetime.now(timezone.utc)
+        activating = [row for row in rows if row["status"] == SubscriptionStatus.ACTIVE]
+        if activating:
+            await self.db.execute(
+                update(Subscription)
+                .where(
+                    Subscription.status == SubscriptionStatus.ACTIVE,
+                    Subscription.user_id.in_([row["user_id"] for row in activating]),
+                    or_(
+                        Subscription.provider_subscription_id.is_(None),
+                        Subscription.provider_subscription_id.not_in([row["provider_subscription_id"] for row in activating]),
+                    ),
+                )
+                .values(status=SubscriptionStatus.CANCELED, canceled_at=now)
+            )
+
+        stmt = pg_insert(Subscription).values(rows)
+        result = await self.db.execute(
+            stmt.on_conflict_do_update(
+                index_elements=[Subscription.provider_subscription_id],
+                set_={
+                    "status": stmt.excluded.status,
+                    "plan_id": stmt.excluded.plan_id,
+                    "provider_customer_id": stmt.excluded.provider_customer_id,
+                    "started_at": stmt.excluded.started_at,
+                    "current_period_end": stmt.excluded.current_period_end,
+                    "canceled_at": stmt.excluded.canceled_at,
+                    "cancel_at_period_end": stmt.excluded.cancel_at_period_end,
+                    "updated_at": now,
+                },
+            ).returning(_INSERTED)
+        )
+        await DashboardCounterRepository(self.db).add(subscriptions=sum(result.scalars().all()))
+        await self.db.commit()
+
+
+
+    async def expire_lapsed(self, lapsed_before: datetime, limit: int) -> list[UUID]:
+        """
+        Moves up to `limit` subscriptions whose period ended before `lapsed_before` to EXPIRED in one
+        statement and returns their user ids. Rows locked by a concurrent sweep are skipped, not waited on.
+        """
+        lapsed = (
+            select(Subscription.id)
+            .where(
+                Subscription.status.in_(EXPIRABLE_STATUSES),
+                Subscription.current_period_end < lapsed_before,
+            )
+            .order_by(Subscription.current_period_end)
+            .limit(limit)
+            .with_for_update(skip_locked=True)
+            .cte("lapsed")
+        )
+        result = await self.db.execute(
+            update(Subscription)
+            .where(Subscription.id.in_(select(lapsed.c.id)))
+            .values(status=SubscriptionStatus.EXPIRED)
+            .returning(Subscription.user_id)
+            .execution_options(synchronize_session=False)
+        )
+        user_ids = list(result.scalars().all())
+        await self.db.commit()
+        return user_ids
+
+
+    async def extend_periods(self, periods: list[dict]) -> None:
+        """Moves each subscription's period forward to a paid one; `periods` rows are {id, start, end}."""
+        if not periods:
+            return
+        # the Core table, not the entity: an ORM bulk UPDATE only matches by primary key
+        table = Subscription.__table__
+        await self.db.execute(
+            update(table)
+            .where(table.c.id == bindparam("sub_id"), table.c.current_period_end < bindparam("end"))
+            .values(started_at=bindparam("start"), current_period_end=bindparam("end")),
+            [{"sub_id": row["id"], "start": row["start"], "end": row["end"]} for row in periods],
+        )
+        await self.db.commit()
+
+
+
 class PaymentRepository:
     def __init__(self, db: AsyncSession) -> None:
         self.db = db
@@ -285,21 +469,66 @@ class PaymentRepository:
         provider: PaymentProvider = PaymentProvider.STRIPE,
     ) -> Payment:
         
-        payment = Payment(
-            user_id=user_id,
-            subscription_id=subscription_id,
-            provider=provider,
-            provider_invoice_id=provider_invoice_id,
-            amount_cents=amount_cents,
-            currency=currency,
-            status=status,
+        # an invoice is recorded once, replays of the same invoice return the stored payment
+        inserted = await self.db.execute(
+            pg_insert(Payment)
+            .values(
+                user_id=user_id,
+                subscription_id=subscription_id,
+                provider=provider,
+                provider_invoice_id=provider_invoice_id,
+                amount_cents=amount_cents,
+                currency=currency,
+                status=status,
+            )
+            .on_conflict_do_nothing(constraint="uq_provider_invoice_id")
+            .returning(Payment.id)
         )
-        self.db.add(payment)
+        await DashboardCounterRepository(self.db).add(payments=len(inserted.all()))
         await self.db.commit()
-        await self.db.refresh(payment)
-        return payment
+        result = await self.db.execute(
+            select(Payment).where(
+                Payment.provider == provider,
+                Payment.provider_invoice_id == provider_invoice_id,
+            )
+        )
+        return result.scalar_one()
     
 
+    async def get_many_by_provider_invoice_ids(
+        self, provider: PaymentProvider, provider_invoice_ids: list[str]
+    ) -> dict[str, Payment]:
+        if not provider_invoice_ids:
+            return {}
+        result = await self.db.execute(
+            select(Payment).where(
+                Payment.provider == provider,
+                Payment.provider_invoice_id.in_(provider_invoice_ids),
+            )
+        )
+        return {payment.provider_invoice_id: payment for payment in result.scalars().all()}
+
+
+    async def upsert_payments(self, rows: list[dict]) -> None:
+        if not rows:
+            return
+        stmt = pg_insert(Payment).values(rows)
+        result = await self.db.execute(
+            stmt.on_conflict_do_update(
+                constraint="uq_provider_invoice_id",
+                set_={
+                    "subscription_id": stmt.excluded.subscription_id,
+                    "amount_cents": stmt.excluded.amount_cents,
+                    "currency": stmt.excluded.currency,
+                    "status": stmt.excluded.status,
+                    "updated_at": datetime.now(timezone.utc),
+                },
+            ).returning(_INSERTED)
+        )
+        await DashboardCounterRepository(self.db).add(payments=sum(result.scalars().all()))
+        await self.db.commit()
+
+
     async def get_my_payments(self, user_id: UUID) -> list[Payment]:
         stmt = (
             select(Payment)
@@ -308,4 +537,131 @@ class PaymentRepository:
         )
 
         result = await self.db.execute(stmt)
-        return list(result.scalars().all())
\ No newline at end of file
+        return list(result.scalars().all())
+
+
+
+class StripeEventRepository:
+    def __init__(self, db: AsyncSession) -> None:
+        self.db = db
+
+
+    async def ingest(self, stripe_event_id: str, event_type: str, payload: dict, ordering_key: str | None = None) -> bool:
+        """Stores a webhook event once; returns False when Stripe redelivers one we already have."""
+        result = await self.db.execute(
+            pg_insert(StripeEvent)
+            .values(stripe_event_id=stripe_event_id, event_type=event_type, payload=payload, ordering_key=ordering_key)
+            .on_conflict_do_nothing(index_elements=[StripeEvent.stripe_event_id])
+            .returning(StripeEvent.id)
+        )
+        inserted = result.scalar_one_or_none() is not None
+        await self.db.commit()
+        return inserted
+
+
+    async def claim_batch(self, limit: int, max_attempts: int, lock_timeout_seconds: int,
+            retry_delay_seconds: int) -> List[StripeEvent]:
+        """
+        Marks up to `limit` events PROCESSING for this worker. SKIP LOCKED lets several
+        workers claim at once without overlapping; PROCESSING rows whose worker died are
+        picked up again once their lock is older than `lock_timeout_seconds`.
+
+        Events of one subscription (same ordering_key) go strictly one at a time in arrival
+        order: an event is only claimable while no earlier event of its key is unfinished
+        and none is being processed, so a batch holds at most one event per key.
+        """
+        now = datetime.now(timezone.utc)
+        stale_before = now - timedelta(seconds=lock_timeout_seconds)
+        other = aliased(StripeEvent)
+        blocked = (
+            select(other.id)
+            .where(
+                other.ordering_key == StripeEvent.ordering_key,
+                other.id != StripeEvent.id,
+                or_(
+                    and_(
+                        other.received_at < StripeEvent.received_at,
+                        other.status != StripeEventStatus.PROCESSED,
+                        other.attempts < max_attempts,
+                    ),
+                    and_(other.status == StripeEventStatus.PROCESSING, other.locked_at >= stale_before),
+                ),
+            )
+            .exists()
+        )
+        claimable = (
+            select(StripeEvent.id)
+            .where(
+                StripeEvent.attempts < max_attempts,
+                or_(
+                    StripeEvent.status == StripeEventStatus.PENDING,
+                    and_(
+                        StripeEvent.status == StripeEventStatus.FAILED,
+                        StripeEvent.locked_at < now - timedelta(seconds=retry_delay_seconds),
+                    ),
+                    and_(StripeEvent.status == StripeEventStatus.PROCESSING, StripeEvent.locked_at < stale_before),
+                ),
+                ~blocked,
+            )
+            .order_by(StripeEvent.received_at)
+            .limit(limit)
+            .with_for_update(skip_locked=True)
+        )
+        result = await self.db.execute(
+            update(StripeEvent)
+            .where(StripeEvent.id.in_(claimable.scalar_subquery()))
+            .values(status=StripeEventStatus.PROCESSING, locked_at=now, attempts=StripeEvent.attempts + 1)
+            .returning(StripeEvent)
+            .execution_options(synchronize_session=False)
+        )
+        events = sorted(result.scalars().all(), key=lambda event: event.received_at)
+        await self.db.commit()
+        return events
+
+
+    async def mark_processed(self, event_id: UUID) -> None:
+        await self.db.execute(
+            update(StripeEvent)
+            .where(StripeEvent.id == event_id)
+            .values(
+                status=StripeEventStatus.PROCESSED,
+                processed_at=datetime.now(timezone.utc),
+                locked_at=None,
+                last_error=None,
+            )
+        )
+        await self.db.commit()
+
+
+    async def mark_failed(self, event_id: UUID, error: str) -> None:
+        await self.db.execute(
+            update(StripeEvent)
+            .where(StripeEvent.id == event_id)
+            # locked_at keeps the time of the failed attempt, the retry waits from there
+            .values(status=StripeEventStatus.FAILED, last_error=error)
+        )
+        await self.db.commit()
+
+
+
+class SyncCursorRepository:
+    def __init__(self, db: AsyncSession) -> None:
+        self.db = db
+
+
+    async def get(self, name: str) -> int:
+        result = await self.db.execute(select(SyncCursor.position).where(SyncCursor.name == name))
+        return result.scalar_one_or_none() or 0
+
+
+    async def advance(self, name: str, position: int) -> None:
+        stmt = pg_insert(SyncCursor).values(name=name, position=position, updated_at=datetime.now(timezone.utc))
+        await self.db.execute(
+            stmt.on_conflict_do_update(
+                index_elements=[SyncCursor.name],
+                # never move backwards, whatever order two overlapping runs finish in
+                set_={"position": func.greatest(SyncCursor.position, stmt.excluded.position),
+                      "updated_at": stmt.excluded.updated_at},
+            )
+        )
+        await self.db.commit()
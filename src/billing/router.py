@@ -3,7 +3,7 @@ from src.rate_limiter import limiter
 from fastapi import APIRouter, status, Request, Header
 from src.billing import schemas
 from src.auth_bearer import  active_user_dep, admin_required
-from src.billing.dependencies import SubscriptionServiceDep, PlanServiceDep, PaymentServiceDep
+from src.billing.dependencies import SubscriptionServiceDep, PlanServiceDep, PaymentServiceDep, StripeEventServiceDep
 
 
 
@@ -72,8 +72,8 @@ async def upgrade_subscription(data: schemas.SubscribeRequest, user: active_user
 
 @router.post("/stripe/webhook")
 @limiter.exempt
-async def stripe_webhook(request: Request, SubscriptionService: SubscriptionServiceDep, stripe_signature: str = Header(..., alias="Stripe-Signature")):
-    await SubscriptionService.stripe_webhook(request, stripe_signature)
+async def stripe_webhook(request: Request, StripeEventService: StripeEventServiceDep, stripe_signature: str = Header(..., alias="Stripe-Signature")):
+    await StripeEventService.receive_webhook(request, stripe_signature)
     return True
 
 
@@ -1,22 +1,31 @@
+import json
+import asyncio
+from collections import Counter
 import stripe
-from uuid import UUID
+from uuid import UUID, uuid4
+from datetime import datetime, timedelta, timezone
 from fastapi import HTTPException, status
 from fastapi.concurrency import run_in_threadpool
 from src.config import settings
 from src.billing import schemas
-from src.billing.models import PaymentProvider
-from src.billing.repository import PlanRepository, SubscriptionRepoistory, PaymentRepository
-from src.billing.tasks import (
-    send_subscription_email_task,
-    send_update_subscription_email_task,
-    send_cancel_subscription_email_task,
-    send_payment_failed_email_task,
+from src.billing.models import PaymentProvider, PaymentStatus, StripeEvent, Subscription, SubscriptionStatus
+from sqlalchemy.orm import sessionmaker
+from src.billing.repository import (
+    PlanRepository, SubscriptionRepoistory, PaymentRepository, StripeEventRepository, SyncCursorRepository,
+)
+from src.billing.tasks import send_subscription_emails_task, process_stripe_events_task
+from src.billing.constants import SubscriptionEmail
+from src.billing.utils import (
+    stripe_event_ordering_key, invoice_subscription_id,
+    timestamp_to_datetime, STRIPE_SUBSCRIPTION_STATUSES,
 )
-from src.billing.utils import serialize_subscription
 from src.billing.stripe_gateway import StripeGateway
+from src.billing.cache import invalidate_plan_catalog, invalidate_entitlement, stripe_event_registry, StripeEventState
 from src.auth.models import User
 from src.auth.repository import UserRepository
 from src.logging import get_logger
+from src.outbox import stage_task, stage_coalesced_task
+from src import metrics
 
 
 
@@ -50,6 +59,7 @@ class PlanService:
                 "stripe_product_id": stripe_plan.stripe_product_id,
                 "stripe_price_id": stripe_plan.stripe_price_id
             })
+            await invalidate_plan_catalog()
             logger.info(
                 f"Plan synced to Stripe plan_id={updated_plan.id}, code={updated_plan.code}, "
                 f"stripe_product_id={updated_plan.stripe_product_id}, stripe_price_id={updated_plan.stripe_price_id}"
@@ -58,6 +68,7 @@ class PlanService:
         logger.warning(
             f"Plan created without Stripe sync plan_id={result.id}, code={result.code}"
         )
+        await invalidate_plan_catalog()
         return result
 
 
@@ -70,19 +81,20 @@ class PlanService:
     
 
     async def update_plan(self, plan_id: UUID, data: schemas.PlanUpdate):
-        plan = await self.plan_repo.get_by_id(plan_id)
+        plan = await self.plan_repo.get_by_id(plan_id, cached=False)
         if not plan: 
             logger.warning(f"Attempt to update non-existing plan plan_id={plan_id}")
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No plan found for this id")
         
         update_data = await StripeGateway.update_plan_in_stripe(plan, data)
         result = await self.plan_repo.update(plan, update_data)    
+        await invalidate_plan_catalog()
         logger.info(f"Plan updated plan_id={result.id}, code={result.code}")
         return result
     
 
     async def soft_delete_plan(self, plan_id: UUID):
-        plan = await self.plan_repo.get_by_id(plan_id)
+        plan = await self.plan_repo.get_by_id(plan_id, cached=False)
         if not plan: 
             logger.warning(f"Attempt to soft delete non-existing plan plan_id={plan_id}")
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No plan found for this id")
@@ -94,6 +106,7 @@ class PlanService:
        
         await StripeGateway.soft_delete_plan_in_stripe(plan)
         await self.plan_repo.soft_delete(plan)
+        await invalidate_plan_catalog()
         logger.info(
             f"Plan soft deleted plan_id={plan.id}, code={plan.code}, "
             f"stripe_product_id={plan.stripe_product_id}, stripe_price_id={plan.stripe_price_id}"
@@ -186,6 +199,7 @@ class SubscriptionService:
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail="Subscription not found in our database.",
             )
+        await invalidate_entitlement(user_id)
         
         logger.info(
             f"Subscription marked to cancel at period end user_id={str(user_id)}, "
@@ -233,19 +247,14 @@ class SubscriptionService:
         return checkout_url
 
 
-    async def stripe_webhook(self, request, stripe_signature):
-        payload = await request.body()
-        try:
-            event = await run_in_threadpool(
-                stripe.Webhook.construct_event,
-                payload.decode("utf-8"),
-                stripe_signature,
-                settings.stripe_webhook_secret
-            )
-        except Exception as e:
-            logger.error(f"Stripe webhook signature verification failed error={str(e)}")
-            return {"error": str(e)}
-        
+    def _stage_email(self, sub: Subscription, email: SubscriptionEmail) -> None:
+        # only the id travels: the worker loads the user and plan for the whole batch at once.
+        # Keyed by user, so the events of one upgrade reach them as a single email.
+        stage_coalesced_task(self.subscription_repo.db, send_subscription_emails_task, str(sub.user_id),
+                             str(sub.id), email.value)
+
+
+    async def handle_stripe_event(self, event: dict):
         event_type = event["type"]
         data_object = event["data"]["object"]
         logger.info(f"Processing Stripe webhook event_type={event_type}")
@@ -277,13 +286,13 @@ class SubscriptionService:
                     f"Sending update subscription email subscription_id={sub.id}, " #type:ignore
                     f"user_id={str(sub.user_id)}" #type:ignore
                 )
-                send_update_subscription_email_task.delay(serialize_subscription(sub)) #type: ignore
+                self._stage_email(sub, SubscriptionEmail.RENEWED) #type: ignore
             elif billing_reason == "subscription_create":
                 logger.info(
                     f"Sending new subscription email subscription_id={sub.id}, " #type:ignore
                     f"user_id={str(sub.user_id)}" #type:ignore
                 )
-                send_subscription_email_task.delay(serialize_subscription(sub)) #type: ignore
+                self._stage_email(sub, SubscriptionEmail.CREATED) #type: ignore
 
 
         if event_type == "customer.subscription.deleted":
@@ -297,7 +306,7 @@ class SubscriptionService:
                     f"Sending cancel subscription email subscription_id={sub.id}, "
                     f"user_id={str(sub.user_id)}"
                 )
-                send_cancel_subscription_email_task.delay(serialize_subscription(sub))
+                self._stage_email(sub, SubscriptionEmail.CANCELED)
             except Exception as exc:
                 logger.exception(
                     f"Failed to enqueue cancel subscription email subscription_id={sub.id}, "
@@ -315,7 +324,349 @@ class SubscriptionService:
                     f"Sending payment failed email subscription_id={sub.id}, "
                     f"user_id={str(sub.user_id)}"
                 )
-                send_payment_failed_email_task.delay(serialize_subscription(sub))
+                self._stage_email(sub, SubscriptionEmail.PAYMENT_FAILED)
+
+
+
+class StripeEventService:
+    def __init__(self, event_repo: StripeEventRepository) -> None:
+        self.event_repo = event_repo
+
+
+    async def receive_webhook(self, request, stripe_signature):
+        """Verifies and stores the event, leaving the actual handling to the billing workers."""
+        payload = await request.body()
+        try:
+            await run_in_threadpool(
+                stripe.Webhook.construct_event,
+                payload.decode("utf-8"),
+                stripe_signature,
+                settings.stripe_webhook_secret
+            )
+        except Exception as e:
+            logger.error(f"Stripe webhook signature verification failed error={str(e)}")
+            return {"error": str(e)}
+
+        event = json.loads(payload)
+        stripe_event_id, event_type = event["id"], event["type"]
+
+        state = await stripe_event_registry.begin(stripe_event_id)
+        if state == StripeEventState.DONE:
+            await metrics.incr("stripe_events.duplicates_suppressed")
+            logger.info(f"Duplicate Stripe webhook ignored stripe_event_id={stripe_event_id}, event_type={event_type}")
+            return
+        if state == StripeEventState.IN_FLIGHT:
+            # not acknowledged: if the other delivery fails to store the event, Stripe's retry still gets it in
+            await metrics.incr("stripe_events.in_flight_rejected")
+            logger.info(f"Stripe webhook already in flight stripe_event_id={stripe_event_id}, event_type={event_type}")
+            raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Event is already being received.")
+
+        # staged first so it commits with the event; on a redelivery it only wakes an idle worker
+        stage_task(self.event_repo.db, process_stripe_events_task)
+        try:
+            inserted = await self.event_repo.ingest(stripe_event_id, event_type, event, stripe_event_ordering_key(event))
+        except Exception:
+            await stripe_event_registry.abort(stripe_event_id)
+            raise
+        await stripe_event_registry.finish(stripe_event_id)
+
+        if not inserted:
+            await metrics.incr("stripe_events.duplicates_suppressed")
+            logger.info(f"Duplicate Stripe webhook ignored stripe_event_id={stripe_event_id}, event_type={event_type}")
+            return
+
+        await metrics.incr("stripe_events.received")
+        logger.info(f"Stripe webhook stored stripe_event_id={stripe_event_id}, event_type={event_type}")
+
+
+    async def claim(self) -> list[StripeEvent]:
+        return await self.event_repo.claim_batch(
+            settings.stripe_event_batch_size,
+            settings.stripe_event_max_attempts,
+            settings.stripe_event_lock_timeout_seconds,
+            settings.stripe_event_retry_delay_seconds,
+        )
+
+
+    async def process_event(self, event: StripeEvent, subscription_service: SubscriptionService) -> None:
+        try:
+            await subscription_service.handle_stripe_event(event.payload)
+        except Exception as e:
+            await self.event_repo.db.rollback()
+            await self.event_repo.mark_failed(event.id, repr(e))
+            await metrics.incr("stripe_events.failed")
+            logger.exception(
+                f"Stripe event processing failed stripe_event_id={event.stripe_event_id}, "
+                f"event_type={event.event_type}, ordering_key={event.ordering_key}, "
+                f"attempts={event.attempts}, error={str(e)}"
+            )
+            return
+        await self.event_repo.mark_processed(event.id)
+        await metrics.incr("stripe_events.processed")
+        logger.info(
+            f"Stripe event processed stripe_event_id={event.stripe_event_id}, "
+            f"event_type={event.event_type}, ordering_key={event.ordering_key}"
+        )
+
+
+
+async def process_stripe_events(session_factory: sessionmaker) -> int:
+    """
+    Claims one batch from the webhook inbox and processes it; returns how many events were claimed.
+    A batch never holds two events of the same subscription, so they run concurrently,
+    each on its own session.
+    """
+    async with session_factory() as db:
+        events = await StripeEventService(StripeEventRepository(db)).claim()
+
+    semaphore = asyncio.Semaphore(settings.stripe_event_concurrency)
+
+    async def _process(event: StripeEvent) -> None:
+        async with semaphore, session_factory() as db:
+            subscription_service = SubscriptionService(
+                SubscriptionRepoistory(db), PlanRepository(db), UserRepository(db), PaymentRepository(db)
+            )
+            await StripeEventService(StripeEventRepository(db)).process_event(event, subscription_service)
+
+    await asyncio.gather(*(_process(event) for event in events))
+    return len(events)
+
+
+
+class StripeReconciliationService:
+    """
+    Catches local state up with Stripe for whatever webhooks never delivered: lists the subscriptions
+    and invoices created since the last run, diffs each page against local rows in one query and
+    writes only what changed in one upsert.
+    """
+    SUBSCRIPTIONS_CURSOR = "stripe_subscriptions"
+    INVOICES_CURSOR = "stripe_invoices"
+
+    def __init__(self, subscription_repo: SubscriptionRepoistory, payment_repo: PaymentRepository,
+                 plan_repo: PlanRepository, user_repo: UserRepository, cursor_repo: SyncCursorRepository) -> None:
+        self.subscription_repo = subscription_repo
+        self.payment_repo = payment_repo
+        self.plan_repo = plan_repo
+        self.user_repo = user_repo
+        self.cursor_repo = cursor_repo
+
+
+    async def reconcile(self) -> dict[str, int]:
+        # subscriptions first: invoices are linked to the local rows they create
+        stats: Counter = Counter()
+        await self._pull(self.SUBSCRIPTIONS_CURSOR, StripeGateway.iter_subscriptions_created_after,
+                         self._apply_subscriptions, stats)
+        await self._pull(self.INVOICES_CURSOR, StripeGateway.iter_invoices_created_after,
+                         self._apply_invoices, stats)
+        for name, count in stats.items():
+            await metrics.incr(f"reconcile.{name}", count)
+        logger.info(f"Stripe reconciliation finished {', '.join(f'{k}={v}' for k, v in sorted(stats.items()))}")
+        return dict(stats)
+
+
+    async def _pull(self, cursor_name: str, iterate, apply, stats: Counter) -> None:
+        cursor = await self.cursor_repo.get(cursor_name)
+        newest = cursor
+        batch = []
+        async for stripe_object in iterate(cursor):
+            batch.append(stripe_object)
+            newest = max(newest, stripe_object.get("created") or 0)
+            if len(batch) >= settings.stripe_reconcile_batch_size:
+                await apply(batch, stats)
+                batch = []
+        if batch:
+            await apply(batch, stats)
+        if newest > cursor:
+            # `created` has one-second resolution and a list can miss objects committed in the
+            # second it started: step back a second so the next run lists that second again
+            await self.cursor_repo.advance(cursor_name, newest - 1)
+
+
+    async def _apply_subscriptions(self, batch: list, stats: Counter) -> None:
+        local = await self.subscription_repo.get_many_by_provider_subscription_ids(
+            PaymentProvider.STRIPE, [stripe_subscription["id"] for stripe_subscription in batch]
+        )
+        plans = {plan.id: plan for plan in await self.plan_repo.list_plans(active_only=False)}
+        plan_ids_by_price = {plan.stripe_price_id: plan.id for plan in plans.values() if plan.stripe_price_id}
+        user_ids_by_customer = await self.user_repo.get_ids_by_stripe_customer_ids(
+            [stripe_subscription.get("customer") for stripe_subscription in batch if stripe_subscription.get("customer")]
+        )
+        metadata_user_ids = [
+            user_id for stripe_subscription in batch
+            if (user_id := _parse_uuid((stripe_subscription.get("metadata") or {}).get("user_id")))
+        ]
+        known_user_ids = await self.user_repo.get_existing_ids(metadata_user_ids)
+
+        rows = []
+        active_users = set()
+        # Stripe lists newest first: if a user has several live subscriptions the newest one stays ACTIVE
+        for stripe_subscription in batch:
+            existing = local.get(stripe_subscription["id"])
+            row = self._subscription_row(stripe_subscription, existing, plans, plan_ids_by_price,
+                                         user_ids_by_customer, known_user_ids)
+            if row is None:
+                stats["subscriptions.skipped"] += 1
+                continue
+            if row["status"] == SubscriptionStatus.ACTIVE:
+                if row["user_id"] in active_users:
+                    row["status"] = SubscriptionStatus.CANCELED
+                active_users.add(row["user_id"])
+            if existing is not None and all(getattr(existing, field) == row[field] for field in _SYNCED_SUBSCRIPTION_FIELDS):
+                stats["subscriptions.unchanged"] += 1
+                continue
+            stats["subscriptions.created" if existing is None else "subscriptions.updated"] += 1
+            rows.append(row)
+
+        await self.subscription_repo.upsert_provider_subscriptions(rows)
+        for user_id in {row["user_id"] for row in rows}:
+            await invalidate_entitlement(user_id)
+
+
+    @staticmethod
+    def _subscription_row(stripe_subscription, existing, plans, plan_ids_by_price,
+                          user_ids_by_customer, known_user_ids) -> dict | None:
+        status = STRIPE_SUBSCRIPTION_STATUSES.get(stripe_subscription.get("status"))
+        items = (stripe_subscription.get("items") or {}).get("data") or []
+        item = items[0] if items else {}
+        metadata = stripe_subscription.get("metadata") or {}
+
+        if existing is not None:
+            user_id = existing.user_id
+        else:
+            user_id = _parse_uuid(metadata.get("user_id"))
+            if user_id not in known_user_ids:
+                user_id = user_ids_by_customer.get(stripe_subscription.get("customer"))
+        plan_id = _parse_uuid(metadata.get("plan_id"))
+        if plan_id not in plans:
+            plan_id = plan_ids_by_price.get((item.get("price") or {}).get("id"))
+
+        if status is None or user_id is None or plan_id is None:
+            logger.warning(
+                f"Stripe reconciliation skipped subscription stripe_subscription_id={stripe_subscription.get('id')}, "
+                f"status={stripe_subscription.get('status')}, user_id={user_id}, plan_id={plan_id}"
+            )
+            return None
+
+        current_period_end = timestamp_to_datetime(item.get("current_period_end"))
+        if status == SubscriptionStatus.CANCELED:
+            # access ends when Stripe ended the subscription, as handle_subscription_deleted records it
+            current_period_end = timestamp_to_datetime(stripe_subscription.get("ended_at")) or current_period_end
+        return {
+            "id": existing.id if existing is not None else uuid4(),
+            "user_id": user_id,
+            "plan_id": plan_id,
+            "status": status,
+            "provider": PaymentProvider.STRIPE,
+            "provider_subscription_id": stripe_subscription["id"],
+            "provider_customer_id": stripe_subscription.get("customer"),
+            "started_at": timestamp_to_datetime(item.get("current_period_start") or stripe_subscription.get("start_date")),
+            # only written on insert: the upsert leaves an existing row's created_at alone
+            "created_at": existing.created_at if existing is not None else timestamp_to_datetime(
+                stripe_subscription.get("start_date") or stripe_subscription.get("created")
+            ) or datetime.now(timezone.utc),
+            "current_period_end": current_period_end,
+            "canceled_at": timestamp_to_datetime(stripe_subscription.get("canceled_at")),
+            "cancel_at_period_end": bool(stripe_subscription.get("cancel_at_period_end")),
+        }
+
+
+    async def _apply_invoices(self, batch: list, stats: Counter) -> None:
+        # only paid invoices leave a local trace, as with the invoice.payment_succeeded webhook
+        paid = [invoice for invoice in batch if invoice.get("status") == "paid"]
+        stats["payments.ignored"] += len(batch) - len(paid)
+        if not paid:
+            return
+        local = await self.payment_repo.get_many_by_provider_invoice_ids(
+            PaymentProvider.STRIPE, [invoice["id"] for invoice in paid]
+        )
+        subscriptions = await self.subscription_repo.get_many_by_provider_subscription_ids(
+            PaymentProvider.STRIPE, list({sub_id for invoice in paid if (sub_id := invoice_subscription_id(invoice))})
+        )
+
+        rows = []
+        periods = []
+        for invoice in paid:
+            sub = subscriptions.get(invoice_subscription_id(invoice))  # type: ignore
+            if sub is None:
+                stats["payments.skipped"] += 1
+                continue
+            lines = (invoice.get("lines") or {}).get("data") or []
+            period = (lines[0].get("period") or {}) if lines else {}
+            period_end = timestamp_to_datetime(period.get("end"))
+            if sub.status != SubscriptionStatus.CANCELED and period_end and (
+                sub.current_period_end is None or sub.current_period_end < period_end
+            ):
+                periods.append({"id": sub.id, "start": timestamp_to_datetime(period.get("start")), "end": period_end})
+
+            row = {
+                "id": uuid4(),
+                "user_id": sub.user_id,
+                "subscription_id": sub.id,
+                "provider": PaymentProvider.STRIPE,
+                "provider_invoice_id": invoice["id"],
+                "amount_cents": invoice.get("amount_paid") or 0,
+                "currency": (invoice.get("currency") or "usd").upper(),
+                "status": PaymentStatus.SUCCEEDED,
+                "created_at": timestamp_to_datetime(
+                    (invoice.get("status_transitions") or {}).get("paid_at") or invoice.get("created")
+                ),
+            }
+            existing = local.get(invoice["id"])
+            if existing is not None and all(getattr(existing, field) == row[field] for field in _SYNCED_PAYMENT_FIELDS):
+                stats["payments.unchanged"] += 1
+                continue
+            stats["payments.created" if existing is None else "payments.updated"] += 1
+            rows.append(row)
+
+        await self.payment_repo.upsert_payments(rows)
+        # a renewal whose webhook was lost: the paid period has to reach the subscription or access lapses
+        await self.subscription_repo.extend_periods(periods)
+        stats["subscriptions.extended"] += len(periods)
+        for user_id in {sub.user_id for sub in subscriptions.values() if sub.id in {p["id"] for p in periods}}:
+            await invalidate_entitlement(user_id)
+
+
+
+_SYNCED_SUBSCRIPTION_FIELDS = (
+    "plan_id", "status", "provider_customer_id", "started_at", "current_period_end", "canceled_at", "cancel_at_period_end",
+)
+_SYNCED_PAYMENT_FIELDS = ("subscription_id", "amount_cents", "currency", "status")
+
+
+def _parse_uuid(value) -> UUID | None:
+    try:
+        return UUID(value) if value else None
+    except (TypeError, ValueError):
+        return None
+
+
+async def expire_lapsed_subscriptions(session_factory: sessionmaker) -> int:
+    """
+    Marks subscriptions whose period is over as EXPIRED, a chunk per transaction so no sweep
+    holds many row locks; several can run at once. Returns how many this run expired.
+    """
+    lapsed_before = datetime.now(timezone.utc) - timedelta(seconds=settings.subscription_expiry_grace_seconds)
+    expired = 0
+    async with session_factory() as db:
+        subscription_repo = SubscriptionRepoistory(db)
+        while True:
+            user_ids = await subscription_repo.expire_lapsed(lapsed_before, settings.subscription_expiry_batch_size)
+            for user_id in set(user_ids):
+                await invalidate_entitlement(user_id)
+            expired += len(user_ids)
+            if len(user_ids) < settings.subscription_expiry_batch_size:
+                break
+    await metrics.incr("subscriptions.expired", expired)
+    logger.info(f"Subscription expiry sweep finished expired={expired}")
+    return expired
+
+
+async def reconcile_stripe(session_factory: sessionmaker) -> dict[str, int]:
+    async with session_factory() as db:
+        return await StripeReconciliationService(
+            SubscriptionRepoistory(db), PaymentRepository(db), PlanRepository(db),
+            UserRepository(db), SyncCursorRepository(db),
+        ).reconcile()
 
 
 
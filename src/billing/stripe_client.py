@@ -0,0 +1,180 @@
+import ssl
+import time
+import asyncio
+import httpx
+import stripe
+from enum import Enum
+from contextvars import ContextVar
+from contextlib import contextmanager
+from src import metrics
+from src.cache import get_redis, TOKEN_BUCKET_SCRIPT
+from src.config import settings
+from src.logging import get_logger
+
+
+logger = get_logger("billing")
+
+
+class StripePriority(str, Enum):
+    INTERACTIVE = "interactive"
+    BACKGROUND = "background"
+
+
+stripe_priority: ContextVar[StripePriority] = ContextVar("stripe_priority", default=StripePriority.INTERACTIVE)
+
+
+@contextmanager
+def background_stripe_calls():
+    """Stripe calls made inside (Celery jobs, syncs, backfills) queue behind interactive traffic."""
+    token = stripe_priority.set(StripePriority.BACKGROUND)
+    try:
+        yield
+    finally:
+        stripe_priority.reset(token)
+
+
+class StripeRateGovernor:
+    """
+    Distributed limit on outbound Stripe requests. Background callers leave `interactive_reserve`
+    tokens in the bucket, so a bulk job can never starve checkout, and a 429 seen by any worker
+    pauses everyone via the cooldown key. Redis being unavailable means requests go out ungoverned;
+    Stripe's own 429s are still retried by the HTTP client below.
+    """
+    BUCKET_KEY = "stripe:ratelimit:bucket"
+    COOLDOWN_KEY = "stripe:ratelimit:cooldown"
+
+    def __init__(self, rate_per_second: float, burst: int, interactive_reserve: int,
+                 max_wait_seconds: float, default_cooldown_seconds: float) -> None:
+        self.rate_per_second = rate_per_second
+        self.burst = burst
+        self.interactive_reserve = interactive_reserve
+        self.max_wait_seconds = max_wait_seconds
+        self.default_cooldown_seconds = default_cooldown_seconds
+
+
+    async def _take(self, priority: StripePriority) -> int:
+        reserve = self.interactive_reserve if priority == StripePriority.BACKGROUND else 0
+        script = get_redis().register_script(TOKEN_BUCKET_SCRIPT)
+        return int(await script(keys=[self.BUCKET_KEY, self.COOLDOWN_KEY], args=[self.rate_per_second, self.burst, reserve]))
+
+
+    async def acquire(self, priority: StripePriority) -> None:
+        started = time.monotonic()
+        while True:
+            try:
+                wait_ms = await self._take(priority)
+            except Exception as e:
+                logger.warning(f"Stripe rate governor unavailable priority={priority.value}, error={str(e)}")
+                return
+            if wait_ms <= 0:
+                break
+            waited = time.monotonic() - started
+            if waited >= self.max_wait_seconds:
+                logger.warning(f"Stripe rate governor wait exceeded, sending anyway priority={priority.value}, waited={waited:.2f}s")
+                await metrics.incr(f"stripe.throttle_timeouts.{priority.value}")
+                break
+            await asyncio.sleep(min(wait_ms / 1000, self.max_wait_seconds - waited))
+
+        waited_ms = int((time.monotonic() - started) * 1000)
+        if waited_ms > 0:
+            await metrics.incr(f"stripe.throttled_requests.{priority.value}")
+            await metrics.incr(f"stripe.throttled_wait_ms.{priority.value}", waited_ms)
+
+
+    async def back_off(self, retry_after_seconds: float | None) -> None:
+        """Stripe answered 429: hold every worker's requests for Retry-After (or the default cooldown)."""
+        cooldown_ms = int((retry_after_seconds or self.default_cooldown_seconds) * 1000)
+        logger.warning(f"Stripe rate limited us, pausing outbound calls cooldown_ms={cooldown_ms}")
+        await metrics.incr("stripe.rate_limited_responses")
+        try:
+            await get_redis().set(self.COOLDOWN_KEY, "1", px=cooldown_ms)
+        except Exception as e:
+            logger.warning(f"Stripe rate governor cooldown not shared error={str(e)}")
+
+
+
+stripe_rate_governor = StripeRateGovernor(
+    rate_per_second=settings.stripe_rate_limit_per_second,
+    burst=settings.stripe_rate_limit_burst,
+    interactive_reserve=settings.stripe_rate_limit_interactive_reserve,
+    max_wait_seconds=settings.stripe_rate_limit_max_wait_seconds,
+    default_cooldown_seconds=settings.stripe_rate_limit_cooldown_seconds,
+)
+
+
+class PooledHTTPXClient(stripe.HTTPXClient):
+    """
+    stripe.HTTPXClient with a pool sized from settings, every attempt (retries included)
+    going through the shared rate governor, and 429s retried with backoff.
+    """
+    def __init__(self, timeout: httpx.Timeout, limits: httpx.Limits, **kwargs) -> None:
+        super().__init__(timeout=timeout, **kwargs)
+        # the parent takes no httpx options, so its client is swapped for a sized one before it could
+        # open a connection (httpx connects lazily). Proxies still apply: the parent passes them per request
+        self._client_async = httpx.AsyncClient(
+            verify=ssl.create_default_context(cafile=stripe.ca_bundle_path) if self._verify_ssl_certs else False,
+            limits=limits,
+        )
+
+
+    async def request_async(self, method, url, headers, post_data=None):
+        await stripe_rate_governor.acquire(stripe_priority.get())
+        response = await super().request_async(method, url, headers, post_data)
+        _, status_code, _ = response
+        if status_code == 429:
+            await stripe_rate_governor.back_off(self._retry_after_header(response))
+        return response
+
+
+    def _should_retry(self, response, api_connection_error, num_retries, max_network_retries):
+        # the library leaves 429s to the caller; POST retries carry idempotency keys, so they are safe
+        max_network_retries = max_network_retries if max_network_retries is not None else 0
+        if response is not None and response[1] == 429 and num_retries < max_network_retries:
+            return True
+        return super()._should_retry(response, api_connection_error, num_retries, max_network_retries)
+
+
+_client: stripe.StripeClient | None = None
+_http_client: PooledHTTPXClient | None = None
+_client_loop: asyncio.AbstractEventLoop | None = None
+
+
+def _build_client() -> tuple[stripe.StripeClient, PooledHTTPXClient]:
+    http_client = PooledHTTPXClient(
+        timeout=httpx.Timeout(settings.stripe_read_timeout_seconds, connect=settings.stripe_connect_timeout_seconds),
+        limits=httpx.Limits(
+            max_connections=settings.stripe_max_connections,
+            max_keepalive_connections=settings.stripe_max_keepalive_connections,
+        ),
+    )
+    client = stripe.StripeClient(
+        settings.stripe_secret_key,
+        http_client=http_client,
+        max_network_retries=settings.stripe_max_network_retries,
+        base_addresses={"api": settings.stripe_api_base} if settings.stripe_api_base else None,
+    )
+    return client, http_client
+
+
+def get_stripe_client() -> stripe.StripeClient:
+    """
+    Async Stripe client sharing one keep-alive connection pool per worker. Like get_redis(),
+    the pool belongs to the event loop that opened it, so it is rebuilt when the running loop changes.
+    Retries (with Stripe's idempotency keys on POSTs) are handled by the library.
+    """
+    global _client, _http_client, _client_loop
+    loop = asyncio.get_running_loop()
+    if _client is None or _client_loop is not loop:
+        if _http_client is not None and _client_loop is not None and not _client_loop.is_closed():
+            # the old pool's connections belong to its loop: closed there, now or the next time it runs
+            asyncio.run_coroutine_threadsafe(_http_client.close_async(), _client_loop)
+        _client, _http_client = _build_client()
+        _client_loop = loop
+    return _client
+
+
+async def close_stripe_client() -> None:
+    global _client, _http_client, _client_loop
+    if _http_client is not None and _client_loop is asyncio.get_running_loop():
+        await _http_client.close_async()
+    _client = _http_client = _client_loop = None
@@ -2,20 +2,55 @@ import stripe
 from uuid import UUID
 from datetime import datetime, timezone
 from fastapi import HTTPException, status
-from fastapi.concurrency import run_in_threadpool
 from src.auth.models import User
 from src.auth.repository import UserRepository
 from src.billing.models import Plan, Subscription, PaymentProvider, PaymentStatus, SubscriptionStatus
 from src.billing.repository import PlanRepository, SubscriptionRepoistory, PaymentRepository
 from src.billing.schemas import PlanUpdate
-from src.config import settings
+from src.billing.cache import invalidate_entitlement, stripe_subscription_cache, checkout_session_cache
+from src.billing.stripe_client import get_stripe_client
+from src import metrics
 from src.logging import get_logger
 
-stripe.api_key = settings.stripe_secret_key
 logger = get_logger("billing")
 
 
+async def _count_retrieve_avoided(source: str, stripe_subscription_id: str | None) -> None:
+    logger.debug(f"Stripe subscription retrieve avoided source={source}, stripe_subscription_id={stripe_subscription_id}")
+    await metrics.incr(f"stripe.subscription_retrieves_avoided.{source}")
+
+
 class StripeGateway:
+    @staticmethod
+    async def iter_subscriptions_created_after(created_after: int):
+        page = await get_stripe_client().v1.subscriptions.list_async(
+            {"created": {"gt": created_after}, "status": "all", "limit": 100}
+        )
+        async for stripe_subscription in page.auto_paging_iter():
+            yield stripe_subscription
+
+
+    @staticmethod
+    async def iter_invoices_created_after(created_after: int):
+        page = await get_stripe_client().v1.invoices.list_async({"created": {"gt": created_after}, "limit": 100})
+        async for invoice in page.auto_paging_iter():
+            yield invoice
+
+
+    @staticmethod
+    async def retrieve_subscription(stripe_subscription_id: str):
+        """Subscription retrieve behind the short-lived subscription cache."""
+        stripe_subscription = stripe_subscription_cache.get(stripe_subscription_id)
+        if stripe_subscription is not None:
+            await _count_retrieve_avoided("cache", stripe_subscription_id)
+            return stripe_subscription
+
+        stripe_subscription = await get_stripe_client().v1.subscriptions.retrieve_async(stripe_subscription_id)
+        stripe_subscription_cache.set(stripe_subscription)
+        await metrics.incr("stripe.subscription_retrieves")
+        return stripe_subscription
+
+
     @staticmethod
     async def save_plan_to_stripe(plan: Plan):
         try:
@@ -23,10 +58,7 @@ class StripeGateway:
                 logger.info(
                     f"Creating Stripe product for plan_id={plan.id}, name={plan.name}"
                 )
-                product = await run_in_threadpool(
-                    stripe.Product.create,
-                    name=plan.name,
-                )
+                product = await get_stripe_client().v1.products.create_async({"name": plan.name})
                 plan.stripe_product_id = product.id
                 logger.info(
                     f"Stripe product created for plan_id={plan.id}, stripe_product_id={plan.stripe_product_id}"
@@ -37,13 +69,12 @@ class StripeGateway:
                     f"Creating Stripe price for plan_id={plan.id}, product_id={plan.stripe_product_id}, "
                     f"price_cents={plan.price_cents}, currency={plan.currency}"
                 )
-                price = await run_in_threadpool(
-                    stripe.Price.create,
-                    unit_amount=plan.price_cents,   # in cents
-                    currency=plan.currency,
-                    recurring={"interval": "month"},
-                    product=plan.stripe_product_id,
-                )
+                price = await get_stripe_client().v1.prices.create_async({
+                    "unit_amount": plan.price_cents,   # in cents
+                    "currency": plan.currency,
+                    "recurring": {"interval": "month"},
+                    "product": plan.stripe_product_id,  # type: ignore
+                })
                 plan.stripe_price_id = price.id
                 logger.info(
                     f"Stripe price created for plan_id={plan.id}, stripe_price_id={plan.stripe_price_id}"
@@ -76,8 +107,7 @@ class StripeGateway:
                 f"Updating Stripe product for plan_id={plan.id}, "
                 f"stripe_product_id={plan.stripe_product_id}, fields={list(product_update_data.keys())}"
             )
-            await run_in_threadpool(
-                stripe.Product.update, plan.stripe_product_id, **product_update_data) # type: ignore
+            await get_stripe_client().v1.products.update_async(plan.stripe_product_id, product_update_data) # type: ignore
 
 
          # 2️⃣ If price-related fields changed → create new price
@@ -86,15 +116,14 @@ class StripeGateway:
                 f"Creating new Stripe price for plan_id={plan.id}, "
                 f"stripe_product_id={plan.stripe_product_id}"
             )
-            new_price = await run_in_threadpool(
-                stripe.Price.create,
-                product=plan.stripe_product_id,
-                unit_amount=update_data.get("price_cents", plan.price_cents),
-                currency=update_data.get("currency", plan.currency),
-                recurring={
+            new_price = await get_stripe_client().v1.prices.create_async({
+                "product": plan.stripe_product_id, # type: ignore
+                "unit_amount": update_data.get("price_cents", plan.price_cents),
+                "currency": update_data.get("currency", plan.currency),
+                "recurring": {
                     "interval": update_data.get("billing_period", plan.billing_period)
                 },
-            )
+            })
             update_data["stripe_price_id"] = new_price.id
             logger.info(
                 f"New Stripe price created for plan_id={plan.id}, stripe_price_id={new_price.id}"
@@ -109,8 +138,8 @@ class StripeGateway:
             f"Soft deleting Stripe product and price for plan_id={plan.id}, "
             f"stripe_product_id={plan.stripe_product_id}, stripe_price_id={plan.stripe_price_id}"
         )
-        await run_in_threadpool(stripe.Product.update, plan.stripe_product_id, active=False)  # type: ignore
-        await run_in_threadpool(stripe.Price.modify, plan.stripe_price_id, active=False)
+        await get_stripe_client().v1.products.update_async(plan.stripe_product_id, {"active": False})  # type: ignore
+        await get_stripe_client().v1.prices.update_async(plan.stripe_price_id, {"active": False})  # type: ignore
         logger.info(
             f"Stripe product and price deactivated for plan_id={plan.id}, "
             f"stripe_product_id={plan.stripe_product_id}, stripe_price_id={plan.stripe_price_id}"
@@ -123,8 +152,11 @@ class StripeGateway:
             logger.info(
                 f"Creating Stripe customer for user_id={str(user.id)}, email={user.email}"
             )
-            customer = await run_in_threadpool(stripe.Customer.create,email=user.email,
-                metadata={"user_id": str(user.id)})
+            # one key per user: the provisioning task and a checkout racing it get the same customer
+            customer = await get_stripe_client().v1.customers.create_async(
+                {"email": user.email, "metadata": {"user_id": str(user.id)}},
+                {"idempotency_key": f"customer-create-{user.id}"},
+            )
             user = await user_repo.update(user, stripe_customer_id = customer['id'])
             logger.info(
                 f"Stripe customer created for user_id={str(user.id)}, "
@@ -143,6 +175,14 @@ class StripeGateway:
     async def create_subscription_checkout_session(user: User, plan: Plan,
         user_repo: UserRepository, old_stripe_sub_id: str | None = None ) -> str | None:
 
+        cached_url = await checkout_session_cache.get(user.id, plan.id, old_stripe_sub_id)
+        if cached_url:
+            logger.info(
+                f"Reusing open checkout session user_id={str(user.id)}, plan_id={plan.id}, "
+                f"old_stripe_sub_id={old_stripe_sub_id}"
+            )
+            return cached_url
+
         await StripeGateway.ensure_customer(user, user_repo)
         metadata = {
             "plan_id": str(plan.id),
@@ -164,24 +204,25 @@ class StripeGateway:
             )
 
 
-        session = await run_in_threadpool(
-            stripe.checkout.Session.create,
-            mode="subscription",
-            customer=user.stripe_customer_id,        
-            line_items=[{
-                "price": plan.stripe_price_id,
+        session = await get_stripe_client().v1.checkout.sessions.create_async({
+            "mode": "subscription",
+            "customer": user.stripe_customer_id, # type: ignore
+            "line_items": [{
+                "price": plan.stripe_price_id, # type: ignore
                 "quantity": 1,
             }],
-            success_url="https://yourapp.com/success?session_id={CHECKOUT_SESSION_ID}",
-            cancel_url="https://yourapp.com/cancel",
-            client_reference_id=str(user.id),  
-            subscription_data={"metadata": metadata},
-        )
+            "success_url": "https://yourapp.com/success?session_id={CHECKOUT_SESSION_ID}",
+            "cancel_url": "https://yourapp.com/cancel",
+            "client_reference_id": str(user.id),
+            "metadata": metadata,  # echoed on checkout.session.completed, saves a subscription retrieve
+            "subscription_data": {"metadata": metadata},
+        })
 
         logger.info(
             f"Stripe checkout session created user_id={str(user.id)}, email={user.email}, "
             f"plan_id={plan.id}, session_id={session.get('id')}"
         )
+        await checkout_session_cache.set(user.id, plan.id, old_stripe_sub_id, session.url, session.get("expires_at")) #type: ignore
 
         return session.url
 
@@ -197,13 +238,16 @@ class StripeGateway:
             f"stripe_subscription_id={new_stripe_sub_id}, stripe_customer_id={customer_id}"
         )
 
-        stripe_subscription = await run_in_threadpool(
-            stripe.Subscription.retrieve,
-            new_stripe_sub_id,
-        )
-        sub_metadata = stripe_subscription.get("metadata", {}) or {}
+        sub_metadata = session.get("metadata", {}) or {}
+        if sub_metadata.get("plan_id"):
+            await _count_retrieve_avoided("payload", new_stripe_sub_id)
+        else:
+            # sessions created before we started copying the metadata onto them
+            stripe_subscription = await StripeGateway.retrieve_subscription(new_stripe_sub_id)
+            sub_metadata = stripe_subscription.get("metadata", {}) or {}
         old_stripe_sub_id = sub_metadata.get("upgrade_from_subscription_id")
         plan_id = sub_metadata.get("plan_id")
+        await checkout_session_cache.forget(user_id, plan_id, old_stripe_sub_id) #type: ignore
         plan = await plan_repo.get_by_id(plan_id) #type: ignore
         if not plan:
             logger.error(
@@ -215,16 +259,8 @@ class StripeGateway:
                 f"Handling upgrade: canceling old Stripe subscription old_stripe_sub_id={old_stripe_sub_id}, "
                 f"user_id={user_id}"
             )
-            await run_in_threadpool(
-                stripe.Subscription.delete,
-                old_stripe_sub_id,
-            )
-            await sub_repo.cancel_subscription(
-                provider=PaymentProvider.STRIPE,
-                provider_subscription_id=old_stripe_sub_id,
-                canceled_at=datetime.now(timezone.utc),
-                current_period_end=datetime.now(timezone.utc),
-            )
+            await get_stripe_client().v1.subscriptions.cancel_async(old_stripe_sub_id)
+            stripe_subscription_cache.invalidate(old_stripe_sub_id)
         sub = await sub_repo.get_by_provider_subscription_id(provider=PaymentProvider.STRIPE,provider_subscription_id=new_stripe_sub_id)
         if not sub:
             sub = await sub_repo.create_subscription(UUID(user_id), UUID(plan_id), PaymentProvider.STRIPE, new_stripe_sub_id, customer_id, SubscriptionStatus.PAST_DUE) 
@@ -232,6 +268,16 @@ class StripeGateway:
                 f"Local subscription created from Stripe user_id={user_id}, "
                 f"subscription_id={sub.id}, plan_id={plan.id}, provider_subscription_id={new_stripe_sub_id}"
             )
+        if old_stripe_sub_id:
+            # canceled locally once the new row exists, so the rollups read it as an upgrade rather than churn
+            await sub_repo.cancel_subscription(
+                provider=PaymentProvider.STRIPE,
+                provider_subscription_id=old_stripe_sub_id,
+                canceled_at=datetime.now(timezone.utc),
+                current_period_end=datetime.now(timezone.utc),
+                replaced_by_id=sub.id,
+            )
+        await invalidate_entitlement(user_id)
         return sub
 
 
@@ -266,11 +312,11 @@ class StripeGateway:
         )
         stripe_subscription = None
         if sub.provider == PaymentProvider.STRIPE and sub.provider_subscription_id:
-            stripe_subscription = await run_in_threadpool(
-                    stripe.Subscription.modify,
+            stripe_subscription = await get_stripe_client().v1.subscriptions.update_async(
                     sub.provider_subscription_id,
-                    cancel_at_period_end=True,
+                    {"cancel_at_period_end": True},
                 )
+            stripe_subscription_cache.set(stripe_subscription)
         
         now = datetime.now(timezone.utc)
         canceled_at = now
@@ -324,19 +370,17 @@ class StripeGateway:
             f"stripe_subscription_id={stripe_subscription_id}"
         )
         
-        stripe_subscription = await run_in_threadpool(
-            stripe.Subscription.retrieve,
-            stripe_subscription_id,
-        )
-        subscription_details = stripe_subscription.get("items", {}).get("data", [])
-        current_period_start = datetime.fromtimestamp(
-             subscription_details[0].get("current_period_start"),
-             tz=timezone.utc,
-        )    
-        current_period_end = datetime.fromtimestamp(
-            subscription_details[0].get("current_period_end"),
-            tz=timezone.utc,
-        )
+        # the subscription line's period is the billing period the invoice paid for
+        stripe_subscription = None
+        period = first_line.get("period", {}) or {}
+        period_start, period_end = period.get("start"), period.get("end")
+        if not (period_start and period_end):
+            stripe_subscription = await StripeGateway.retrieve_subscription(stripe_subscription_id)
+            subscription_details = stripe_subscription.get("items", {}).get("data", [])
+            period_start = subscription_details[0].get("current_period_start")
+            period_end = subscription_details[0].get("current_period_end")
+        current_period_start = datetime.fromtimestamp(period_start, tz=timezone.utc)
+        current_period_end = datetime.fromtimestamp(period_end, tz=timezone.utc)
         sub = await sub_repo.update_subscription_period(
             provider=PaymentProvider.STRIPE,
             provider_subscription_id=stripe_subscription_id,
@@ -349,12 +393,25 @@ class StripeGateway:
                 f"user_id={str(sub.user_id)}, current_period_start={current_period_start.isoformat()}, " #type: ignore
                 f"current_period_end={current_period_end.isoformat()}"
             )
+            await invalidate_entitlement(sub.user_id)
+            if stripe_subscription is None:
+                await _count_retrieve_avoided("payload", stripe_subscription_id)
             return sub
-        metadata = stripe_subscription.get("metadata", {}) or {}
+
+        subscription_snapshot = (invoice.get("parent", {}) or {}).get("subscription_details", {}) or {}
+        metadata = subscription_snapshot.get("metadata", {}) or {}
+        customer_id = invoice.get("customer")
+        if not (metadata.get("plan_id") and metadata.get("user_id")):
+            if stripe_subscription is None:
+                stripe_subscription = await StripeGateway.retrieve_subscription(stripe_subscription_id)
+            metadata = stripe_subscription.get("metadata", {}) or {}
+            customer_id = stripe_subscription.get("customer")
+        elif stripe_subscription is None:
+            await _count_retrieve_avoided("payload", stripe_subscription_id)
         plan_id = metadata.get("plan_id")
         user_id = metadata.get("user_id")
-        customer_id = stripe_subscription.get("customer")
         sub = await sub_repo.create_subscription(UUID(user_id), UUID(plan_id), PaymentProvider.STRIPE, stripe_subscription_id, customer_id, SubscriptionStatus.ACTIVE) #type:ignore
+        await invalidate_entitlement(sub.user_id)
         return sub
         
 
@@ -384,6 +441,7 @@ class StripeGateway:
                 f"Subscription marked PAST_DUE subscription_id={sub.id}, "
                 f"user_id={str(sub.user_id)}, provider_subscription_id={stripe_subscription_id}"
             )
+            await invalidate_entitlement(sub.user_id)
         else:
             logger.error(
                 f"Failed to mark subscription PAST_DUE, local sub not found "
@@ -414,6 +472,7 @@ class StripeGateway:
         
         current_period_end = datetime.now(timezone.utc)
          #Current period end changes to now so user has no access to the deleted plan
+        stripe_subscription_cache.invalidate(stripe_subscription_id)
 
         sub = await sub_repo.cancel_subscription(
             provider=PaymentProvider.STRIPE,
@@ -437,6 +496,7 @@ class StripeGateway:
             f"Subscription canceled locally after Stripe deletion subscription_id={sub.id}, "
             f"user_id={str(sub.user_id)}, provider_subscription_id={stripe_subscription_id}"
         )
+        await invalidate_entitlement(sub.user_id)
 
         return sub
     
\ No newline at end of file
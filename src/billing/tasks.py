@@ -1,72 +1,188 @@
 import asyncio
+from uuid import UUID
 from src.celery_app import celery_app, beat_app
-from datetime import datetime, timezone
-from asgiref.sync import async_to_sync
-from sqlalchemy import update
 from src import load_models
+from src.auth.repository import UserRepository
+from src.billing.constants import SubscriptionEmail
 from src.billing.emails import Emails
-from src.billing.models import Subscription, SubscriptionStatus
+from src.billing.repository import SubscriptionRepoistory
+from src.billing.stripe_client import background_stripe_calls
+from src.billing.utils import serialize_subscription
+from src.config import settings
+from src.logging import get_logger
 
-from src.database import get_sync_session
+from src.database import worker_async_session
+from src.outbox import relay_outbox
+from src.worker import run_async
 
 
 email_service = Emails()
-
-@celery_app.task(
-            name="send_subscription_email_task",
-            autoretry_for=(Exception,),
-            retry_backoff=True,
-            retry_kwargs={"max_retries": 5},
+logger = get_logger("billing")
+
+_SUBSCRIPTION_EMAILS = {
+    SubscriptionEmail.CREATED: email_service.send_subscription_email,
+    SubscriptionEmail.RENEWED: email_service.send_subscription_update_email,
+    SubscriptionEmail.CANCELED: email_service.send_cancel_subscription_email,
+    SubscriptionEmail.PAYMENT_FAILED: email_service.send_payment_failed_email,
+}
+
+_SUMMARY_TITLES = {
+    SubscriptionEmail.CREATED: "Subscription started",
+    SubscriptionEmail.RENEWED: "Subscription renewed",
+    SubscriptionEmail.CANCELED: "Subscription canceled",
+    SubscriptionEmail.PAYMENT_FAILED: "Payment failed",
+}
+
+
+async def _send_subscription_emails(notifications: list[list[str]]) -> tuple[list[list[str]], Exception | None]:
+    """
+    Sends the batch as one email per user: a user with several notifications, like the cancel,
+    create and invoice of an upgrade, gets a single summary of them. Returns the notifications
+    whose email failed and the first error.
+    """
+    async with worker_async_session() as db:
+        subscriptions = await SubscriptionRepoistory(db).get_many_with_user_and_plan(
+            [UUID(subscription_id) for subscription_id, _ in notifications]
         )
-def send_subscription_email_task(subscription: dict):
-    async_to_sync(email_service.send_subscription_email)(subscription)
+
+    by_user: dict[UUID, list[list[str]]] = {}
+    for notification in notifications:
+        subscription_id, email = notification
+        sub = subscriptions.get(UUID(subscription_id))
+        if sub is None:
+            logger.warning(f"Subscription email skipped, subscription is gone subscription_id={subscription_id}, email={email}")
+            continue
+        user_notifications = by_user.setdefault(sub.user_id, [])
+        # the outbox delivers at least once, so a notification can come twice
+        if notification not in user_notifications:
+            user_notifications.append(notification)
+
+    async def _send(user_notifications: list[list[str]]) -> None:
+        if len(user_notifications) == 1:
+            subscription_id, email = user_notifications[0]
+            await _SUBSCRIPTION_EMAILS[SubscriptionEmail(email)](serialize_subscription(subscriptions[UUID(subscription_id)]))
+            return
+        await email_service.send_subscription_summary_email([
+            {"title": _SUMMARY_TITLES[SubscriptionEmail(email)], **serialize_subscription(subscriptions[UUID(subscription_id)])}
+            for subscription_id, email in user_notifications
+        ])
+
+    groups = list(by_user.values())
+    results = await asyncio.gather(*(_send(group) for group in groups), return_exceptions=True)
+    failed = [
+        notification
+        for group, result in zip(groups, results) if isinstance(result, Exception)
+        for notification in group
+    ]
+    error = next((result for result in results if isinstance(result, Exception)), None)
+    return failed, error
 
 
 @celery_app.task(
-        name="send_update_subscription_email_task",
-        autoretry_for=(Exception,),
-        retry_backoff=True,
-        retry_kwargs={"max_retries": 5},
+        bind=True,
+        name="send_subscription_emails_task",
+        max_retries=5,
+        outbox_batched=True,
+        outbox_coalesce_seconds=settings.subscription_email_coalesce_seconds,
         )
-def send_update_subscription_email_task(subscription: dict):
-    async_to_sync(email_service.send_subscription_update_email)(subscription)
+def send_subscription_emails_task(self, notifications: list[list[str]]):
+    """
+    `notifications` are `[subscription_id, SubscriptionEmail]` pairs; the outbox relay packs every
+    pair pending at once into one message, holding a user's pairs back for the coalescing window.
+    A retry resends only the emails that failed.
+    """
+    failed, error = run_async(_send_subscription_emails(notifications))
+    if failed:
+        logger.warning(f"Subscription emails failed failed={len(failed)}, total={len(notifications)}, error={str(error)}")
+        raise self.retry(args=(failed,), exc=error, countdown=2 ** self.request.retries)
 
 
-@celery_app.task(
-        name="send_cancel_subscription_email_task",
-        autoretry_for=(Exception,),
-        retry_backoff=True,
-        retry_kwargs={"max_retries": 5},
-        )
-def send_cancel_subscription_email_task(subscription: dict):
-    async_to_sync(email_service.send_cancel_subscription_email)(subscription)
+async def _drain_stripe_events():
+    # imported here: src.billing.service imports this module for the tasks it stages
+    from src.billing.service import process_stripe_events
+
+    # keep going while there is work: finishing an event can unblock the next one of its subscription
+    with background_stripe_calls():
+        while await process_stripe_events(worker_async_session):
+            pass
+    # send the emails those events staged now rather than on the relay's next tick
+    await relay_outbox(worker_async_session)
+
+
+@celery_app.task(name="process_stripe_events_task")
+def process_stripe_events_task():
+    run_async(_drain_stripe_events())
+
+
+@beat_app.task(name="sweep_stripe_events_task")
+def sweep_stripe_events_task():
+    """Picks up events whose enqueue failed, failed attempts and work left by dead workers."""
+    run_async(_drain_stripe_events())
+
+
+async def _provision_stripe_customer(user_id: str):
+    # imported here: the gateway pulls in the billing repositories and cache, which the auth service does not need
+    from src.billing.stripe_gateway import StripeGateway
+
+    async with worker_async_session() as db:
+        user_repo = UserRepository(db)
+        user = await user_repo.get_by_id(UUID(user_id))
+        if user is None or user.stripe_customer_id:
+            return
+        with background_stripe_calls():
+            await StripeGateway.ensure_customer(user, user_repo)
 
 
 @celery_app.task(
-        name="send_payment_failed_email_task",
+        name="provision_stripe_customer_task",
         autoretry_for=(Exception,),
         retry_backoff=True,
         retry_kwargs={"max_retries": 5},
         )
-def send_payment_failed_email_task(subscription: dict):
-    async_to_sync(email_service.send_payment_failed_email)(subscription)
+def provision_stripe_customer_task(user_id: str):
+    run_async(_provision_stripe_customer(user_id))
 
-@beat_app.task(name="expire_subscriptions_task")
-def expire_subscriptions_task():
-    # Will be implemented for credits in subs later
-    pass
-    # db = get_sync_session()
 
-    # now = datetime.now(timezone.utc)
+async def _backfill_stripe_customers() -> int:
+    enqueued = 0
+    after_id = None
+    async with worker_async_session() as db:
+        user_repo = UserRepository(db)
+        while user_ids := await user_repo.list_ids_without_stripe_customer(after_id, settings.stripe_customer_backfill_batch_size):
+            for user_id in user_ids:
+                provision_stripe_customer_task.delay(str(user_id))
+            enqueued += len(user_ids)
+            after_id = user_ids[-1]
+    return enqueued
+
+
+@celery_app.task(name="backfill_stripe_customers_task")
+def backfill_stripe_customers_task():
+    """One-off job for users verified before customers were provisioned eagerly."""
+    enqueued = run_async(_backfill_stripe_customers())
+    logger.info(f"Stripe customer backfill enqueued users={enqueued}")
+
 
+async def _reconcile_stripe() -> dict[str, int]:
+    from src.billing.service import reconcile_stripe
 
-    # db.execute(
-    #     update(Subscription)
-    #     .where(Subscription.current_period_end <= now)
-    #     .where(Subscription.status != SubscriptionStatus.CANCELED)
-    #     .values(status=SubscriptionStatus.CANCELED)
-    # )
+    with background_stripe_calls():
+        return await reconcile_stripe(worker_async_session)
 
-    # db.commit()
-    # db.close()
+
+@beat_app.task(name="reconcile_stripe_task")
+def reconcile_stripe_task():
+    """Repairs subscriptions and payments whose webhooks were lost; cheap when nothing changed."""
+    run_async(_reconcile_stripe())
+
+
+async def _expire_subscriptions() -> int:
+    from src.billing.service import expire_lapsed_subscriptions
+
+    return await expire_lapsed_subscriptions(worker_async_session)
+
+
+@beat_app.task(name="expire_subscriptions_task")
+def expire_subscriptions_task():
+    run_async(_expire_subscriptions())
 
@@ -1,15 +1,14 @@
 from datetime import datetime, timezone
-from src.billing.models import Subscription
+from src.billing.models import Subscription, SubscriptionStatus
 
 
 
 def serialize_subscription(subscription: Subscription) -> dict:
     """
-    Converts a Subscription SQLAlchemy object into a JSON-serializable dict
-    ready to be sent to Celery tasks.
+    The context the subscription emails render from; needs `user` and `plan` loaded.
     """
     return {
-        "id": subscription.id,
+        "id": str(subscription.id),
         "user": {
             "email": subscription.user.email,
             "username": subscription.user.username
@@ -32,3 +31,48 @@ def subscription_has_access(subscription: Subscription) -> bool:
         return False
     
     return True
+
+
+def stripe_event_ordering_key(event: dict) -> str | None:
+    """
+    The Stripe subscription an event belongs to. Events sharing a key are processed
+    one at a time in arrival order; events without one have no ordering constraint.
+    """
+    event_type = event.get("type", "")
+    data_object = (event.get("data") or {}).get("object") or {}
+
+    if event_type.startswith("customer.subscription."):
+        return data_object.get("id")
+    if event_type.startswith("checkout.session."):
+        return data_object.get("subscription")
+    if event_type.startswith("invoice."):
+        return invoice_subscription_id(data_object)
+    return None
+
+
+def invoice_subscription_id(invoice) -> str | None:
+    """The Stripe subscription an invoice bills, wherever this API version puts it."""
+    lines = (invoice.get("lines") or {}).get("data") or []
+    if lines:
+        parent = lines[0].get("parent") or {}
+        sub_details = parent.get("subscription_item_details") or {}
+        if sub_details.get("subscription"):
+            return sub_details["subscription"]
+    subscription_details = (invoice.get("parent") or {}).get("subscription_details") or {}
+    return subscription_details.get("subscription") or invoice.get("subscription")
+
+
+STRIPE_SUBSCRIPTION_STATUSES = {
+    "active": SubscriptionStatus.ACTIVE,
+    "trialing": SubscriptionStatus.TRIALING,
+    "past_due": SubscriptionStatus.PAST_DUE,
+    "unpaid": SubscriptionStatus.PAST_DUE,
+    "incomplete": SubscriptionStatus.PENDING,
+    "paused": SubscriptionStatus.PENDING,
+    "canceled": SubscriptionStatus.CANCELED,
+    "incomplete_expired": SubscriptionStatus.CANCELED,
+}
+
+
+def timestamp_to_datetime(value: int | None) -> datetime | None:
+    return datetime.fromtimestamp(value, tz=timezone.utc) if value else None
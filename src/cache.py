@@ -0,0 +1,96 @@
+import asyncio
+from typing import Callable
+from redis import asyncio as aioredis
+from src.config import settings
+from src.logging import get_logger
+
+
+logger = get_logger()
+
+INVALIDATION_CHANNEL = "cache:invalidate"
+
+_redis: aioredis.Redis | None = None
+_redis_loop: asyncio.AbstractEventLoop | None = None
+
+
+def get_redis() -> aioredis.Redis:
+    """
+    Async Redis client, created on first use. Connections belong to the event loop that
+    opened them, and Celery worker processes (src.worker) and tests run their own loops,
+    so the client is recreated when the running loop changes.
+    """
+    global _redis, _redis_loop
+    loop = asyncio.get_running_loop()
+    if _redis is None or _redis_loop is not loop:
+        _redis = aioredis.from_url(settings.redis_url, decode_responses=True, socket_connect_timeout=2)
+        _redis_loop = loop
+    return _redis
+
+
+# Token bucket shared by every process: KEYS[1] holds the bucket, ARGV is (rate per second, capacity,
+# reserve). A caller must leave `reserve` tokens in the bucket, and while KEYS[2] exists nobody gets one.
+# Returns 0 when a token was taken, otherwise how many milliseconds to wait before asking again.
+TOKEN_BUCKET_SCRIPT = """
+local cooldown = redis.call('PTTL', KEYS[2])
+if cooldown > 0 then
+    return cooldown
+end
+local rate = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local reserve = tonumber(ARGV[3])
+local now = redis.call('TIME')
+local now_ms = tonumber(now[1]) * 1000 + math.floor(tonumber(now[2]) / 1000)
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or capacity
+local ts = tonumber(state[2]) or now_ms
+tokens = math.min(capacity, tokens + math.max(0, now_ms - ts) * rate / 1000)
+local wait = 0
+if tokens >= reserve + 1 then
+    tokens = tokens - 1
+else
+    wait = math.ceil((reserve + 1 - tokens) * 1000 / rate)
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now_ms))
+redis.call('PEXPIRE', KEYS[1], math.ceil(capacity * 1000 / rate) + 1000)
+return wait
+"""
+
+
+async def publish_invalidation(kind: str, key: str = "") -> None:
+    """
+    Tell every worker to drop a cached entry. Messages look like "<kind>:<key>",
+    an empty key means "everything of this kind".
+    Redis being down must never fail the write that triggered the invalidation.
+    """
+    try:
+        await get_redis().publish(INVALIDATION_CHANNEL, f"{kind}:{key}")
+    except Exception as e:
+        logger.warning(f"Cache invalidation publish failed kind={kind}, key={key}, error={str(e)}")
+
+
+async def listen_for_invalidations(handlers: dict[str, Callable[[str], None]]) -> None:
+    """
+    Long running task (one per API worker) applying invalidations published by other workers.
+    After every (re)connect all handlers are called with an empty key, since messages
+    sent while we were disconnected are lost.
+    """
+    while True:
+        try:
+            pubsub = get_redis().pubsub()
+            await pubsub.subscribe(INVALIDATION_CHANNEL)
+            for handler in handlers.values():
+                handler("")
+
+            async for message in pubsub.listen():
+                if message["type"] != "message":
+                    continue
+                kind, _, key = message["data"].partition(":")
+                handler = handlers.get(kind)
+                if handler:
+                    handler(key)
+
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning(f"Cache invalidation listener disconnected error={str(e)}, retrying in 5s")
+            await asyncio.sleep(5)
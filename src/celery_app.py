@@ -7,7 +7,7 @@ celery_app = Celery(
     "worker",
     broker=settings.celery_worker_url,
     backend=None,
-    include=["src.tasks", "src.billing.tasks"]
+    include=["src.auth.tasks", "src.billing.tasks", "src.admin.tasks", "src.outbox"]
 )
 
 
@@ -15,12 +15,19 @@ beat_app = Celery(
     "beat_worker",
     broker=settings.celery_beat_url,
     backend=None,
-    include=["src.billing.tasks"]
+    include=["src.billing.tasks", "src.admin.tasks", "src.outbox"]
 )
 
+# msgpack for what we publish; json is still accepted for messages queued before the switch
+for app in (celery_app, beat_app):
+    app.conf.task_serializer = "msgpack"
+    app.conf.accept_content = ["msgpack", "json"]
+
 celery_app.conf.task_routes = {
-    "src.tasks.*": {"queue": "default"},
     "src.billing.tasks.*": {"queue": "billing"},
+    # a user is waiting on these: a dedicated worker keeps them out from behind bulk email
+    "send_login_code_task": {"queue": "emails_priority"},
+    "send_password_reset_email_task": {"queue": "emails_priority"},
 }
 
 
@@ -29,4 +36,34 @@ beat_app.conf.beat_schedule = {
         "task": "expire_subscriptions_task",
         "schedule": crontab(minute=0, hour="*"),  
     },
+    "sweep-stripe-events-every-minute": {
+        "task": "sweep_stripe_events_task",
+        "schedule": crontab(minute="*"),
+    },
+    "reconcile-stripe-every-15-minutes": {
+        "task": "reconcile_stripe_task",
+        "schedule": crontab(minute="*/15"),
+    },
+    "relay-task-outbox": {
+        "task": "relay_task_outbox_task",
+        "schedule": settings.task_outbox_relay_interval_seconds,
+        # each run drains the outbox: ticks queued behind a slow one have nothing left to do
+        "options": {"expires": settings.task_outbox_relay_interval_seconds},
+    },
+    "resume-campaign-fanouts-every-5-minutes": {
+        "task": "resume_campaign_fanouts_task",
+        "schedule": crontab(minute="*/5"),
+    },
+    "recount-dashboard-counters-every-hour": {
+        "task": "recount_dashboard_counters_task",
+        "schedule": crontab(minute=45, hour="*"),
+    },
+    "refresh-daily-rollups-every-15-minutes": {
+        "task": "refresh_daily_rollups_task",
+        "schedule": crontab(minute="*/15"),
+    },
+    "purge-task-outbox-every-hour": {
+        "task": "purge_task_outbox_task",
+        "schedule": crontab(minute=30, hour="*"),
+    },
 }
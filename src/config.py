@@ -7,7 +7,8 @@ from src.settings.redis import RedisSettings
 from src.settings.celery import CelerySettings
 from src.auth.config import AuthSettings
 from src.settings.stripe import StripeSettings
-from src.admin.config import AiSettings
+from src.billing.config import BillingSettings
+from src.admin.config import AiSettings, CampaignSettings, AnalyticsSettings
 
 
 
@@ -15,7 +16,7 @@ BASE_DIR = Path(__file__).parent.parent
 
 
 class Settings(AppSettings,DatabaseSettings,MailSettings,RedisSettings,
-    CelerySettings,AuthSettings, StripeSettings, AiSettings):
+    CelerySettings,AuthSettings, StripeSettings, AiSettings, BillingSettings, CampaignSettings, AnalyticsSettings):
 
     model_config = SettingsConfigDict(env_file=".env",env_file_encoding="utf-8",
     extra="ignore",)
@@ -1,8 +1,8 @@
 from typing import Annotated
 from fastapi import Depends
-from sqlalchemy import create_engine
+from sqlalchemy.pool import NullPool
 from sqlalchemy.orm import sessionmaker, declarative_base
-from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, AsyncEngine
 from src.config import settings
 
 
@@ -31,26 +31,45 @@ db_dependency = Annotated[AsyncSession, Depends(get_db)]
 
 
 # ---------------------------
-# SYNC (Celery)
+# Celery workers
 # ---------------------------
-sync_engine = create_engine(
-    settings.sync_database_url,
-    future=True,
-    echo=False,
-)
+# Until a worker process builds its own engine (src.worker), tasks share this one: tests and scripts drive
+# them from loops of their own, and asyncpg connections can't outlive their loop, so it doesn't pool.
+worker_engine: AsyncEngine = create_async_engine(settings.database_url, poolclass=NullPool)
 
-SyncSessionLocal = sessionmaker(
-    bind=sync_engine,
-    autoflush=False,
-    autocommit=False,
+worker_async_session = sessionmaker(
+    worker_engine,
+    class_=AsyncSession,
     expire_on_commit=False,
 )
 
 
-def get_sync_session():
-    """Used ONLY inside Celery tasks."""
-    db = SyncSessionLocal()
-    try:
-        return db
-    finally:
-        db.close()
\ No newline at end of file
+def worker_pool_limits(concurrency: int) -> tuple[int, int]:
+    """
+    `(pool_size, max_overflow)` for one of `concurrency` worker processes, so that together they
+    stay within `worker_db_max_connections`. Overflow covers tasks that fan out over several sessions.
+    """
+    per_process = max(1, settings.worker_db_max_connections // max(1, concurrency))
+    pool_size = min(settings.worker_db_pool_size, per_process)
+    return pool_size, per_process - pool_size
+
+
+def init_worker_engine(concurrency: int) -> None:
+    """
+    Gives this worker process a pooled engine of its own, created after the fork so no connection is
+    shared with the parent. Its connections belong to the process's task loop (src.worker.run_async).
+    """
+    global worker_engine
+    pool_size, max_overflow = worker_pool_limits(concurrency)
+    worker_engine = create_async_engine(
+        settings.database_url,
+        pool_size=pool_size,
+        max_overflow=max_overflow,
+        pool_pre_ping=True,
+        pool_recycle=settings.worker_db_pool_recycle_seconds,
+    )
+    worker_async_session.configure(bind=worker_engine)
+
+
+async def dispose_worker_engine() -> None:
+    await worker_engine.dispose()
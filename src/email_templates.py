@@ -0,0 +1,135 @@
+import threading
+from datetime import datetime
+from pathlib import Path
+from jinja2 import Environment, FileSystemLoader, Template, nodes
+from src.config import settings, BASE_DIR
+
+
+TEMPLATE_FOLDER = BASE_DIR / "templates" / "email"
+
+
+def static_context() -> dict:
+    """Values every email template shares; they only change with settings or the year."""
+    return {
+        "app_name": settings.app_name,
+        "app_url": settings.app_url,
+        "dashboard_url": settings.app_url,
+        "expires_in": settings.validation_token_expire,
+        "support_email": "support@fast_api.com",
+        "company_address": "1234 Street, City, Country",
+        "year": datetime.now().year,
+    }
+
+
+def _segments(template_ast: nodes.Template) -> list[str | nodes.Name] | None:
+    """
+    The template as literal text and plain `{{ name }}` lookups, or None when it uses anything
+    else (filters, blocks, control flow), which only Jinja itself can render.
+    """
+    segments: list[str | nodes.Name] = []
+    for node in template_ast.body:
+        if not isinstance(node, nodes.Output):
+            return None
+        for child in node.nodes:
+            if isinstance(child, nodes.TemplateData):
+                segments.append(child.data)
+            elif isinstance(child, nodes.Name) and child.ctx == "load":
+                segments.append(child)
+            else:
+                return None
+    return segments
+
+
+class CompiledEmail:
+    """
+    One template with the shared context already rendered in. Plain-substitution templates are kept
+    as literal fragments joined around the per-message variables; any other template renders through
+    its compiled Jinja template with the shared context underneath the message's.
+    """
+
+    def __init__(self, template: Template, segments: list[str | nodes.Name] | None, shared: dict) -> None:
+        self.template = template
+        self.shared = shared
+        self.fragments: list[str] | None = None
+        self.variables: list[str] = []
+        if segments is not None:
+            self._fold(segments)
+
+
+    def _fold(self, segments: list[str | nodes.Name]) -> None:
+        fragments, variables, current = [], [], []
+        for segment in segments:
+            if isinstance(segment, str):
+                current.append(segment)
+            elif segment.name in self.shared:
+                current.append(str(self.shared[segment.name]))
+            else:
+                fragments.append("".join(current))
+                variables.append(segment.name)
+                current = []
+        fragments.append("".join(current))
+        self.fragments, self.variables = fragments, variables
+
+
+    def render(self, context: dict) -> str:
+        if self.fragments is None or any(
+            name in self.shared and context[name] != self.shared[name] for name in context
+        ):
+            return self.template.render({**self.shared, **context})
+        # Jinja renders a missing variable as an empty string
+        parts = [self.fragments[0]]
+        for name, fragment in zip(self.variables, self.fragments[1:]):
+            parts.append(str(context[name]) if name in context else "")
+            parts.append(fragment)
+        return "".join(parts)
+
+
+
+class EmailTemplates:
+    """
+    Every template in the folder compiled once per process. The shared context is rendered into
+    each template up front and again only when it changes (the year rolls over).
+    """
+
+    def __init__(self, folder: Path) -> None:
+        self.env = Environment(loader=FileSystemLoader(folder))
+        self._lock = threading.Lock()
+        self._compiled: dict[str, CompiledEmail] = {}
+        self._shared: dict | None = None
+        self._templates = {}
+        for name in self.env.list_templates():
+            source, _, _ = self.env.loader.get_source(self.env, name)  # type: ignore
+            self._templates[name] = (self.env.get_template(name), _segments(self.env.parse(source)))
+
+
+    def get(self, name: str) -> CompiledEmail:
+        shared = static_context()
+        compiled = self._compiled.get(name)
+        if compiled is not None and compiled.shared == shared:
+            return compiled
+        with self._lock:
+            if shared != self._shared:
+                self._compiled, self._shared = {}, shared
+            if name not in self._compiled:
+                template, segments = self._templates[name]
+                self._compiled[name] = CompiledEmail(template, segments, shared)
+            return self._compiled[name]
+
+
+    def render(self, name: str, context: dict | None = None) -> str:
+        return self.get(name).render(context or {})
+
+
+
+_email_templates: EmailTemplates | None = None
+
+
+def get_email_templates() -> EmailTemplates:
+    global _email_templates
+    if _email_templates is None:
+        _email_templates = EmailTemplates(TEMPLATE_FOLDER)
+    return _email_templates
+
+
+def render_email(name: str, context: dict | None = None) -> str:
+    return get_email_templates().render(name, context)
@@ -0,0 +1,114 @@
+import json
+import base64
+import hashlib
+from fastapi import Request, Response, status
+from fastapi.responses import JSONResponse
+from src.cache import get_redis
+from src.config import settings
+from src.logging import get_logger
+
+
+logger = get_logger()
+
+IDEMPOTENCY_HEADER = "Idempotency-Key"
+REPLAYED_HEADER = "Idempotent-Replayed"
+MAX_KEY_LENGTH = 255
+# only billing mutations are replayed: auth responses carry tokens and must never be persisted
+IDEMPOTENT_PATH_PREFIXES = ("/billing/",)
+
+_IN_FLIGHT = "in_flight"
+_DONE = "done"
+
+
+def _redis_key(request: Request, idempotency_key: str) -> str:
+    # keys are only unique per caller: scope them by the credentials the request was made with
+    caller_hash = hashlib.sha256(request.headers["Authorization"].encode()).hexdigest()[:32]
+    return f"idempotency:{caller_hash}:{request.method}:{request.url.path}:{idempotency_key}"
+
+
+def _replay(record: dict) -> Response:
+    response = Response(
+        content=base64.b64decode(record["body"]),
+        status_code=record["status_code"],
+    )
+    for name, value in record["headers"]:
+        response.headers.append(name, value)
+    response.headers[REPLAYED_HEADER] = "true"
+    return response
+
+
+async def idempotency_middleware(request: Request, call_next):
+    """
+    Makes authenticated billing POST requests carrying an Idempotency-Key header safe to retry.
+    The first request holds a short in-flight lock while it runs; its response (unless it is a 5xx)
+    is stored for `idempotency_ttl_seconds` and replayed to every retry with the same key and request.
+    A retry arriving while the first one still runs gets 409, the same key with a different body or
+    query string 422. Anonymous requests and routes outside IDEMPOTENT_PATH_PREFIXES pass straight through.
+    Redis being unavailable only means the request is processed without the guarantee.
+    """
+    idempotency_key = request.headers.get(IDEMPOTENCY_HEADER)
+    if (request.method != "POST" or not idempotency_key or "Authorization" not in request.headers
+            or not request.url.path.startswith(IDEMPOTENT_PATH_PREFIXES)):
+        return await call_next(request)
+    if len(idempotency_key) > MAX_KEY_LENGTH:
+        return JSONResponse(status_code=status.HTTP_400_BAD_REQUEST,
+                            content={"detail": f"{IDEMPOTENCY_HEADER} is longer than {MAX_KEY_LENGTH} characters."})
+
+    key = _redis_key(request, idempotency_key)
+    fingerprint = hashlib.sha256(request.url.query.encode() + b"?" + await request.body()).hexdigest()
+    try:
+        redis = get_redis()
+        acquired = await redis.set(key, json.dumps({"state": _IN_FLIGHT, "fingerprint": fingerprint}),
+                                   nx=True, ex=settings.idempotency_lock_ttl_seconds)
+        stored = None if acquired else await redis.get(key)
+    except Exception as e:
+        logger.warning(f"Idempotency store unavailable path={request.url.path}, error={str(e)}")
+        return await call_next(request)
+
+    if not acquired and stored:
+        record = json.loads(stored)
+        if record["fingerprint"] != fingerprint:
+            return JSONResponse(status_code=status.HTTP_422_UNPROCESSABLE_CONTENT,
+                                content={"detail": f"{IDEMPOTENCY_HEADER} was already used with a different request."})
+        if record["state"] == _IN_FLIGHT:
+            return JSONResponse(status_code=status.HTTP_409_CONFLICT, headers={"Retry-After": "1"},
+                                content={"detail": "A request with this Idempotency-Key is still being processed."})
+        logger.info(f"Replaying idempotent response path={request.url.path}, status={record['status_code']}")
+        return _replay(record)
+
+    try:
+        response = await call_next(request)
+    except BaseException:
+        await _release(key)
+        raise
+
+    if response.status_code >= 500:
+        # let the client retry a server error with the same key
+        await _release(key)
+        return response
+
+    body = b"".join([chunk async for chunk in response.body_iterator])  # type: ignore
+    headers = [(name, value) for name, value in response.headers.items() if name != "content-length"]
+    record = {
+        "state": _DONE,
+        "fingerprint": fingerprint,
+        "status_code": response.status_code,
+        "headers": headers,
+        "body": base64.b64encode(body).decode(),
+    }
+    try:
+        await get_redis().set(key, json.dumps(record), ex=settings.idempotency_ttl_seconds)
+    except Exception as e:
+        logger.warning(f"Idempotent response not stored path={request.url.path}, error={str(e)}")
+
+    replayable = Response(content=body, status_code=response.status_code, background=response.background)
+    for name, value in headers:
+        replayable.headers.append(name, value)
+    return replayable
+
+
+async def _release(key: str) -> None:
+    try:
+        await get_redis().delete(key)
+    except Exception as e:
+        logger.warning(f"Idempotency lock release failed key={key}, error={str(e)}")
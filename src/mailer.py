@@ -0,0 +1,184 @@
+import time
+import asyncio
+import aiosmtplib
+from email.message import EmailMessage, Message
+from email.utils import formataddr
+from fastapi_mail import ConnectionConfig, FastMail, MessageSchema
+from fastapi_mail.fastmail import email_dispatched
+from fastapi_mail.msg import MailMsg
+from src.cache import get_redis, TOKEN_BUCKET_SCRIPT
+from src.config import settings
+from src.email_templates import render_email
+from src.logging import get_logger
+from src.utils import conf
+
+
+logger = get_logger()
+
+
+class SMTPPool:
+    """
+    Logged-in SMTP connections reused across messages, at most `size` open at once.
+    Servers close idle sessions, so a connection idle for `idle_timeout_seconds` is replaced
+    rather than reused, and a send that finds its connection dropped reconnects and retries once.
+    """
+
+    def __init__(self, config: ConnectionConfig, size: int, idle_timeout_seconds: float) -> None:
+        self.config = config
+        self.idle_timeout_seconds = idle_timeout_seconds
+        self._slots = asyncio.Semaphore(size)
+        self._idle: list[tuple[aiosmtplib.SMTP, float]] = []
+
+
+    async def _connect(self) -> aiosmtplib.SMTP:
+        smtp = aiosmtplib.SMTP(
+            hostname=self.config.MAIL_SERVER,
+            port=self.config.MAIL_PORT,
+            timeout=self.config.TIMEOUT,
+            use_tls=self.config.MAIL_SSL_TLS,
+            start_tls=self.config.MAIL_STARTTLS,
+            validate_certs=self.config.VALIDATE_CERTS,
+            local_hostname=self.config.LOCAL_HOSTNAME,
+            cert_bundle=self.config.CERT_BUNDLE,
+        )
+        await smtp.connect()
+        if self.config.USE_CREDENTIALS:
+            await smtp.login(self.config.MAIL_USERNAME, self.config.MAIL_PASSWORD.get_secret_value())
+        return smtp
+
+
+    async def _checkout(self) -> tuple[aiosmtplib.SMTP, bool]:
+        now = time.monotonic()
+        while self._idle:
+            smtp, last_used = self._idle.pop()
+            if smtp.is_connected and now - last_used < self.idle_timeout_seconds:
+                return smtp, True
+            await self._discard(smtp)
+        return await self._connect(), False
+
+
+    @staticmethod
+    async def _discard(smtp: aiosmtplib.SMTP) -> None:
+        try:
+            await smtp.quit()
+        except Exception:
+            smtp.close()
+
+
+    async def send(self, message: EmailMessage | Message) -> None:
+        async with self._slots:
+            smtp, reused = await self._checkout()
+            try:
+                try:
+                    await smtp.send_message(message)
+                except (ConnectionError, aiosmtplib.SMTPTimeoutError) as e:
+                    if not reused:
+                        raise
+                    logger.info(f"Pooled SMTP connection dropped, reconnecting error={str(e)}")
+                    await self._discard(smtp)
+                    smtp = await self._connect()
+                    await smtp.send_message(message)
+            except BaseException:
+                await self._discard(smtp)
+                raise
+            self._idle.append((smtp, time.monotonic()))
+
+
+    async def close(self) -> None:
+        idle, self._idle = self._idle, []
+        for smtp, _ in idle:
+            await self._discard(smtp)
+
+
+
+class Mailer:
+    """FastMail.send_message over an SMTPPool, rendering through the process-wide template registry."""
+
+    def __init__(self, config: ConnectionConfig, pool: SMTPPool) -> None:
+        self.config = config
+        self.pool = pool
+
+
+    async def send_message(self, message: MessageSchema, template_name: str | None = None) -> None:
+        if template_name and message.template_body is not None:
+            message.template_body = render_email(template_name, FastMail.check_data(message.template_body))
+
+        sender = message.from_email or self.config.MAIL_FROM
+        if (from_name := message.from_name or self.config.MAIL_FROM_NAME) is not None:
+            sender = formataddr((from_name, sender))
+        # FastMail has no public builder that doesn't also open its own connection; this is the call its
+        # send_message makes. fastapi-mail is pinned to an exact version for it (tests/mailer_test.py)
+        msg = await MailMsg(message)._message(sender)
+
+        if not self.config.SUPPRESS_SEND:
+            await self.pool.send(msg)
+        email_dispatched.send(msg)
+
+
+
+class DomainThrottle:
+    """
+    Bulk sending rate per recipient domain, shared by every worker, so one campaign doesn't get us
+    deferred by a large mailbox provider. A domain that answers 421 (try again later) is paused for
+    everyone. Redis being unavailable means mail goes out unthrottled.
+    """
+
+    def __init__(self, rate_per_second: float, burst: int, cooldown_seconds: int) -> None:
+        self.rate_per_second = rate_per_second
+        self.burst = burst
+        self.cooldown_seconds = cooldown_seconds
+
+
+    @staticmethod
+    def _keys(domain: str) -> list[str]:
+        return [f"mail:throttle:{domain}", f"mail:throttle:{domain}:cooldown"]
+
+
+    async def acquire(self, domain: str) -> None:
+        while True:
+            try:
+                script = get_redis().register_script(TOKEN_BUCKET_SCRIPT)
+                wait_ms = int(await script(keys=self._keys(domain), args=[self.rate_per_second, self.burst, 0]))
+            except Exception as e:
+                logger.warning(f"Mail domain throttle unavailable domain={domain}, error={str(e)}")
+                return
+            if wait_ms <= 0:
+                return
+            await asyncio.sleep(wait_ms / 1000)
+
+
+    async def back_off(self, domain: str) -> None:
+        logger.warning(f"Mail domain deferred us, pausing sends domain={domain}, cooldown_seconds={self.cooldown_seconds}")
+        try:
+            await get_redis().set(self._keys(domain)[1], "1", ex=self.cooldown_seconds)
+        except Exception as e:
+            logger.warning(f"Mail domain cooldown not shared domain={domain}, error={str(e)}")
+
+
+
+domain_throttle = DomainThrottle(
+    rate_per_second=settings.smtp_domain_rate_per_second,
+    burst=settings.smtp_domain_burst,
+    cooldown_seconds=settings.smtp_domain_cooldown_seconds,
+)
+
+
+_mailer: Mailer | None = None
+_mailer_loop: asyncio.AbstractEventLoop | None = None
+
+
+def get_mailer() -> Mailer:
+    """Process-wide mailer; like get_redis(), its connections belong to the loop that opened them."""
+    global _mailer, _mailer_loop
+    loop = asyncio.get_running_loop()
+    if _mailer is None or _mailer_loop is not loop:
+        pool = SMTPPool(conf, settings.smtp_pool_size, settings.smtp_idle_timeout_seconds)
+        _mailer, _mailer_loop = Mailer(conf, pool), loop
+    return _mailer
+
+
+async def close_mailer() -> None:
+    global _mailer, _mailer_loop
+    if _mailer is not None and _mailer_loop is asyncio.get_running_loop():
+        await _mailer.pool.close()
+    _mailer = _mailer_loop = None
@@ -1,4 +1,6 @@
 import time
+import asyncio
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, Request, HTTPException, Depends
 from fastapi.responses import ORJSONResponse
 from fastapi.exceptions import RequestValidationError
@@ -15,16 +17,41 @@ from src.billing.router import router as billing_router
 from src.admin.router import router as admin_router
 from src.exceptions import validation_exception_handler
 from src.auth_bearer import admin_required
+from src.cache import listen_for_invalidations
+from src.database import async_session
+from src.billing.cache import plan_catalog, entitlement_cache
+from src.billing.repository import PlanRepository
+from src.billing.stripe_client import close_stripe_client
+from src.idempotency import idempotency_middleware
 
 
 setup_logging()
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    try:
+        async with async_session() as db:
+            await PlanRepository(db).list_plans()
+    except Exception as e:
+        logger.warning(f"Plan catalog warm up failed, it will be loaded on first use error={str(e)}")
+
+    invalidation_listener = asyncio.create_task(listen_for_invalidations({
+        "plans": plan_catalog.invalidate,
+        "entitlement": entitlement_cache.invalidate,
+    }))
+    yield
+    invalidation_listener.cancel()
+    await close_stripe_client()
+
+
+app = FastAPI(lifespan=lifespan)
 
 app.state.limiter = limiter
 
 app.add_middleware(SlowAPIMiddleware)
 
+app.middleware("http")(idempotency_middleware)
 
 
 @app.middleware("http")
@@ -0,0 +1,35 @@
+from src.cache import get_redis
+from src.logging import get_logger
+
+
+logger = get_logger()
+
+COUNTERS_KEY = "metrics:counters"
+
+
+async def incr(name: str, amount: int = 1) -> None:
+    """Bumps a shared counter. Metrics are best effort: Redis errors are logged, never raised."""
+    try:
+        await get_redis().hincrby(COUNTERS_KEY, name, amount)
+    except Exception as e:
+        logger.warning(f"Metric update failed name={name}, error={str(e)}")
+
+
+async def incr_many(counts: dict[str, int]) -> None:
+    """Bumps several counters in one round trip; as best effort as `incr`."""
+    try:
+        async with get_redis().pipeline(transaction=False) as pipe:
+            for name, amount in counts.items():
+                pipe.hincrby(COUNTERS_KEY, name, amount)
+            await pipe.execute()
+    except Exception as e:
+        logger.warning(f"Metric update failed names={','.join(counts)}, error={str(e)}")
+
+
+async def get_counters() -> dict[str, int]:
+    try:
+        values = await get_redis().hgetall(COUNTERS_KEY)
+    except Exception as e:
+        logger.warning(f"Metrics read failed error={str(e)}")
+        return {}
+    return {name: int(value) for name, value in sorted(values.items())}
@@ -1,7 +1,8 @@
 from uuid import uuid4, UUID as PyUUID
+from typing import Any
 from datetime import datetime, timezone
-from sqlalchemy import ForeignKey, String, DateTime, Boolean
-from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy import ForeignKey, String, DateTime, Boolean, BigInteger, Integer, Text, Index, text
+from sqlalchemy.dialects.postgresql import UUID, JSONB
 from sqlalchemy.orm import relationship, mapped_column, Mapped
 from src.database import Base
 
@@ -13,7 +14,7 @@ class RefreshToken(Base):
     __tablename__ = "refresh_tokens"
 
     id: Mapped[PyUUID] = mapped_column(UUID(as_uuid=True), primary_key=True, default=uuid4)
-    user_id: Mapped[PyUUID] = mapped_column(UUID(as_uuid=True), ForeignKey("users.id"), nullable=False)
+    user_id: Mapped[PyUUID] = mapped_column(UUID(as_uuid=True), ForeignKey("users.id"), nullable=False, index=True)
     jti: Mapped[str] = mapped_column(String(), nullable=False, unique=True)
     token_hash: Mapped[str] = mapped_column(String(), nullable=False)
 
@@ -28,4 +29,44 @@ class RefreshToken(Base):
 
     user = relationship("User", backref="refresh_tokens")
 
-    
\ No newline at end of file
+
+
+class TaskOutbox(Base):
+    """
+    Celery tasks staged in the transaction of the change they belong to, published by the outbox relay
+    once that transaction has committed.
+    """
+    __tablename__ = "task_outbox"
+
+    id: Mapped[int] = mapped_column(BigInteger(), primary_key=True, autoincrement=True)
+    task_name: Mapped[str] = mapped_column(String(200), nullable=False)
+    args: Mapped[list[Any]] = mapped_column(JSONB, nullable=False, default=list)
+    kwargs: Mapped[dict[str, Any]] = mapped_column(JSONB, nullable=False, default=dict)
+    attempts: Mapped[int] = mapped_column(Integer(), nullable=False, default=0)
+    last_error: Mapped[str | None] = mapped_column(Text(), nullable=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True),
+                                    default=lambda: datetime.now(timezone.utc))
+    sent_at: Mapped[datetime | None] = mapped_column(DateTime(timezone=True), nullable=True)
+    # rows sharing a key are published together once the first of them is due
+    coalesce_key: Mapped[str | None] = mapped_column(String(200), nullable=True)
+    available_at: Mapped[datetime] = mapped_column(DateTime(timezone=True),
+                                    default=lambda: datetime.now(timezone.utc))
+
+
+# The relay reads unsent rows in id order; sent rows stay out of the index until they are purged.
+Index("ix_task_outbox_unsent", TaskOutbox.id, postgresql_where=text("sent_at IS NULL"))
+
+
+
+class DashboardCounter(Base):
+    """
+    Running row counts for the admin dashboard, bumped in the transaction of each write they count
+    and periodically overwritten with an exact recount.
+    """
+    __tablename__ = "dashboard_counters"
+
+    name: Mapped[str] = mapped_column(String(100), primary_key=True)
+    value: Mapped[int] = mapped_column(BigInteger(), nullable=False, default=0)
+    updated_at: Mapped[datetime] = mapped_column(DateTime(timezone=True),
+                                    default=lambda: datetime.now(timezone.utc))
+
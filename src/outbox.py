@@ -0,0 +1,116 @@
+from datetime import datetime, timedelta, timezone
+from celery import Task
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import sessionmaker
+from src.celery_app import celery_app, beat_app
+from src.config import settings
+from src.database import worker_async_session
+from src.models import TaskOutbox
+from src.repository import TaskOutboxRepository
+from src.logging import get_logger
+from src.worker import run_async
+from src import metrics
+
+
+logger = get_logger()
+
+
+def stage_task(db: AsyncSession, task: Task, *args, **kwargs) -> None:
+    """
+    `task.delay(*args, **kwargs)`, deferred to the relay: the row commits or rolls back with the
+    caller's transaction, so a task is never published for a change that didn't happen nor lost
+    for one that did. Arguments must be plain JSON.
+    """
+    TaskOutboxRepository(db).add(task.name, list(args), kwargs)
+
+
+def stage_coalesced_task(db: AsyncSession, task: Task, key: str, *args) -> None:
+    """
+    `stage_task` for a task declared with `outbox_batched=True` and `outbox_coalesce_seconds`: the
+    row is held back for that long, and rows staged under the same key before the first of them is
+    due are published with it, in the same message.
+    """
+    available_at = datetime.now(timezone.utc) + timedelta(seconds=task.outbox_coalesce_seconds)
+    TaskOutboxRepository(db).add(task.name, list(args), {}, coalesce_key=f"{task.name}:{key}", available_at=available_at)
+
+
+def _messages(rows: list[TaskOutbox]) -> list[tuple[str, list, dict, list[int]]]:
+    """
+    `(task_name, args, kwargs, row ids)` per message to publish: one per row, except for tasks
+    declared with `outbox_batched=True`, whose rows in the batch share one message carrying the
+    list of their staged positional arguments.
+    """
+    messages, batched = [], {}
+    for row in rows:
+        if not getattr(celery_app.tasks.get(row.task_name), "outbox_batched", False):
+            messages.append((row.task_name, row.args, row.kwargs, [row.id]))
+            continue
+        if row.task_name not in batched:
+            batched[row.task_name] = (row.task_name, [[]], {}, [])
+            messages.append(batched[row.task_name])
+        _, args, _, ids = batched[row.task_name]
+        args[0].append(row.args)
+        ids.append(row.id)
+    return messages
+
+
+async def relay_outbox(session_factory: sessionmaker) -> int:
+    """
+    Publishes staged tasks in id order, a batch per transaction over one broker connection, and
+    marks them sent; returns how many were published. Delivery is at-least-once: a relay that dies
+    between publishing and committing publishes its batch again on the next run.
+    """
+    sent = 0
+    while True:
+        async with session_factory() as db:
+            outbox_repo = TaskOutboxRepository(db)
+            rows = await outbox_repo.claim_pending(settings.task_outbox_batch_size)
+            if not rows:
+                return sent
+
+            messages = _messages(rows)
+            published: list[int] = []
+            published_messages = 0
+            try:
+                with celery_app.producer_or_acquire() as producer:
+                    for task_name, args, kwargs, ids in messages:
+                        celery_app.send_task(task_name, args=args, kwargs=kwargs, producer=producer)
+                        published.extend(ids)
+                        published_messages += 1
+            except Exception as e:
+                task_name, _, _, failed_ids = messages[published_messages]
+                await outbox_repo.mark_sent(published)
+                await outbox_repo.mark_failed(failed_ids, repr(e))
+                await metrics.incr("task_outbox.sent", len(published))
+                await metrics.incr("task_outbox.publish_failed")
+                # the broker is most likely down: leave the rest for the next run
+                logger.warning(
+                    f"Task outbox publish failed outbox_ids={failed_ids}, task_name={task_name}, error={str(e)}"
+                )
+                return sent + len(published)
+
+            await outbox_repo.mark_sent(published)
+        sent += len(published)
+        await metrics.incr("task_outbox.sent", len(published))
+        await metrics.incr("task_outbox.messages", len(messages))
+        if len(rows) < settings.task_outbox_batch_size:
+            return sent
+
+
+async def purge_outbox(session_factory: sessionmaker) -> int:
+    sent_before = datetime.now(timezone.utc) - timedelta(hours=settings.task_outbox_retention_hours)
+    async with session_factory() as db:
+        return await TaskOutboxRepository(db).delete_sent_before(sent_before)
+
+
+@beat_app.task(name="relay_task_outbox_task")
+def relay_task_outbox_task():
+    sent = run_async(relay_outbox(worker_async_session))
+    if sent:
+        logger.info(f"Task outbox relayed tasks={sent}")
+
+
+@beat_app.task(name="purge_task_outbox_task")
+def purge_task_outbox_task():
+    deleted = run_async(purge_outbox(worker_async_session))
+    logger.info(f"Task outbox purged rows={deleted}")
@@ -1,8 +1,9 @@
 from uuid import UUID
 from datetime import datetime, timezone, UTC
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, update, delete
-from src.models import RefreshToken
+from sqlalchemy import select, update, delete, or_, Select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from src.models import RefreshToken, TaskOutbox, DashboardCounter
 
 
 class RefreshTokenRepository:
@@ -39,4 +40,124 @@ class RefreshTokenRepository:
                 RefreshToken.user_id == user_id
             )
         )
-        await self.db.commit()
\ No newline at end of file
+        await self.db.commit()
+
+
+
+class TaskOutboxRepository:
+    def __init__(self, db: AsyncSession) -> None:
+        self.db = db
+
+
+    def add(
+        self, task_name: str, args: list, kwargs: dict,
+        coalesce_key: str | None = None, available_at: datetime | None = None,
+    ) -> None:
+        """Stages a task without committing: it is published only if the caller's transaction commits."""
+        self.db.add(TaskOutbox(
+            task_name=task_name, args=args, kwargs=kwargs,
+            coalesce_key=coalesce_key, available_at=available_at or datetime.now(timezone.utc),
+        ))
+
+
+    async def claim_pending(self, limit: int) -> list[TaskOutbox]:
+        """
+        Locks up to `limit` unsent rows that are due, oldest first, until the caller commits, along
+        with the rows not yet due that share a coalesce key with a due one.
+        SKIP LOCKED lets a second relay take the next rows instead of publishing the same ones.
+        """
+        now = datetime.now(timezone.utc)
+        due_keys = (
+            select(TaskOutbox.coalesce_key)
+            .where(
+                TaskOutbox.sent_at.is_(None),
+                TaskOutbox.available_at <= now,
+                TaskOutbox.coalesce_key.is_not(None),
+            )
+        )
+        result = await self.db.execute(
+            select(TaskOutbox)
+            .where(
+                TaskOutbox.sent_at.is_(None),
+                or_(TaskOutbox.available_at <= now, TaskOutbox.coalesce_key.in_(due_keys)),
+            )
+            .order_by(TaskOutbox.id)
+            .limit(limit)
+            .with_for_update(skip_locked=True)
+        )
+        return list(result.scalars().all())
+
+
+    async def mark_sent(self, ids: list[int]) -> None:
+        if ids:
+            await self.db.execute(
+                update(TaskOutbox)
+                .where(TaskOutbox.id.in_(ids))
+                .values(sent_at=datetime.now(timezone.utc))
+            )
+        await self.db.commit()
+
+
+    async def mark_failed(self, ids: list[int], error: str) -> None:
+        await self.db.execute(
+            update(TaskOutbox)
+            .where(TaskOutbox.id.in_(ids))
+            .values(attempts=TaskOutbox.attempts + 1, last_error=error)
+        )
+        await self.db.commit()
+
+
+    async def delete_sent_before(self, sent_before: datetime) -> int:
+        result = await self.db.execute(
+            delete(TaskOutbox).where(TaskOutbox.sent_at < sent_before)
+        )
+        await self.db.commit()
+        return result.rowcount
+
+
+
+class DashboardCounterRepository:
+    def __init__(self, db: AsyncSession) -> None:
+        self.db = db
+
+
+    async def _upsert(self, values: dict[str, int], increment: bool) -> None:
+        now = datetime.now(timezone.utc)
+        # rows in name order, so two writers bumping several counters lock them in the same order
+        stmt = pg_insert(DashboardCounter).values(
+            [{"name": name, "value": value, "updated_at": now} for name, value in sorted(values.items())]
+        )
+        new_value = DashboardCounter.value + stmt.excluded.value if increment else stmt.excluded.value
+        await self.db.execute(
+            stmt.on_conflict_do_update(
+                index_elements=[DashboardCounter.name],
+                set_={"value": new_value, "updated_at": stmt.excluded.updated_at},
+            )
+        )
+
+
+    async def add(self, **deltas: int) -> None:
+        """Bumps counters without committing, so they move only if the caller's write commits."""
+        deltas = {name: delta for name, delta in deltas.items() if delta}
+        if deltas:
+            await self._upsert(deltas, increment=True)
+
+
+    async def get_all(self) -> dict[str, int]:
+        result = await self.db.execute(select(DashboardCounter.name, DashboardCounter.value))
+        return {name: value for name, value in result.all()}
+
+
+    async def recount(self, count_queries: dict[str, Select]) -> dict[str, int]:
+        """
+        Overwrites the counters with exact counts. The counter rows are locked first: a write that
+        already bumped one commits before the counts are taken, and later ones wait and add on top.
+        """
+        await self.db.execute(
+            select(DashboardCounter.name).order_by(DashboardCounter.name).with_for_update()
+        )
+        exact = {name: (await self.db.execute(query)).scalar_one() for name, query in count_queries.items()}
+        await self._upsert(exact, increment=False)
+        await self.db.commit()
+        return exact
+
@@ -6,4 +6,8 @@ class AppSettings(BaseSettings):
     app_name: str = "FastAPI Auth System"
     app_env: str = "development"
     app_debug: bool = True
-    app_url: str
\ No newline at end of file
+    app_url: str
+
+    #IDEMPOTENCY
+    idempotency_ttl_seconds: int = Field(default=24 * 3600)
+    idempotency_lock_ttl_seconds: int = Field(default=60)
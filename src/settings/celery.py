@@ -4,4 +4,9 @@ from pydantic import Field
 
 class CelerySettings(BaseSettings):
     celery_worker_url: str = Field(...)
-    celery_beat_url: str = Field(...)
\ No newline at end of file
+    celery_beat_url: str = Field(...)
+
+    #TASK OUTBOX
+    task_outbox_batch_size: int = Field(default=200)
+    task_outbox_relay_interval_seconds: float = Field(default=2.0)
+    task_outbox_retention_hours: int = Field(default=24)
@@ -4,5 +4,10 @@ from pydantic import Field
 
 class DatabaseSettings(BaseSettings):
     database_url: str = Field(...)
-    sync_database_url: str = Field(...)
-    test_database_url: str = Field(...)
\ No newline at end of file
+    test_database_url: str = Field(...)
+
+    #CELERY WORKERS
+    # every process of one worker node together; keep it within the server's max_connections
+    worker_db_max_connections: int = Field(default=40)
+    worker_db_pool_size: int = Field(default=2)
+    worker_db_pool_recycle_seconds: int = Field(default=1800)
@@ -6,4 +6,11 @@ class MailSettings(BaseSettings):
     smtp_host: str = Field(...)
     smtp_port: int = Field(...)
     smtp_user: str = Field(...)
-    smtp_password: str = Field(...)
\ No newline at end of file
+    smtp_password: str = Field(...)
+    smtp_pool_size: int = Field(default=4)
+    # below the idle timeout of common SMTP servers, so a pooled session is replaced before it is dropped
+    smtp_idle_timeout_seconds: int = Field(default=60)
+    # bulk sends per recipient domain, shared by every worker
+    smtp_domain_rate_per_second: float = Field(default=5.0)
+    smtp_domain_burst: int = Field(default=20)
+    smtp_domain_cooldown_seconds: int = Field(default=60)
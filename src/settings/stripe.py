@@ -6,4 +6,19 @@ from pydantic import Field
 class StripeSettings(BaseSettings):
     stripe_webhook_secret: str = Field(...)
     stripe_public_key: str = Field(...)
-    stripe_secret_key: str = Field(...)
\ No newline at end of file
+    stripe_secret_key: str = Field(...)
+
+    #HTTP CLIENT
+    stripe_api_base: str | None = Field(default=None)  # point at a local fake in benchmarks
+    stripe_connect_timeout_seconds: float = Field(default=5.0)
+    stripe_read_timeout_seconds: float = Field(default=20.0)
+    stripe_max_network_retries: int = Field(default=2)
+    stripe_max_connections: int = Field(default=20)
+    stripe_max_keepalive_connections: int = Field(default=20)
+
+    #RATE GOVERNOR
+    stripe_rate_limit_per_second: float = Field(default=25.0)  # Stripe test mode; live mode allows 100
+    stripe_rate_limit_burst: int = Field(default=25)
+    stripe_rate_limit_interactive_reserve: int = Field(default=5)
+    stripe_rate_limit_max_wait_seconds: float = Field(default=30.0)
+    stripe_rate_limit_cooldown_seconds: float = Field(default=1.0)
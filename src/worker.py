@@ -0,0 +1,124 @@
+import os
+import time
+import asyncio
+import threading
+from datetime import datetime
+from typing import Any, Coroutine, TypeVar
+from celery.signals import (
+    worker_init, worker_process_init, worker_process_shutdown, before_task_publish, task_prerun, task_postrun,
+)
+from src.database import init_worker_engine, dispose_worker_engine
+from src.logging import get_logger
+from src import metrics
+
+
+logger = get_logger()
+
+T = TypeVar("T")
+
+_local = threading.local()
+_concurrency = 1
+# task id -> (perf_counter at start, ms spent queued or None)
+_running_tasks: dict[str, tuple[float, int | None]] = {}
+
+
+def _get_loop() -> asyncio.AbstractEventLoop:
+    # a forked child must not reuse the parent's loop: its selector shares the parent's file descriptors
+    loop = getattr(_local, "loop", None)
+    if loop is None or loop.is_closed() or getattr(_local, "pid", None) != os.getpid():
+        loop = asyncio.new_event_loop()
+        _local.loop, _local.pid = loop, os.getpid()
+    return loop
+
+
+def run_async(coro: Coroutine[Any, Any, T]) -> T:
+    """
+    Runs a coroutine from a Celery task on this worker process's event loop.
+    The loop lives as long as the process, so clients bound to it (SMTP pool, Redis, the
+    Stripe HTTP pool, the database pool) are reused by every task instead of rebuilt per call.
+    """
+    return _get_loop().run_until_complete(coro)
+
+
+@worker_init.connect
+def remember_concurrency(sender, **kwargs) -> None:
+    # runs in the parent before the pool forks: the children inherit it
+    global _concurrency
+    _concurrency = sender.concurrency
+
+
+@worker_process_init.connect
+def init_worker_process(**kwargs) -> None:
+    """Prefork children and the solo pool; thread pools keep the unpooled engine, their threads have a loop each."""
+    init_worker_engine(_concurrency)
+
+
+async def _close_clients() -> None:
+    # imported here: this module is imported by the task modules these clients live next to
+    from src.mailer import close_mailer
+    from src.billing.stripe_client import close_stripe_client
+
+    await close_mailer()
+    await close_stripe_client()
+    await dispose_worker_engine()
+
+
+@worker_process_shutdown.connect
+def close_worker_loop(**kwargs) -> None:
+    loop = getattr(_local, "loop", None)
+    if loop is None or loop.is_closed() or getattr(_local, "pid", None) != os.getpid():
+        return
+    try:
+        loop.run_until_complete(_close_clients())
+    except Exception as e:
+        logger.warning(f"Closing worker clients failed error={str(e)}")
+    finally:
+        loop.close()
+
+
+
+@before_task_publish.connect
+def stamp_enqueue_time(headers: dict | None = None, **kwargs) -> None:
+    # also stamps retries, which are published again
+    if headers is not None:
+        headers["enqueued_at"] = time.time()
+
+
+def _queue_wait_ms(request) -> int | None:
+    enqueued_at = getattr(request, "enqueued_at", None)
+    if enqueued_at is None:
+        return None
+    # a countdown (retry backoff) is time the task asked to wait, not backlog
+    ready_at = max(enqueued_at, datetime.fromisoformat(request.eta).timestamp()) if request.eta else enqueued_at
+    return max(0, int((time.time() - ready_at) * 1000))
+
+
+@task_prerun.connect
+def start_task_timer(task_id: str, task, **kwargs) -> None:
+    _running_tasks[task_id] = (time.perf_counter(), _queue_wait_ms(task.request))
+
+
+@task_postrun.connect
+def record_task_metrics(task_id: str, task, state: str | None = None, **kwargs) -> None:
+    """
+    Per task name and queue: `runs`, `wait_ms` (enqueue to start), `runtime_ms`, and one counter per
+    outcome (`success`, `retry`, `failure`); averages are the sums over `runs`.
+    """
+    started = _running_tasks.pop(task_id, None)
+    if started is None:
+        return
+    started_at, wait_ms = started
+    queue = (task.request.delivery_info or {}).get("routing_key") or "celery"
+    prefix = f"tasks.{queue}.{task.name}"
+    counts = {
+        f"{prefix}.runs": 1,
+        f"{prefix}.runtime_ms": int((time.perf_counter() - started_at) * 1000),
+        f"{prefix}.{(state or 'unknown').lower()}": 1,
+    }
+    if wait_ms is not None:
+        counts[f"{prefix}.wait_ms"] = wait_ms
+    try:
+        run_async(metrics.incr_many(counts))
+    except Exception as e:
+        # e.g. a task applied eagerly from code already running a loop
+        logger.warning(f"Task metrics not recorded task_name={task.name}, error={str(e)}")
@@ -0,0 +1,357 @@
+import aiosmtplib
+import pytest
+from datetime import datetime, timedelta, timezone
+from fastapi import status
+from httpx import AsyncClient
+from uuid import UUID, uuid4
+from unittest.mock import AsyncMock, MagicMock
+from sqlalchemy import delete, select
+from src.admin import services as admin_services
+from src.admin.models import EmailCampaign, CampaignStatus
+from src.admin.repository import AdminCampaignRepository, AdminAnalyticsRepository
+from src.admin.services import (
+    fan_out_campaign, send_campaign_chunk, recount_dashboard_counters, refresh_daily_rollups, ROLLUP_CURSOR,
+)
+from src.auth.models import User, Provider
+from src.auth.repository import UserRepository
+from src.billing.models import (
+    Subscription, SubscriptionStatus, PaymentProvider, Payment, PaymentStatus, Plan, BillingPeriod, SyncCursor,
+)
+from src.billing.repository import PaymentRepository, SubscriptionRepoistory, PlanRepository
+from src.billing.stripe_gateway import StripeGateway
+from src.models import TaskOutbox
+from tests.conftest import TestSessionDB
+
+
+async def _plan_with_subscribers(subscriptions: list[tuple[SubscriptionStatus, timedelta, bool]]):
+    """A fresh plan and one user per `(status, period end offset, user active)`, ordered by user id."""
+    now = datetime.now(timezone.utc)
+    suffix = uuid4().hex[:8]
+    plan = Plan(id=uuid4(), name="Campaign Plan", code=f"campaign-{suffix}", price_cents=1000,
+                billing_period=BillingPeriod.MONTHLY, currency="USD", is_active=True)
+    user_ids = sorted(uuid4() for _ in subscriptions)
+    users = [
+        User(id=user_id, email=f"campaign-{suffix}-{i}@example{i % 2}.com", username=f"campaign_{suffix}_{i}",
+             password="x", is_active=user_active, is_verified=True, provider=Provider.LOCAL)
+        for i, (user_id, (_, _, user_active)) in enumerate(zip(user_ids, subscriptions))
+    ]
+    async with TestSessionDB() as session:
+        session.add(plan)
+        session.add_all(users)
+        await session.flush()
+        session.add_all(
+            Subscription(user_id=user.id, plan_id=plan.id, status=sub_status, provider=PaymentProvider.MANUAL,
+                         current_period_end=now + period_offset)
+            for user, (sub_status, period_offset, _) in zip(users, subscriptions)
+        )
+        await session.commit()
+    return plan, users
+
+
+@pytest.mark.asyncio
+async def test_campaign_fans_out_chunks_and_resumes_after_cursor(client: AsyncClient, admin_headers, monkeypatch):
+    plan, users = await _plan_with_subscribers([
+        (SubscriptionStatus.ACTIVE, timedelta(days=30), True),
+        (SubscriptionStatus.CANCELED, timedelta(days=3), True),
+        (SubscriptionStatus.TRIALING, timedelta(days=7), True),
+        (SubscriptionStatus.PAST_DUE, timedelta(days=1), True),
+        (SubscriptionStatus.ACTIVE, timedelta(days=-1), True),
+        (SubscriptionStatus.ACTIVE, timedelta(days=30), False),
+    ])
+    audience = [user.id for user in users[:4]]
+    async with TestSessionDB() as session:
+        await session.execute(delete(TaskOutbox).where(TaskOutbox.task_name.in_(
+            ["fan_out_campaign_task", "send_campaign_chunk_task"])))
+        await session.commit()
+
+    response = await client.post("/campaigns", headers=admin_headers,
+                                 json={"plan_id": str(plan.id), "subject": "Price change", "body": "Prices go up."})
+    assert response.status_code == status.HTTP_202_ACCEPTED
+    campaign_id = UUID(response.json()["id"])
+
+    # a fan-out that died after handing out the first recipient
+    async with TestSessionDB() as session:
+        staged = (await session.execute(select(TaskOutbox.args).where(TaskOutbox.task_name == "fan_out_campaign_task"))).scalars().all()
+        await AdminCampaignRepository(session).advance_fanout(campaign_id, audience[0], 1)
+    assert staged == [[str(campaign_id)]]
+    monkeypatch.setattr(admin_services.settings, "campaign_chunk_size", 2)
+
+    assert await fan_out_campaign(TestSessionDB, campaign_id) == 3
+    assert await fan_out_campaign(TestSessionDB, campaign_id) == 0
+
+    async with TestSessionDB() as session:
+        chunks = (await session.execute(
+            select(TaskOutbox.args).where(TaskOutbox.task_name == "send_campaign_chunk_task").order_by(TaskOutbox.id)
+        )).scalars().all()
+        campaign = await session.get(EmailCampaign, campaign_id)
+    assert chunks == [
+        [str(campaign_id), [str(user_id) for user_id in audience[1:3]]],
+        [str(campaign_id), [str(audience[3])]],
+    ]
+    assert (campaign.recipients, campaign.fanout_cursor, campaign.fanout_done) == (4, audience[3], True)
+    assert campaign.status == CampaignStatus.SENDING
+
+
+@pytest.mark.asyncio
+async def test_campaign_chunk_retries_failed_recipients_and_completes(monkeypatch, admin_user):
+    plan, users = await _plan_with_subscribers([
+        (SubscriptionStatus.ACTIVE, timedelta(days=30), True),
+        (SubscriptionStatus.ACTIVE, timedelta(days=30), True),
+        (SubscriptionStatus.ACTIVE, timedelta(days=30), False),
+    ])
+    async with TestSessionDB() as session:
+        campaign = EmailCampaign(plan_id=plan.id, created_by=admin_user.id, subject="Maintenance", body="Down at 2am.",
+                                 status=CampaignStatus.SENDING, fanout_done=True, recipients=3)
+        session.add(campaign)
+        await session.commit()
+    active = [user for user in users if user.is_active]
+    deferring = active[0]
+
+    async def _send(*, email, **kwargs):
+        if email == deferring.email:
+            raise aiosmtplib.SMTPResponseException(421, "Try again later")
+    send_mock = AsyncMock(side_effect=_send)
+    throttle = MagicMock(acquire=AsyncMock(), back_off=AsyncMock())
+    monkeypatch.setattr(admin_services.CampaignEmails, "send_campaign_email", send_mock)
+    monkeypatch.setattr(admin_services, "domain_throttle", throttle)
+
+    retry = await send_campaign_chunk(TestSessionDB, campaign.id, [user.id for user in users], final_attempt=False)
+    assert retry == [deferring.id]
+    assert send_mock.await_count == 2
+    assert throttle.acquire.await_count == 2
+    throttle.back_off.assert_awaited_once_with(deferring.email.rpartition("@")[2])
+    async with TestSessionDB() as session:
+        campaign = await session.get(EmailCampaign, campaign.id)
+    # the deactivated user counts as failed right away
+    assert (campaign.sent, campaign.failed, campaign.status) == (1, 1, CampaignStatus.SENDING)
+
+    assert await send_campaign_chunk(TestSessionDB, campaign.id, retry, final_attempt=True) == []
+    async with TestSessionDB() as session:
+        campaign = await session.get(EmailCampaign, campaign.id)
+    assert (campaign.sent, campaign.failed, campaign.status) == (1, 2, CampaignStatus.COMPLETED)
+    assert campaign.completed_at is not None
+
+
+@pytest.mark.asyncio
+async def test_dashboard_counters_follow_writes_and_recount(client: AsyncClient, subscription):
+    baseline = await recount_dashboard_counters(TestSessionDB)
+    response = await client.get("/dashboard/stats")
+    assert response.json() == baseline
+
+    invoice_id = f"in_counter_{uuid4().hex[:8]}"
+    async with TestSessionDB() as session:
+        await UserRepository(session).create(User(
+            id=uuid4(), email=f"counter-{uuid4().hex[:8]}@test.com", username=f"counter_{uuid4().hex[:8]}",
+            password="x", is_active=True, is_verified=True, provider=Provider.LOCAL,
+        ))
+        payment_repo = PaymentRepository(session)
+        for _ in range(2):
+            await payment_repo.create_payment(user_id=subscription.user_id, subscription_id=subscription.id,
+                                              provider_invoice_id=invoice_id, amount_cents=1000, currency="USD",
+                                              status=PaymentStatus.SUCCEEDED)
+        # an upsert counts only the rows it inserted
+        rows = [{
+            "id": uuid4(), "user_id": subscription.user_id, "subscription_id": subscription.id,
+            "provider": PaymentProvider.STRIPE, "provider_invoice_id": provider_invoice_id, "amount_cents": 1000,
+            "currency": "USD", "status": PaymentStatus.SUCCEEDED, "created_at": datetime.now(timezone.utc),
+        } for provider_invoice_id in (invoice_id, f"{invoice_id}_next")]
+        await payment_repo.upsert_payments(rows)
+
+    response = await client.get("/dashboard/stats")
+    assert response.json() == {**baseline, "users": baseline["users"] + 1, "payments": baseline["payments"] + 2}
+
+    # a write that bypasses the repositories is corrected by the recount
+    async with TestSessionDB() as session:
+        await session.execute(delete(Payment).where(Payment.provider_invoice_id == f"{invoice_id}_next"))
+        await session.commit()
+    exact = await recount_dashboard_counters(TestSessionDB)
+    assert exact["payments"] == baseline["payments"] + 1
+    response = await client.get("/dashboard/stats")
+    assert response.json() == exact
+
+
+@pytest.mark.asyncio
+async def test_daily_rollups_refresh_touched_days_and_serve_series(client: AsyncClient, admin_headers, monkeypatch):
+    monkeypatch.setattr(admin_services.settings, "analytics_rollup_lookback_seconds", 0)
+    now = datetime.now(timezone.utc)
+    today = now.date()
+    suffix = uuid4().hex[:6]
+    currency = f"T{suffix[:5]}".upper()
+    monthly = Plan(id=uuid4(), name="Rollup Monthly", code=f"rollup-m-{suffix}", price_cents=3000, currency=currency,
+                   billing_period=BillingPeriod.MONTHLY, is_active=True)
+    yearly = Plan(id=uuid4(), name="Rollup Yearly", code=f"rollup-y-{suffix}", price_cents=12000, currency=currency,
+                  billing_period=BillingPeriod.YEARLY, is_active=True)
+    users = [
+        User(id=uuid4(), email=f"rollup-{suffix}-{i}@test.com", username=f"rollup_{suffix}_{i}", password="x",
+             is_active=True, is_verified=True, provider=Provider.LOCAL)
+        for i in range(3)
+    ]
+    subs = [
+        Subscription(id=uuid4(), user_id=users[0].id, plan_id=monthly.id, status=SubscriptionStatus.ACTIVE,
+                     provider=PaymentProvider.MANUAL, created_at=now - timedelta(days=3),
+                     started_at=now - timedelta(days=3), current_period_end=now + timedelta(days=27)),
+        Subscription(id=uuid4(), user_id=users[1].id, plan_id=yearly.id, status=SubscriptionStatus.CANCELED,
+                     provider=PaymentProvider.MANUAL, created_at=now - timedelta(days=2),
+                     started_at=now - timedelta(days=2), canceled_at=now - timedelta(days=1),
+                     current_period_end=now + timedelta(days=28)),
+        Subscription(id=uuid4(), user_id=users[2].id, plan_id=yearly.id, status=SubscriptionStatus.ACTIVE,
+                     provider=PaymentProvider.MANUAL, started_at=now, current_period_end=now + timedelta(days=365)),
+    ]
+    payments = [
+        Payment(user_id=users[0].id, subscription_id=subs[0].id, provider=PaymentProvider.MANUAL,
+                provider_invoice_id=f"in_rollup_{suffix}_0", amount_cents=3000, currency=currency,
+                status=PaymentStatus.SUCCEEDED, created_at=now - timedelta(days=3)),
+        Payment(user_id=users[0].id, subscription_id=subs[0].id, provider=PaymentProvider.MANUAL,
+                provider_invoice_id=f"in_rollup_{suffix}_1", amount_cents=3000, currency=currency,
+                status=PaymentStatus.FAILED, created_at=now - timedelta(days=3)),
+    ]
+    async with TestSessionDB() as session:
+        session.add_all([monthly, yearly, *users])
+        await session.flush()
+        session.add_all(subs)
+        await session.flush()
+        session.add_all(payments)
+        # the previous run was an hour ago: only the days these rows touch, and today, are recomputed
+        await session.execute(delete(SyncCursor).where(SyncCursor.name == ROLLUP_CURSOR))
+        session.add(SyncCursor(name=ROLLUP_CURSOR, position=int((now - timedelta(hours=1)).timestamp() * 1000)))
+        await session.commit()
+
+    assert await refresh_daily_rollups(TestSessionDB) >= 4
+    days = [str(today - timedelta(days=n)) for n in (3, 2, 1, 0)]
+    query = {"start": days[0], "end": days[-1], "currency": currency}
+
+    response = await client.get("/analytics/subscriptions", headers=admin_headers, params=query)
+    assert response.status_code == status.HTTP_200_OK
+    assert [
+        (row["day"], row["new"], row["canceled"], row["active"], row["mrr_cents"], row["churn_rate"])
+        for row in response.json()
+    ] == [
+        (days[0], 1, 0, 1, 3000, None),
+        (days[1], 1, 0, 2, 4000, 0.0),
+        (days[2], 0, 1, 1, 3000, 0.5),
+        (days[3], 1, 0, 2, 4000, 0.0),
+    ]
+    response = await client.get("/analytics/revenue", headers=admin_headers,
+                                params={"start": days[0], "end": days[-1], "plan_id": str(monthly.id)})
+    assert [(row["day"], row["currency"], row["payments"], row["amount_cents"]) for row in response.json()] == [
+        (days[0], currency, 1, 3000),
+    ]
+
+    # nothing changed: a rerun only revisits the open days, without duplicating rows
+    assert await refresh_daily_rollups(TestSessionDB) < 4
+    response = await client.get("/analytics/revenue", headers=admin_headers,
+                                params={"start": days[0], "end": days[-1], "plan_id": str(monthly.id)})
+    assert len(response.json()) == 1
+
+
+@pytest.mark.asyncio
+async def test_daily_rollups_count_an_upgrade_as_no_churn(
+    client: AsyncClient, admin_headers, in_memory_redis, mock_stripe_client
+):
+    now = datetime.now(timezone.utc)
+    today = now.date()
+    suffix = uuid4().hex[:6]
+    currency = f"U{suffix[:5]}".upper()
+    monthly = Plan(id=uuid4(), name="Upgrade Monthly", code=f"upgrade-m-{suffix}", price_cents=3000, currency=currency,
+                   billing_period=BillingPeriod.MONTHLY, is_active=True)
+    yearly = Plan(id=uuid4(), name="Upgrade Yearly", code=f"upgrade-y-{suffix}", price_cents=12000, currency=currency,
+                  billing_period=BillingPeriod.YEARLY, is_active=True)
+    users = [
+        User(id=uuid4(), email=f"upgrade-{suffix}-{i}@test.com", username=f"upgrade_{suffix}_{i}", password="x",
+             is_active=True, is_verified=True, provider=Provider.LOCAL)
+        for i in range(2)
+    ]
+    old_sub = Subscription(id=uuid4(), user_id=users[0].id, plan_id=monthly.id, status=SubscriptionStatus.ACTIVE,
+                           provider=PaymentProvider.STRIPE, provider_subscription_id=f"sub_old_{suffix}",
+                           created_at=now - timedelta(days=2), started_at=now - timedelta(days=2),
+                           current_period_end=now + timedelta(days=28))
+    # canceled before canceled_at was recorded: never active, whatever its period end says
+    legacy_sub = Subscription(id=uuid4(), user_id=users[1].id, plan_id=monthly.id, status=SubscriptionStatus.CANCELED,
+                              provider=PaymentProvider.MANUAL, created_at=now - timedelta(days=2),
+                              started_at=now - timedelta(days=2), current_period_end=now + timedelta(days=28))
+    async with TestSessionDB() as session:
+        session.add_all([monthly, yearly, *users])
+        await session.flush()
+        session.add_all([old_sub, legacy_sub])
+        await session.commit()
+
+    checkout = {"client_reference_id": str(users[0].id), "subscription": f"sub_new_{suffix}", "customer": "cus_upgrade",
+                "metadata": {"plan_id": str(yearly.id), "upgrade_from_subscription_id": f"sub_old_{suffix}"}}
+    async with TestSessionDB() as session:
+        sub_repo = SubscriptionRepoistory(session)
+        new_sub = await StripeGateway.user_subscribe(checkout, sub_repo, PlanRepository(session))
+        await sub_repo.update_subscription_period(PaymentProvider.STRIPE, f"sub_new_{suffix}", now, now + timedelta(days=365))
+        replaced = await session.get(Subscription, old_sub.id, populate_existing=True)
+        assert replaced.status == SubscriptionStatus.CANCELED
+        assert replaced.replaced_by_id == new_sub.id
+
+        analytics_repo = AdminAnalyticsRepository(session)
+        for n in (2, 1, 0):
+            await analytics_repo.refresh_day(today - timedelta(days=n))
+        await session.commit()
+
+    days = [str(today - timedelta(days=n)) for n in (2, 1, 0)]
+    response = await client.get("/analytics/subscriptions", headers=admin_headers,
+                                params={"start": days[0], "end": days[-1], "currency": currency})
+    assert response.status_code == status.HTTP_200_OK
+    assert [
+        (row["day"], row["new"], row["canceled"], row["active"], row["mrr_cents"]) for row in response.json()
+    ] == [
+        (days[0], 2, 0, 1, 3000),
+        (days[1], 0, 0, 1, 3000),
+        (days[2], 1, 0, 1, 1000),
+    ]
+
+
+@pytest.mark.asyncio
+async def test_daily_rollups_do_not_count_a_renewal_as_new(client: AsyncClient, admin_headers):
+    now = datetime.now(timezone.utc)
+    today = now.date()
+    suffix = uuid4().hex[:6]
+    currency = f"R{suffix[:5]}".upper()
+    plan = Plan(id=uuid4(), name="Renewal Monthly", code=f"renewal-m-{suffix}", price_cents=3000, currency=currency,
+                billing_period=BillingPeriod.MONTHLY, is_active=True)
+    user = User(id=uuid4(), email=f"renewal-{suffix}@test.com", username=f"renewal_{suffix}", password="x",
+                is_active=True, is_verified=True, provider=Provider.LOCAL)
+    sub = Subscription(id=uuid4(), user_id=user.id, plan_id=plan.id, status=SubscriptionStatus.ACTIVE,
+                       provider=PaymentProvider.STRIPE, provider_subscription_id=f"sub_renewal_{suffix}",
+                       created_at=now - timedelta(days=2), started_at=now - timedelta(days=2),
+                       current_period_end=now + timedelta(days=1))
+    async with TestSessionDB() as session:
+        session.add_all([plan, user])
+        await session.flush()
+        session.add(sub)
+        await session.commit()
+
+    days = [today - timedelta(days=n) for n in (2, 1, 0)]
+    query = {"start": str(days[0]), "end": str(days[-1]), "currency": currency}
+
+    async def _series():
+        async with TestSessionDB() as session:
+            analytics_repo = AdminAnalyticsRepository(session)
+            for day in days:
+                await analytics_repo.refresh_day(day)
+            await session.commit()
+        response = await client.get("/analytics/subscriptions", headers=admin_headers, params=query)
+        return [(row["day"], row["new"], row["active"], row["mrr_cents"]) for row in response.json()]
+
+    before = await _series()
+    async with TestSessionDB() as session:
+        await SubscriptionRepoistory(session).update_subscription_period(
+            PaymentProvider.STRIPE, f"sub_renewal_{suffix}", now, now + timedelta(days=30))
+        touched = await AdminAnalyticsRepository(session).days_touched_since(now)
+
+    # the renewal moves started_at to today; the subscription is still new two days ago and active since
+    assert await _series() == before == [
+        (str(days[0]), 1, 1, 3000),
+        (str(days[1]), 0, 1, 3000),
+        (str(days[2]), 0, 1, 3000),
+    ]
+    assert days[0] in touched
+
+
+@pytest.mark.asyncio
+async def test_analytics_rejects_oversized_range(client: AsyncClient, admin_headers):
+    response = await client.get("/analytics/revenue", headers=admin_headers,
+                                params={"start": "2024-01-01", "end": "2026-01-01"})
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
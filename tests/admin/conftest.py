@@ -0,0 +1,75 @@
+import pytest
+from uuid import uuid4
+from datetime import datetime, timezone, timedelta
+from unittest.mock import AsyncMock, MagicMock
+from sqlalchemy import select
+from src.hashing import hash_password
+from tests.conftest import TestSessionDB
+from src.auth.models import User, Provider
+from src.billing.models import Plan, BillingPeriod, Subscription, SubscriptionStatus, PaymentProvider
+
+
+@pytest.fixture()
+async def admin_user():
+    async with TestSessionDB() as session:
+        result = await session.execute(
+            select(User).where(User.email == "admin@test.com")
+        )
+        user = result.scalar_one_or_none()
+        if user:
+            return user
+
+        hashed = await hash_password("123456")
+
+        user = User(
+            id=uuid4(),
+            email="admin@test.com",
+            username="admin_user",
+            password=hashed,
+            is_active=True,
+            is_verified=True,
+            is_admin=True,
+            provider=Provider.LOCAL,
+        )
+        session.add(user)
+        await session.commit()
+        await session.refresh(user)
+        return user
+
+
+@pytest.fixture
+async def admin_headers(client, admin_user):
+    response = await client.post("/login", json={
+        "email": admin_user.email,
+        "password": "123456"
+    })
+    assert response.status_code == 200
+    return {"Authorization": f"Bearer {response.json()['token']}"}
+
+
+@pytest.fixture()
+async def subscription():
+    """An active subscription of a fresh user on a fresh plan."""
+    suffix = uuid4().hex[:8]
+    user = User(id=uuid4(), email=f"subscriber-{suffix}@test.com", username=f"subscriber_{suffix}", password="x",
+                is_active=True, is_verified=True, provider=Provider.LOCAL)
+    plan = Plan(id=uuid4(), name="Admin Test Plan", code=f"admin-{suffix}", price_cents=1000,
+                billing_period=BillingPeriod.MONTHLY, currency="USD", is_active=True)
+    async with TestSessionDB() as session:
+        session.add_all([user, plan])
+        await session.flush()
+        subscription = Subscription(id=uuid4(), user_id=user.id, plan_id=plan.id, status=SubscriptionStatus.ACTIVE,
+                                    provider=PaymentProvider.MANUAL,
+                                    current_period_end=datetime.now(timezone.utc) + timedelta(days=30))
+        session.add(subscription)
+        await session.commit()
+        return subscription
+
+
+@pytest.fixture()
+def mock_stripe_client(monkeypatch):
+    """Stands in for the async StripeClient for tests that drive the Stripe gateway."""
+    client = MagicMock()
+    client.v1.subscriptions.cancel_async = AsyncMock()
+    monkeypatch.setattr("src.billing.stripe_gateway.get_stripe_client", lambda: client)
+    return client
@@ -1,33 +1,50 @@
 import pytest
 from datetime import datetime, timezone, timedelta
 from uuid import uuid4
-from unittest.mock import patch
+from unittest.mock import ANY, patch
 from httpx import AsyncClient
 from fastapi import status
+from sqlalchemy import select
+from src import outbox
 from src.config import settings
 from src.hashing import hash_password
 from src.jwt import generate_token
+from src.models import TaskOutbox
 from src.auth.models import LoginCode, Provider, User
+from src.auth.tasks import send_verification_email_task, send_password_reset_email_task, send_login_code_task
+from src.billing.tasks import provision_stripe_customer_task
+from tests.conftest import TestSessionDB
 
 
 
 @pytest.mark.asyncio
-async def test_register_user_success(client: AsyncClient):
-    with patch("src.auth.emails.Emails.send_verification_email") as mock_send_email:
-        payload = {
-            "email": "sam@example.com",
-            "username": "sam",
-            "password": "password123"
-        }
-
-        response = await client.post("/register", json=payload)
-        assert response.status_code == 201
-        mock_send_email.assert_called_once()
-        args, kwargs = mock_send_email.call_args
-        assert args[0] == "sam@example.com"
-        data = response.json()
-        assert data["email"] == payload["email"]
-        assert data["username"] == payload["username"]
+async def test_register_user_success(client: AsyncClient, mock_stage_task):
+    payload = {
+        "email": "sam@example.com",
+        "username": "sam",
+        "password": "password123"
+    }
+
+    response = await client.post("/register", json=payload)
+    assert response.status_code == 201
+    data = response.json()
+    assert data["email"] == payload["email"]
+    assert data["username"] == payload["username"]
+    mock_stage_task.assert_called_once_with(ANY, send_verification_email_task, "sam@example.com", data["id"])
+
+
+@pytest.mark.asyncio
+async def test_register_user_commits_verification_email_with_user(client: AsyncClient, monkeypatch):
+    monkeypatch.setattr("src.auth.service.stage_task", outbox.stage_task)
+    response = await client.post("/register", json={"email": "outbox@example.com", "username": "outbox_user",
+                                                    "password": "password123"})
+    assert response.status_code == 201
+
+    async with TestSessionDB() as session:
+        rows = (await session.execute(
+            select(TaskOutbox).where(TaskOutbox.task_name == send_verification_email_task.name)
+        )).scalars().all()
+    assert ["outbox@example.com", response.json()["id"]] in [row.args for row in rows]
 
 
 @pytest.mark.asyncio
@@ -176,6 +193,22 @@ async def test_verify_email_success(client: AsyncClient, unverified_user):
     assert response.json()["message"] == "Email is Verified"
 
 
+@pytest.mark.asyncio
+async def test_verify_email_commits_stripe_provisioning_with_verification(client: AsyncClient, unverified_user, monkeypatch):
+    monkeypatch.setattr("src.auth.service.stage_task", outbox.stage_task)
+    token, _, _ = generate_token(data={"sub": str(unverified_user.id)}, mins=5, secret_key=settings.validation_secret_key)
+    response = await client.get("/verify", params={"token": token})
+    assert response.status_code == status.HTTP_202_ACCEPTED
+
+    async with TestSessionDB() as session:
+        user = await session.get(User, unverified_user.id)
+        rows = (await session.execute(
+            select(TaskOutbox).where(TaskOutbox.task_name == provision_stripe_customer_task.name)
+        )).scalars().all()
+    assert user.is_verified is True
+    assert [str(unverified_user.id)] in [row.args for row in rows]
+
+
 @pytest.mark.asyncio
 async def test_verify_email_already_verified(client: AsyncClient, active_user):
     token, _, _ = generate_token(
@@ -189,42 +222,39 @@ async def test_verify_email_already_verified(client: AsyncClient, active_user):
 
 
 @pytest.mark.asyncio
-async def test_request_verify_email_sends_for_unverified(client: AsyncClient, unverified_user):
+async def test_request_verify_email_sends_for_unverified(client: AsyncClient, unverified_user, mock_stage_task):
     login_payload = {"email": unverified_user.email, "password": "123456"}
     login_response = await client.post("/login", json=login_payload)
     assert login_response.status_code == status.HTTP_200_OK
     token = login_response.json()["token"]
 
     headers = {"Authorization": f"Bearer {token}"}
-    with patch("src.auth.emails.Emails.send_verification_email") as mock_send_email:
-        response = await client.post("/request/verify", headers=headers)
-        assert response.status_code == status.HTTP_202_ACCEPTED
-        assert response.json()["message"] == "New Verification Email has been sent"
-        mock_send_email.assert_called_once_with(unverified_user.email, unverified_user.id)
+    response = await client.post("/request/verify", headers=headers)
+    assert response.status_code == status.HTTP_202_ACCEPTED
+    assert response.json()["message"] == "New Verification Email has been sent"
+    mock_stage_task.assert_called_once_with(ANY, send_verification_email_task, unverified_user.email,
+                                            str(unverified_user.id))
 
 
 @pytest.mark.asyncio
-async def test_request_verify_email_already_verified(client: AsyncClient, logged_in_user, auth_headers):
-    with patch("src.auth.emails.Emails.send_verification_email") as mock_send_email:
-        response = await client.post("/request/verify", headers=auth_headers)
-        assert response.status_code == status.HTTP_202_ACCEPTED
-        assert response.json()["message"] == "Email is already verified"
-        mock_send_email.assert_not_called()
+async def test_request_verify_email_already_verified(client: AsyncClient, logged_in_user, auth_headers, mock_stage_task):
+    response = await client.post("/request/verify", headers=auth_headers)
+    assert response.status_code == status.HTTP_202_ACCEPTED
+    assert response.json()["message"] == "Email is already verified"
+    mock_stage_task.assert_not_called()
 
 
 @pytest.mark.asyncio
-async def test_forget_password_sends_email_when_user_exists(client: AsyncClient, active_user):
-    with patch("src.auth.emails.Emails.send_password_reset_email") as mock_send_email:
-        response = await client.post("/forget-password", json={"email": active_user.email})
-        assert response.status_code == status.HTTP_202_ACCEPTED
-        assert "password reset link" in response.json()["message"]
-        mock_send_email.assert_called_once_with(active_user.email, active_user.id)
+async def test_forget_password_sends_email_when_user_exists(client: AsyncClient, active_user, mock_stage_task):
+    response = await client.post("/forget-password", json={"email": active_user.email})
+    assert response.status_code == status.HTTP_202_ACCEPTED
+    assert "password reset link" in response.json()["message"]
+    mock_stage_task.assert_called_once_with(ANY, send_password_reset_email_task, active_user.email, str(active_user.id))
 
 
 @pytest.mark.asyncio
-async def test_request_login_code_success(client: AsyncClient, active_user):
-    with patch("src.auth.utils.generate_otp_code") as mock_generate, \
-        patch("src.auth.emails.Emails.send_login_code") as mock_send_code:
+async def test_request_login_code_success(client: AsyncClient, active_user, mock_stage_task):
+    with patch("src.auth.utils.generate_otp_code") as mock_generate:
         hashed = await hash_password("123456")
         login_code = LoginCode(
             user_id=active_user.id,
@@ -235,13 +265,12 @@ async def test_request_login_code_success(client: AsyncClient, active_user):
         response = await client.post("/request/login-code", json={"email": active_user.email})
         assert response.status_code == status.HTTP_200_OK
         assert "login code" in response.json()["message"]
-        mock_send_code.assert_called_once_with(active_user.email, "123456")
+        mock_stage_task.assert_called_once_with(ANY, send_login_code_task, active_user.email, "123456")
 
 
 @pytest.mark.asyncio
 async def test_login_with_code_success(client: AsyncClient, active_user):
-    with patch("src.auth.utils.generate_otp_code") as mock_generate, \
-        patch("src.auth.emails.Emails.send_login_code"):
+    with patch("src.auth.utils.generate_otp_code") as mock_generate:
         hashed = await hash_password("123456")
         login_code = LoginCode(
             user_id=active_user.id,
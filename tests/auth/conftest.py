@@ -3,9 +3,17 @@ from uuid import uuid4
 from sqlalchemy import select
 from src.hashing import hash_password
 from tests.conftest import TestSessionDB
+from unittest.mock import MagicMock
 from src.auth.models import User, Provider
 
 
+@pytest.fixture(autouse=True)
+def mock_stage_task(monkeypatch):
+    """Records the tasks the auth service stages, so service tests with mocked repositories need no session."""
+    stage_mock = MagicMock()
+    monkeypatch.setattr("src.auth.service.stage_task", stage_mock)
+    return stage_mock
+
 
 @pytest.fixture()
 async def active_user():
@@ -9,6 +9,8 @@ from src.hashing import verify_password, hash_password
 from src.jwt import generate_token, verify_token
 from src.auth.service import UserService
 from src.auth.models import User, Provider, LoginCode
+from src.auth.tasks import send_password_reset_email_task, send_login_code_task
+from src.billing.tasks import provision_stripe_customer_task
 from src.auth.schemas import UserCreateRequest, UserLoginRequest, NewPasswordRequest, ChangePasswordRequest, ForgetPasswordRequest, LoginCodeRequest, LoginWithCodeRequest
 
 
@@ -353,7 +355,7 @@ async def test_refresh_token_invalid_token():
 
 
 @pytest.mark.asyncio
-async def test_validate_user():
+async def test_validate_user(mock_stage_task):
     user_repo = AsyncMock()
     user = User(
         id=uuid4(),
@@ -377,6 +379,23 @@ async def test_validate_user():
         assert result is True
         user_repo.update.assert_awaited_once_with(user)
         assert user.is_verified is True
+        mock_stage_task.assert_called_once_with(user_repo.db, provision_stripe_customer_task, str(user.id))
+
+
+@pytest.mark.asyncio
+async def test_validate_user_stages_provisioning_before_commit(mock_stage_task):
+    user = User(id=uuid4(), email="sam@example.com", username="sam", is_active=True, is_verified=False)
+    user_repo = AsyncMock()
+    user_repo.get_by_id.return_value = user
+    calls = []
+    mock_stage_task.side_effect = lambda *args: calls.append("stage")
+    user_repo.update.side_effect = lambda *args: calls.append("commit")
+    service = UserService(user_repo, AsyncMock(), AsyncMock())
+
+    with patch("src.auth.service.verify_token", return_value={"sub": str(user.id)}):
+        assert await service.validate_user("valid_token") is True
+    # staged in the transaction that marks the user verified, so it commits or rolls back with it
+    assert calls == ["stage", "commit"]
 
 
 @pytest.mark.asyncio
@@ -422,7 +441,7 @@ async def test_validate_user_user_not_found():
 
 
 @pytest.mark.asyncio
-async def test_forget_password_user_found():
+async def test_forget_password_user_found(mock_stage_task):
     user_repo = AsyncMock()
     user = User(
         id=uuid4(),
@@ -439,10 +458,12 @@ async def test_forget_password_user_found():
     data = ForgetPasswordRequest(email="sam@example.com")
     result = await service.forget_password(data)
     assert result == user
+    mock_stage_task.assert_called_once_with(user_repo.db, send_password_reset_email_task, user.email, str(user.id))
+    user_repo.db.commit.assert_awaited_once()
 
 
 @pytest.mark.asyncio
-async def test_forget_password_user_missing():
+async def test_forget_password_user_missing(mock_stage_task):
     user_repo = AsyncMock()
     user_repo.get_by_email.return_value = None
     token_repo = AsyncMock()
@@ -452,6 +473,7 @@ async def test_forget_password_user_missing():
     data = ForgetPasswordRequest(email="missing@example.com")
     result = await service.forget_password(data)
     assert result is None
+    mock_stage_task.assert_not_called()
 
 
 @pytest.mark.asyncio
@@ -572,7 +594,7 @@ async def test_deactivate_user_success():
 
 
 @pytest.mark.asyncio
-async def test_request_login_code():
+async def test_request_login_code(mock_stage_task):
     user_repo = AsyncMock()
     user = User(
         id=uuid4(),
@@ -598,6 +620,7 @@ async def test_request_login_code():
         user_repo.get_by_email.assert_awaited_once_with("sam@example.com")
         code_repo.delete.assert_awaited_once_with(user.id)
         code_repo.create.assert_awaited_once_with(otp_code_obj)
+        mock_stage_task.assert_called_once_with(code_repo.db, send_login_code_task, user.email, code_value)
 
 
 @pytest.mark.asyncio
@@ -731,7 +754,7 @@ async def test_login_with_code_invalid_code():
 
 
 @pytest.mark.asyncio
-async def test_login_with_google_success():
+async def test_login_with_google_success(mock_stage_task):
     scope = {
         "type": "http",
         "query_string": b"code=valid_code&state=123",
@@ -780,6 +803,8 @@ async def test_login_with_google_success():
 
         repo.get_by_email.assert_awaited_once_with("sam@example.com")
         repo.create.assert_awaited_once()
+        staged_user = repo.create.await_args.args[0]
+        mock_stage_task.assert_called_once_with(repo.db, provision_stripe_customer_task, str(staged_user.id))
 
 
 @pytest.mark.asyncio
@@ -6,8 +6,23 @@ from fastapi import status
 from fastapi.exceptions import ResponseValidationError
 from httpx import AsyncClient
 from uuid import uuid4
-from unittest.mock import ANY, AsyncMock
-from src.billing.utils import serialize_subscription
+from unittest.mock import ANY, AsyncMock, MagicMock
+from sqlalchemy import delete, select
+from src.billing.constants import SubscriptionEmail
+from src.billing.models import (
+    Subscription, SubscriptionStatus, PaymentProvider, StripeEvent, StripeEventStatus, Payment, PaymentStatus, SyncCursor,
+)
+from src.billing.service import (
+    process_stripe_events, reconcile_stripe, StripeReconciliationService, expire_lapsed_subscriptions,
+)
+from src.billing.repository import StripeEventRepository, SubscriptionRepoistory
+from src.billing import tasks
+from src.auth.models import User, Provider
+from tests.conftest import TestSessionDB
+
+
+async def _drain_stripe_inbox() -> int:
+    return await process_stripe_events(TestSessionDB)
 
 
 @pytest.mark.asyncio
@@ -146,6 +161,33 @@ async def test_get_my_subscription(
     assert data["status"] == "active"
 
 
+@pytest.mark.asyncio
+async def test_get_my_subscription_prefers_latest_period_end(
+    client: AsyncClient, user_headers, test_subscription
+):
+    older = Subscription(
+        user_id=test_subscription.user_id,
+        plan_id=test_subscription.plan_id,
+        status=SubscriptionStatus.CANCELED,
+        provider=PaymentProvider.STRIPE,
+        provider_subscription_id=f"sub_{uuid4().hex[:8]}",
+        current_period_end=datetime.now(timezone.utc) + timedelta(days=5),
+    )
+    async with TestSessionDB() as session:
+        session.add(older)
+        await session.commit()
+
+    try:
+        response = await client.get("/billing/subscriptions/me", headers=user_headers)
+    finally:
+        async with TestSessionDB() as session:
+            await session.execute(delete(Subscription).where(Subscription.id == older.id))
+            await session.commit()
+
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json()["id"] == str(test_subscription.id)
+
+
 @pytest.mark.asyncio
 async def test_cancel_subscription(
     client: AsyncClient, user_headers, test_subscription
@@ -172,14 +214,74 @@ async def test_subscribe_to_plan_starts_checkout(client: AsyncClient, logged_in_
     mock_create_checkout.assert_awaited_once()
 
 
+@pytest.mark.asyncio
+async def test_subscribe_replays_response_for_same_idempotency_key(
+    client: AsyncClient, logged_in_user_no_subscription, test_plan, mock_create_checkout, in_memory_redis
+):
+    headers = {"Authorization": f"Bearer {logged_in_user_no_subscription['token']}", "Idempotency-Key": "subscribe-1"}
+    first = await client.post("/billing/subscriptions/subscribe", json={"plan_code": test_plan.code}, headers=headers)
+    second = await client.post("/billing/subscriptions/subscribe", json={"plan_code": test_plan.code}, headers=headers)
+
+    assert first.status_code == second.status_code == status.HTTP_201_CREATED
+    assert second.json() == first.json()
+    assert second.headers["Idempotent-Replayed"] == "true"
+    mock_create_checkout.assert_awaited_once()
+
+    other_body = await client.post("/billing/subscriptions/subscribe", json={"plan_code": "other"}, headers=headers)
+    assert other_body.status_code == status.HTTP_422_UNPROCESSABLE_CONTENT
+
+
+@pytest.mark.asyncio
+async def test_idempotency_ignores_auth_routes_and_fingerprints_the_query_string(
+    client: AsyncClient, logged_in_user_no_subscription, test_plan, mock_create_checkout, in_memory_redis
+):
+    response = await client.post("/refresh-token", params={"token": "invalidtokenvalue"},
+                                 headers={"Idempotency-Key": "refresh-1"})
+    assert response.status_code == status.HTTP_401_UNAUTHORIZED
+    assert "Idempotent-Replayed" not in response.headers
+    assert in_memory_redis.values == {}
+
+    headers = {"Authorization": f"Bearer {logged_in_user_no_subscription['token']}", "Idempotency-Key": "subscribe-3"}
+    first = await client.post("/billing/subscriptions/subscribe", params={"source": "a"},
+                              json={"plan_code": test_plan.code}, headers=headers)
+    assert first.status_code == status.HTTP_201_CREATED
+
+    other_query = await client.post("/billing/subscriptions/subscribe", params={"source": "b"},
+                                    json={"plan_code": test_plan.code}, headers=headers)
+    assert other_query.status_code == status.HTTP_422_UNPROCESSABLE_CONTENT
+    mock_create_checkout.assert_awaited_once()
+
+
+@pytest.mark.asyncio
+async def test_subscribe_rejects_retry_while_first_request_runs(
+    client: AsyncClient, logged_in_user_no_subscription, test_plan, mock_create_checkout, in_memory_redis
+):
+    headers = {"Authorization": f"Bearer {logged_in_user_no_subscription['token']}", "Idempotency-Key": "subscribe-2"}
+    body = json.dumps({"plan_code": test_plan.code}).encode()
+
+    async def _slow_checkout(*args, **kwargs):
+        retry = await client.post("/billing/subscriptions/subscribe", content=body,
+                                  headers={**headers, "Content-Type": "application/json"})
+        assert retry.status_code == status.HTTP_409_CONFLICT
+        assert retry.headers["Retry-After"] == "1"
+        return "https://stripe.test/checkout"
+    mock_create_checkout.side_effect = _slow_checkout
+
+    response = await client.post("/billing/subscriptions/subscribe", content=body,
+                                 headers={**headers, "Content-Type": "application/json"})
+    assert response.status_code == status.HTTP_201_CREATED
+    mock_create_checkout.assert_awaited_once()
+
+
 @pytest.mark.asyncio
 async def test_stripe_webhook_checkout_triggers_email(
     client: AsyncClient,
-    user_headers,
+    clear_stripe_events,
     mock_user_subscribe,
     monkeypatch,
 ):
     event_payload = {
+        "id": "evt_checkout",
         "type": "checkout.session.completed",
         "data": {"object": {"id": "cs_test", "subscription": "sub_123", "customer": "cus_123"}},
     }
@@ -189,10 +291,11 @@ async def test_stripe_webhook_checkout_triggers_email(
     response = await client.post(
         "/billing/stripe/webhook",
         content=json.dumps(event_payload),
-        headers={**user_headers, "Stripe-Signature": "sig"},
+        headers={"Stripe-Signature": "sig"},
     )
 
     assert response.status_code == status.HTTP_200_OK
+    assert await _drain_stripe_inbox() == 1
     assert response.json() is True
     mock_user_subscribe.assert_awaited_once_with(event_payload["data"]["object"], ANY, ANY)
 
@@ -200,8 +303,8 @@ async def test_stripe_webhook_checkout_triggers_email(
 @pytest.mark.asyncio
 async def test_stripe_webhook_invoice_payment_triggers_update_email(
     client: AsyncClient,
-    user_headers,
-    mock_send_update_subscription_email_task,
+    clear_stripe_events,
+    mock_send_subscription_emails_task,
     monkeypatch,
 ):
     invoice = {
@@ -215,7 +318,7 @@ async def test_stripe_webhook_invoice_payment_triggers_update_email(
         "amount_paid": 5000,
         "currency": "usd",
     }
-    event_payload = {"type": "invoice.payment_succeeded", "data": {"object": invoice}}
+    event_payload = {"id": "evt_invoice_paid", "type": "invoice.payment_succeeded", "data": {"object": invoice}}
     run_mock = AsyncMock(return_value=event_payload)
     monkeypatch.setattr("src.billing.service.run_in_threadpool", run_mock)
 
@@ -238,21 +341,22 @@ async def test_stripe_webhook_invoice_payment_triggers_update_email(
     response = await client.post(
         "/billing/stripe/webhook",
         content=json.dumps(event_payload),
-        headers={**user_headers, "Stripe-Signature": "sig"},
+        headers={"Stripe-Signature": "sig"},
     )
 
     assert response.status_code == status.HTTP_200_OK
+    assert await _drain_stripe_inbox() == 1
     assert response.json() is True
     handle_payment_mock.assert_awaited_once_with(invoice, ANY)
-    mock_send_update_subscription_email_task.assert_called_once_with(serialize_subscription(updated_sub))
+    mock_send_subscription_emails_task.assert_called_once_with(str(updated_sub.id), SubscriptionEmail.RENEWED)
     record_payment_mock.assert_awaited_once_with(invoice, updated_sub, ANY)
 
 
 @pytest.mark.asyncio
 async def test_stripe_webhook_invoice_payment_failed_sends_email(
     client: AsyncClient,
-    user_headers,
-    mock_send_payment_failed_email_task,
+    clear_stripe_events,
+    mock_send_subscription_emails_task,
     monkeypatch,
 ):
     invoice = {
@@ -262,7 +366,7 @@ async def test_stripe_webhook_invoice_payment_failed_sends_email(
         "amount_paid": 0,
         "currency": "usd",
     }
-    event_payload = {"type": "invoice.payment_failed", "data": {"object": invoice}}
+    event_payload = {"id": "evt_invoice_failed", "type": "invoice.payment_failed", "data": {"object": invoice}}
     run_mock = AsyncMock(return_value=event_payload)
     monkeypatch.setattr("src.billing.service.run_in_threadpool", run_mock)
 
@@ -283,22 +387,23 @@ async def test_stripe_webhook_invoice_payment_failed_sends_email(
     response = await client.post(
         "/billing/stripe/webhook",
         content=json.dumps(event_payload),
-        headers={**user_headers, "Stripe-Signature": "sig"},
+        headers={"Stripe-Signature": "sig"},
     )
 
     assert response.status_code == status.HTTP_200_OK
+    assert await _drain_stripe_inbox() == 1
     handler_mock.assert_awaited_once_with(invoice, ANY)
-    mock_send_payment_failed_email_task.assert_called_once_with(serialize_subscription(failed_sub))
+    mock_send_subscription_emails_task.assert_called_once_with(str(failed_sub.id), SubscriptionEmail.PAYMENT_FAILED)
 
 
 @pytest.mark.asyncio
 async def test_stripe_webhook_subscription_deleted_sends_cancel_email(
     client: AsyncClient,
-    user_headers,
-    mock_send_cancel_subscription_email_task,
+    clear_stripe_events,
+    mock_send_subscription_emails_task,
     monkeypatch,
 ):
-    event_payload = {"type": "customer.subscription.deleted", "data": {"object": {"id": "sub_789"}}}
+    event_payload = {"id": "evt_sub_deleted", "type": "customer.subscription.deleted", "data": {"object": {"id": "sub_789"}}}
     run_mock = AsyncMock(return_value=event_payload)
     monkeypatch.setattr("src.billing.service.run_in_threadpool", run_mock)
 
@@ -319,12 +424,60 @@ async def test_stripe_webhook_subscription_deleted_sends_cancel_email(
     response = await client.post(
         "/billing/stripe/webhook",
         content=json.dumps(event_payload),
-        headers={**user_headers, "Stripe-Signature": "sig"},
+        headers={"Stripe-Signature": "sig"},
     )
 
     assert response.status_code == status.HTTP_200_OK
+    assert await _drain_stripe_inbox() == 1
     handler_mock.assert_awaited_once_with(event_payload["data"]["object"], ANY)
-    mock_send_cancel_subscription_email_task.assert_called_once_with(serialize_subscription(canceled_sub))
+    mock_send_subscription_emails_task.assert_called_once_with(str(canceled_sub.id), SubscriptionEmail.CANCELED)
+
+
+@pytest.mark.asyncio
+async def test_stripe_webhook_redelivery_is_stored_once_and_failures_recorded(
+    client: AsyncClient,
+    clear_stripe_events,
+    monkeypatch,
+):
+    event_payload = {"id": "evt_redelivered", "type": "customer.subscription.deleted", "data": {"object": {"id": "sub_x"}}}
+    monkeypatch.setattr("src.billing.service.run_in_threadpool", AsyncMock(return_value=event_payload))
+    monkeypatch.setattr(
+        "src.billing.service.StripeGateway.handle_subscription_deleted",
+        AsyncMock(side_effect=RuntimeError("boom")),
+    )
+
+    for _ in range(2):
+        response = await client.post(
+            "/billing/stripe/webhook",
+            content=json.dumps(event_payload),
+            headers={"Stripe-Signature": "sig"},
+        )
+        assert response.status_code == status.HTTP_200_OK
+
+    assert await _drain_stripe_inbox() == 1
+
+    async with TestSessionDB() as session:
+        events = (await session.execute(select(StripeEvent))).scalars().all()
+    assert len(events) == 1
+    assert events[0].status == StripeEventStatus.FAILED
+    assert events[0].attempts == 1
+    assert "boom" in events[0].last_error
+
+
+@pytest.mark.asyncio
+async def test_stripe_inbox_serializes_events_of_one_subscription(clear_stripe_events):
+    async with TestSessionDB() as session:
+        repo = StripeEventRepository(session)
+        for stripe_event_id, ordering_key in [("evt_a1", "sub_a"), ("evt_a2", "sub_a"), ("evt_b1", "sub_b")]:
+            await repo.ingest(stripe_event_id, "invoice.payment_succeeded", {}, ordering_key)
+
+        first = await repo.claim_batch(10, 5, 300, 60)
+        assert [event.stripe_event_id for event in first] == ["evt_a1", "evt_b1"]
+        assert await repo.claim_batch(10, 5, 300, 60) == []
+
+        await repo.mark_processed(first[0].id)
+        second = await repo.claim_batch(10, 5, 300, 60)
+        assert [event.stripe_event_id for event in second] == ["evt_a2"]
 
 
 @pytest.mark.asyncio
@@ -365,3 +518,261 @@ async def test_get_my_payments_not_found(client: AsyncClient, user_headers, clea
 
     assert response.status_code == status.HTTP_200_OK
     assert response.json() == []
+
+
+@pytest.mark.asyncio
+async def test_backfill_enqueues_verified_users_without_customer(monkeypatch):
+    suffix = uuid4().hex[:8]
+    users = [
+        User(email=f"backfill-{suffix}-{i}@test.com", username=f"backfill_{suffix}_{i}", password="x",
+             is_active=True, is_verified=verified, provider=Provider.LOCAL, stripe_customer_id=customer_id)
+        for i, (verified, customer_id) in enumerate([(True, None), (True, None), (True, "cus_existing"), (False, None)])
+    ]
+    async with TestSessionDB() as session:
+        session.add_all(users)
+        await session.commit()
+
+    delay_mock = MagicMock()
+    monkeypatch.setattr(tasks, "worker_async_session", TestSessionDB)
+    monkeypatch.setattr(tasks.provision_stripe_customer_task, "delay", delay_mock)
+    monkeypatch.setattr(tasks.settings, "stripe_customer_backfill_batch_size", 1)
+
+    enqueued = await tasks._backfill_stripe_customers()
+
+    enqueued_ids = {call.args[0] for call in delay_mock.call_args_list}
+    assert enqueued == len(enqueued_ids)
+    assert {str(users[0].id), str(users[1].id)} <= enqueued_ids
+    assert str(users[2].id) not in enqueued_ids
+    assert str(users[3].id) not in enqueued_ids
+
+
+@pytest.mark.asyncio
+async def test_subscription_emails_coalesce_per_user_and_report_failures(
+    monkeypatch, test_subscription, normal_user, test_plan
+):
+    suffix = uuid4().hex[:8]
+    other_user = User(id=uuid4(), email=f"coalesce-{suffix}@test.com", username=f"coalesce_{suffix}", password="x",
+                      is_active=True, is_verified=True, provider=Provider.LOCAL)
+    other_subscription_id = uuid4()
+    async with TestSessionDB() as session:
+        session.add(other_user)
+        await session.flush()
+        session.add(Subscription(id=other_subscription_id, user_id=other_user.id, plan_id=test_plan.id,
+                                 status=SubscriptionStatus.ACTIVE, provider=PaymentProvider.MANUAL,
+                                 current_period_end=datetime.now(timezone.utc) + timedelta(days=30)))
+        await session.commit()
+    sent = AsyncMock()
+    summary = AsyncMock(side_effect=ConnectionError("smtp down"))
+    monkeypatch.setattr(tasks, "worker_async_session", TestSessionDB)
+    monkeypatch.setitem(tasks._SUBSCRIPTION_EMAILS, SubscriptionEmail.CREATED, sent)
+    monkeypatch.setattr(tasks.email_service, "send_subscription_summary_email", summary)
+    notifications = [
+        [str(test_subscription.id), "canceled"],
+        [str(other_subscription_id), "created"],
+        [str(uuid4()), "renewed"],
+        [str(test_subscription.id), "created"],
+        [str(test_subscription.id), "canceled"],
+    ]
+
+    failed, error = await tasks._send_subscription_emails(notifications)
+
+    # one summary for the user with several notifications, the repeated one dropped
+    assert failed == [[str(test_subscription.id), "canceled"], [str(test_subscription.id), "created"]]
+    assert isinstance(error, ConnectionError)
+    changes = summary.await_args.args[0]
+    assert [change["title"] for change in changes] == ["Subscription canceled", "Subscription started"]
+    assert {change["user"]["email"] for change in changes} == {normal_user.email}
+    sent.assert_awaited_once()
+    assert sent.await_args.args[0]["id"] == str(other_subscription_id)
+    assert sent.await_args.args[0]["user"]["email"] == other_user.email
+
+
+class _FakeListPage:
+    def __init__(self, objects):
+        self.objects = objects
+
+    async def auto_paging_iter(self):
+        for stripe_object in self.objects:
+            yield stripe_object
+
+
+@pytest.mark.asyncio
+async def test_reconcile_stripe_repairs_missed_webhooks(monkeypatch, mock_stripe_client, test_plan):
+    suffix = uuid4().hex[:8]
+    user = User(email=f"reconcile-{suffix}@test.com", username=f"reconcile_{suffix}", password="x",
+                is_active=True, is_verified=True, provider=Provider.LOCAL, stripe_customer_id=f"cus_{suffix}")
+    renewing_user = User(id=uuid4(), email=f"renewing-{suffix}@test.com", username=f"renewing_{suffix}", password="x",
+                         is_active=True, is_verified=True, provider=Provider.LOCAL)
+    now = int(datetime.now(timezone.utc).timestamp())
+    period_end = now + 30 * 24 * 3600
+    # created before the cursor, so only its renewal invoice is listed
+    renewing = Subscription(user_id=renewing_user.id, plan_id=test_plan.id, status=SubscriptionStatus.ACTIVE,
+                            provider=PaymentProvider.STRIPE, provider_subscription_id=f"sub_renewing_{suffix}",
+                            current_period_end=datetime.fromtimestamp(now, tz=timezone.utc))
+    async with TestSessionDB() as session:
+        session.add_all([user, renewing_user])
+        await session.flush()
+        session.add(renewing)
+        await session.execute(delete(SyncCursor))
+        await session.commit()
+
+    subscriptions = [
+        {   # newest first, as Stripe lists them; mapped through customer and price
+            "id": f"sub_new_{suffix}", "created": now, "status": "active", "customer": f"cus_{suffix}",
+            "metadata": {}, "cancel_at_period_end": False, "canceled_at": None, "ended_at": None,
+            "items": {"data": [{"price": {"id": test_plan.stripe_price_id},
+                                "current_period_start": now, "current_period_end": period_end}]},
+        },
+        {
+            "id": f"sub_old_{suffix}", "created": now - 60, "status": "canceled", "customer": f"cus_{suffix}",
+            "metadata": {"user_id": str(user.id), "plan_id": str(test_plan.id)},
+            "cancel_at_period_end": False, "canceled_at": now - 30, "ended_at": now - 30,
+            "items": {"data": [{"price": {"id": "price_unknown"},
+                                "current_period_start": now - 60, "current_period_end": period_end}]},
+        },
+        {
+            "id": f"sub_unknown_{suffix}", "created": now - 90, "status": "active", "customer": "cus_nobody",
+            "metadata": {}, "items": {"data": [{"price": {"id": "price_unknown"}}]},
+        },
+    ]
+    invoices = [
+        {
+            "id": f"in_{suffix}", "created": now, "status": "paid", "amount_paid": 1000, "currency": "usd",
+            "status_transitions": {"paid_at": now},
+            "parent": {"subscription_details": {"subscription": f"sub_new_{suffix}"}},
+            "lines": {"data": [{"period": {"start": now, "end": period_end}}]},
+        },
+        {
+            "id": f"in_renewal_{suffix}", "created": now - 10, "status": "paid", "amount_paid": 1000, "currency": "usd",
+            "parent": {"subscription_details": {"subscription": f"sub_renewing_{suffix}"}},
+            "lines": {"data": [{"period": {"start": now, "end": period_end}}]},
+        },
+        {"id": f"in_draft_{suffix}", "created": now, "status": "draft"},
+    ]
+    mock_stripe_client.v1.subscriptions.list_async = AsyncMock(return_value=_FakeListPage(subscriptions))
+    mock_stripe_client.v1.invoices.list_async = AsyncMock(return_value=_FakeListPage(invoices))
+    monkeypatch.setattr(tasks.settings, "stripe_reconcile_batch_size", 2)
+
+    stats = await reconcile_stripe(TestSessionDB)
+
+    assert stats["subscriptions.created"] == 2
+    assert stats["subscriptions.skipped"] == 1
+    assert stats["payments.created"] == 2
+    assert stats["payments.ignored"] == 1
+    assert stats["subscriptions.extended"] == 1
+    mock_stripe_client.v1.subscriptions.list_async.assert_awaited_once_with(
+        {"created": {"gt": 0}, "status": "all", "limit": 100}
+    )
+    async with TestSessionDB() as session:
+        subs = {
+            sub.provider_subscription_id: sub
+            for sub in (await session.execute(select(Subscription).where(Subscription.user_id == user.id))).scalars()
+        }
+        payment = (await session.execute(select(Payment).where(Payment.provider_invoice_id == f"in_{suffix}"))).scalar_one()
+        renewed = await session.get(Subscription, renewing.id)
+        cursors = {cursor.name: cursor.position for cursor in (await session.execute(select(SyncCursor))).scalars()}
+
+    assert subs[f"sub_new_{suffix}"].status == SubscriptionStatus.ACTIVE
+    assert subs[f"sub_new_{suffix}"].plan_id == test_plan.id
+    assert int(subs[f"sub_new_{suffix}"].current_period_end.timestamp()) == period_end
+    assert subs[f"sub_old_{suffix}"].status == SubscriptionStatus.CANCELED
+    assert int(subs[f"sub_old_{suffix}"].current_period_end.timestamp()) == now - 30
+    assert (payment.status, payment.amount_cents, payment.subscription_id) == (
+        PaymentStatus.SUCCEEDED, 1000, subs[f"sub_new_{suffix}"].id
+    )
+    assert int(renewed.current_period_end.timestamp()) == period_end
+    # one second of overlap so objects created in the newest second are listed again
+    assert cursors == {
+        StripeReconciliationService.SUBSCRIPTIONS_CURSOR: now - 1,
+        StripeReconciliationService.INVOICES_CURSOR: now - 1,
+    }
+
+    stats = await reconcile_stripe(TestSessionDB)
+
+    mock_stripe_client.v1.subscriptions.list_async.assert_awaited_with(
+        {"created": {"gt": now - 1}, "status": "all", "limit": 100}
+    )
+    assert "subscriptions.created" not in stats and "subscriptions.updated" not in stats
+    assert stats["subscriptions.unchanged"] == 2
+    assert stats["payments.unchanged"] == 2
+    assert stats["subscriptions.extended"] == 0
+
+
+@pytest.mark.asyncio
+async def test_activating_a_subscription_cancels_the_users_other_active_ones(test_plan):
+    now = datetime.now(timezone.utc)
+    suffix = uuid4().hex[:8]
+    user = User(id=uuid4(), email=f"reactivate-{suffix}@test.com", username=f"reactivate_{suffix}", password="x",
+                is_active=True, is_verified=True, provider=Provider.LOCAL)
+    # lapsed but not swept yet, so invisible to the access lookup
+    lapsed = Subscription(user_id=user.id, plan_id=test_plan.id, status=SubscriptionStatus.ACTIVE,
+                          provider=PaymentProvider.STRIPE, provider_subscription_id=f"sub_lapsed_{suffix}",
+                          current_period_end=now - timedelta(hours=1))
+    past_due = Subscription(user_id=user.id, plan_id=test_plan.id, status=SubscriptionStatus.PAST_DUE,
+                            provider=PaymentProvider.STRIPE, provider_subscription_id=f"sub_past_due_{suffix}",
+                            current_period_end=now - timedelta(days=2))
+    async with TestSessionDB() as session:
+        session.add(user)
+        await session.flush()
+        session.add_all([lapsed, past_due])
+        await session.commit()
+
+    async with TestSessionDB() as session:
+        repo = SubscriptionRepoistory(session)
+        resubscribed = await repo.create_subscription(user.id, test_plan.id, PaymentProvider.STRIPE,
+                                                      f"sub_new_{suffix}", "cus_test", SubscriptionStatus.ACTIVE)
+        # Stripe's retry then pays the old invoice
+        paid = await repo.update_subscription_period(PaymentProvider.STRIPE, f"sub_past_due_{suffix}",
+                                                     now, now + timedelta(days=30))
+
+    async with TestSessionDB() as session:
+        statuses = {
+            sub_id: (await session.get(Subscription, sub_id)).status
+            for sub_id in (lapsed.id, resubscribed.id, paid.id)
+        }
+    assert statuses == {
+        lapsed.id: SubscriptionStatus.CANCELED,
+        resubscribed.id: SubscriptionStatus.CANCELED,
+        paid.id: SubscriptionStatus.ACTIVE,
+    }
+
+
+@pytest.mark.asyncio
+async def test_expire_lapsed_subscriptions_in_chunks(monkeypatch, test_plan):
+    now = datetime.now(timezone.utc)
+    suffix = uuid4().hex[:8]
+    users = [
+        User(id=uuid4(), email=f"expiry-{suffix}-{i}@test.com", username=f"expiry_{suffix}_{i}", password="x",
+             is_active=True, is_verified=True, provider=Provider.LOCAL)
+        for i in range(4)
+    ]
+    subs = [
+        Subscription(user_id=user.id, plan_id=test_plan.id, status=sub_status, provider=PaymentProvider.MANUAL,
+                     current_period_end=now + period_offset)
+        for user, (sub_status, period_offset) in zip(users, [
+            (SubscriptionStatus.ACTIVE, timedelta(days=-1)),
+            (SubscriptionStatus.CANCELED, timedelta(hours=-1)),
+            (SubscriptionStatus.TRIALING, timedelta(minutes=-1)),
+            (SubscriptionStatus.ACTIVE, timedelta(days=1)),
+        ])
+    ]
+    async with TestSessionDB() as session:
+        session.add_all(users)
+        await session.flush()
+        session.add_all(subs)
+        await session.commit()
+
+    invalidate_mock = AsyncMock()
+    monkeypatch.setattr("src.billing.service.invalidate_entitlement", invalidate_mock)
+    monkeypatch.setattr(tasks.settings, "subscription_expiry_batch_size", 1)
+    monkeypatch.setattr(tasks.settings, "subscription_expiry_grace_seconds", 0)
+
+    expired = await expire_lapsed_subscriptions(TestSessionDB)
+
+    async with TestSessionDB() as session:
+        statuses = [(await session.get(Subscription, sub.id)).status for sub in subs]
+    assert statuses == [SubscriptionStatus.EXPIRED] * 3 + [SubscriptionStatus.ACTIVE]
+    assert expired >= 3
+    invalidated = {call.args[0] for call in invalidate_mock.await_args_list}
+    assert {user.id for user in users[:3]} <= invalidated
+    assert users[3].id not in invalidated
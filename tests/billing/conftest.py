@@ -1,4 +1,5 @@
 import pytest
+from collections import defaultdict
 from uuid import uuid4
 from datetime import datetime, timezone, timedelta
 from types import SimpleNamespace
@@ -7,7 +8,7 @@ from sqlalchemy import select, update, delete
 from src.hashing import hash_password
 from tests.conftest import TestSessionDB
 from src.auth.models import User, Provider
-from src.billing.models import Plan, BillingPeriod, Subscription, SubscriptionStatus, PaymentProvider, Payment, PaymentStatus
+from src.billing.models import Plan, BillingPeriod, Subscription, SubscriptionStatus, PaymentProvider, Payment, PaymentStatus, StripeEvent
 
 
 @pytest.fixture(autouse=True)
@@ -29,10 +30,20 @@ def mock_create_checkout(monkeypatch):
 
 
 @pytest.fixture(autouse=True)
-def mock_stripe_product_price(monkeypatch):
-    monkeypatch.setattr("src.billing.stripe_gateway.stripe.Product.update", lambda *args, **kwargs: {"id": "prod_test"})
-    monkeypatch.setattr("src.billing.stripe_gateway.stripe.Price.create", lambda *args, **kwargs: SimpleNamespace(id="price_test_new"))
-    monkeypatch.setattr("src.billing.stripe_gateway.stripe.Price.modify", lambda *args, **kwargs: None)
+def mock_stripe_client(monkeypatch):
+    """Stands in for the async StripeClient so no test reaches the Stripe API."""
+    client = MagicMock()
+    client.v1.products.create_async = AsyncMock(return_value=SimpleNamespace(id="prod_test"))
+    client.v1.products.update_async = AsyncMock(return_value={"id": "prod_test"})
+    client.v1.prices.create_async = AsyncMock(return_value=SimpleNamespace(id="price_test_new"))
+    client.v1.prices.update_async = AsyncMock(return_value=None)
+    client.v1.customers.create_async = AsyncMock(return_value={"id": "cus_test"})
+    client.v1.checkout.sessions.create_async = AsyncMock(return_value=SimpleNamespace(id="cs_test", url="https://stripe.test/checkout"))
+    client.v1.subscriptions.retrieve_async = AsyncMock()
+    client.v1.subscriptions.update_async = AsyncMock()
+    client.v1.subscriptions.cancel_async = AsyncMock()
+    monkeypatch.setattr("src.billing.stripe_gateway.get_stripe_client", lambda: client)
+    return client
 
 
 @pytest.fixture(autouse=True)
@@ -45,36 +56,33 @@ def mock_cancel_at_period_end(monkeypatch):
 
 
 @pytest.fixture(autouse=True)
-def mock_send_subscription_email_task(monkeypatch):
-    """Stub Celery task to avoid hitting a broker and allow assertions."""
-    delay_mock = MagicMock()
-    task_mock = MagicMock(delay=delay_mock)
-    monkeypatch.setattr("src.billing.service.send_subscription_email_task", task_mock)
-    return delay_mock
+def staged_tasks(monkeypatch):
+    """Records what the billing service stages in the task outbox, as one mock per task name."""
+    staged = defaultdict(MagicMock)
+    def _stage(db, task, *args, **kwargs):
+        staged[task.name](*args, **kwargs)
+    def _stage_coalesced(db, task, key, *args):
+        staged[task.name](*args)
+    monkeypatch.setattr("src.billing.service.stage_task", _stage)
+    monkeypatch.setattr("src.billing.service.stage_coalesced_task", _stage_coalesced)
+    return staged
 
 
 @pytest.fixture(autouse=True)
-def mock_send_update_subscription_email_task(monkeypatch):
-    delay_mock = MagicMock()
-    task_mock = MagicMock(delay=delay_mock)
-    monkeypatch.setattr("src.billing.service.send_update_subscription_email_task", task_mock)
-    return delay_mock
+def mock_send_subscription_emails_task(staged_tasks):
+    return staged_tasks["send_subscription_emails_task"]
 
 
 @pytest.fixture(autouse=True)
-def mock_send_cancel_subscription_email_task(monkeypatch):
-    delay_mock = MagicMock()
-    task_mock = MagicMock(delay=delay_mock)
-    monkeypatch.setattr("src.billing.service.send_cancel_subscription_email_task", task_mock)
-    return delay_mock
+def mock_process_stripe_events_task(staged_tasks):
+    return staged_tasks["process_stripe_events_task"]
 
 
-@pytest.fixture(autouse=True)
-def mock_send_payment_failed_email_task(monkeypatch):
-    delay_mock = MagicMock()
-    task_mock = MagicMock(delay=delay_mock)
-    monkeypatch.setattr("src.billing.service.send_payment_failed_email_task", task_mock)
-    return delay_mock
+@pytest.fixture()
+async def clear_stripe_events():
+    async with TestSessionDB() as session:
+        await session.execute(delete(StripeEvent))
+        await session.commit()
 
 
 @pytest.fixture()
@@ -1,3 +1,7 @@
+import ssl
+import json
+import httpx
+import asyncio
 import pytest
 from uuid import uuid4
 from types import SimpleNamespace
@@ -5,15 +9,24 @@ from datetime import datetime, timezone, timedelta
 from fastapi import HTTPException
 from unittest.mock import AsyncMock, Mock, ANY
 
-from src.billing.service import PlanService, SubscriptionService, PaymentService
+from src.billing.service import PlanService, SubscriptionService, PaymentService, StripeEventService
 from src.billing.schemas import PlanCreate, PlanUpdate
-from src.billing.models import BillingPeriod, PaymentProvider
-from src.billing.utils import serialize_subscription
+from src.billing.models import BillingPeriod, PaymentProvider, PlanTier, SubscriptionStatus
+from src.billing.constants import SubscriptionEmail
+from src.billing.utils import stripe_event_ordering_key
+from src.billing.cache import PlanCatalog, EntitlementCache, Entitlement, StripeEventState, StripeSubscriptionCache
+from src.billing.stripe_gateway import StripeGateway
+from src.billing import stripe_client
+from src.billing.repository import PlanRepository, SubscriptionRepoistory
 
 
 pytestmark = pytest.mark.asyncio
 
 
+# the billing conftest replaces this on the class for every test; keep the real one for the gateway tests
+create_checkout_session = StripeGateway.create_subscription_checkout_session
+
+
 def _dummy_request(payload: bytes = b"{}"):
     class DummyRequest:
         def __init__(self, data: bytes):
@@ -385,27 +398,24 @@ async def test_upgrade_subscription_no_active():
     assert exc.value.detail == "No active subscription to upgrade."
 
 
-async def test_stripe_webhook_checkout_creates_subscription(monkeypatch, mock_user_subscribe):
+async def test_handle_stripe_event_checkout_creates_subscription(monkeypatch, mock_user_subscribe):
     event = {
         "type": "checkout.session.completed",
         "data": {"object": {"id": "cs_test", "subscription": "sub_123", "customer": "cus_123"}},
     }
-    run_mock = AsyncMock(return_value=event)
-    monkeypatch.setattr("src.billing.service.run_in_threadpool", run_mock)
 
-    request = _dummy_request(b"{}")
     sub_repo = Mock()
     plan_repo = Mock()
     payment_repo = Mock()
 
     service = SubscriptionService(sub_repo, plan_repo, Mock(), payment_repo)
-    result = await service.stripe_webhook(request, "sig")
+    result = await service.handle_stripe_event(event)
 
     assert result is None
     mock_user_subscribe.assert_awaited_once_with(event["data"]["object"], sub_repo, plan_repo)
 
 
-async def test_stripe_webhook_invoice_payment(monkeypatch, mock_send_update_subscription_email_task):
+async def test_handle_stripe_event_invoice_payment(monkeypatch, mock_send_subscription_emails_task):
     invoice = {
         "lines": {
             "data": [
@@ -418,8 +428,6 @@ async def test_stripe_webhook_invoice_payment(monkeypatch, mock_send_update_subs
         "currency": "usd",
     }
     event = {"type": "invoice.payment_succeeded", "data": {"object": invoice}}
-    run_mock = AsyncMock(return_value=event)
-    monkeypatch.setattr("src.billing.service.run_in_threadpool", run_mock)
 
     updated_sub = SimpleNamespace(
         id=uuid4(),
@@ -440,28 +448,25 @@ async def test_stripe_webhook_invoice_payment(monkeypatch, mock_send_update_subs
         record_payment_mock,
     )
 
-    request = _dummy_request(b"{}")
     sub_repo = Mock()
     payment_repo = Mock()
 
     service = SubscriptionService(sub_repo, Mock(), Mock(), payment_repo)
-    result = await service.stripe_webhook(request, "sig")
+    result = await service.handle_stripe_event(event)
 
     assert result is None
     handle_payment_mock.assert_awaited_once_with(invoice, sub_repo)
-    mock_send_update_subscription_email_task.assert_called_once_with(serialize_subscription(updated_sub))
+    mock_send_subscription_emails_task.assert_called_once_with(str(updated_sub.id), SubscriptionEmail.RENEWED)
     record_payment_mock.assert_awaited_once_with(invoice, updated_sub, payment_repo)
 
 
-async def test_stripe_webhook_invoice_payment_failed(monkeypatch, mock_send_payment_failed_email_task):
+async def test_handle_stripe_event_invoice_payment_failed(monkeypatch, mock_send_subscription_emails_task):
     invoice = {
         "lines": {"data": [{"parent": {"subscription_item_details": {"subscription": "sub_999"}}}]},
         "billing_reason": "subscription_cycle",
         "id": "in_failed",
     }
     event = {"type": "invoice.payment_failed", "data": {"object": invoice}}
-    run_mock = AsyncMock(return_value=event)
-    monkeypatch.setattr("src.billing.service.run_in_threadpool", run_mock)
 
     failed_sub = SimpleNamespace(
         id=uuid4(),
@@ -474,45 +479,39 @@ async def test_stripe_webhook_invoice_payment_failed(monkeypatch, mock_send_paym
     handler = AsyncMock(return_value=failed_sub)
     monkeypatch.setattr("src.billing.service.StripeGateway.handle_invoice_payment_failed", handler)
 
-    request = _dummy_request(b"{}")
     sub_repo = Mock()
 
     service = SubscriptionService(sub_repo, Mock(), Mock(), Mock())
-    result = await service.stripe_webhook(request, "sig")
+    result = await service.handle_stripe_event(event)
 
     assert result is None
     handler.assert_awaited_once_with(invoice, sub_repo)
-    mock_send_payment_failed_email_task.assert_called_once_with(serialize_subscription(failed_sub))
+    mock_send_subscription_emails_task.assert_called_once_with(str(failed_sub.id), SubscriptionEmail.PAYMENT_FAILED)
 
 
-async def test_stripe_webhook_invoice_payment_failed_without_subscription(monkeypatch, mock_send_payment_failed_email_task):
+async def test_handle_stripe_event_invoice_payment_failed_without_subscription(monkeypatch, mock_send_subscription_emails_task):
     invoice = {
         "lines": {"data": [{"parent": {"subscription_item_details": {"subscription": "sub_999"}}}]},
         "billing_reason": "subscription_cycle",
         "id": "in_failed",
     }
     event = {"type": "invoice.payment_failed", "data": {"object": invoice}}
-    run_mock = AsyncMock(return_value=event)
-    monkeypatch.setattr("src.billing.service.run_in_threadpool", run_mock)
 
     handler = AsyncMock(return_value=None)
     monkeypatch.setattr("src.billing.service.StripeGateway.handle_invoice_payment_failed", handler)
 
-    request = _dummy_request(b"{}")
     sub_repo = Mock()
 
     service = SubscriptionService(sub_repo, Mock(), Mock(), Mock())
-    result = await service.stripe_webhook(request, "sig")
+    result = await service.handle_stripe_event(event)
 
     assert result is None
     handler.assert_awaited_once_with(invoice, sub_repo)
-    mock_send_payment_failed_email_task.assert_not_called()
+    mock_send_subscription_emails_task.assert_not_called()
 
 
-async def test_stripe_webhook_subscription_deleted(monkeypatch, mock_send_cancel_subscription_email_task):
+async def test_handle_stripe_event_subscription_deleted(monkeypatch, mock_send_subscription_emails_task):
     event = {"type": "customer.subscription.deleted", "data": {"object": {"id": "sub_123"}}}
-    run_mock = AsyncMock(return_value=event)
-    monkeypatch.setattr("src.billing.service.run_in_threadpool", run_mock)
 
     canceled_sub = SimpleNamespace(
         id=uuid4(),
@@ -525,16 +524,15 @@ async def test_stripe_webhook_subscription_deleted(monkeypatch, mock_send_cancel
     handler = AsyncMock(return_value=canceled_sub)
     monkeypatch.setattr("src.billing.service.StripeGateway.handle_subscription_deleted", handler)
 
-    request = _dummy_request(b"{}")
     sub_repo = Mock()
     payment_repo = Mock()
 
     service = SubscriptionService(sub_repo, Mock(), Mock(), payment_repo)
-    result = await service.stripe_webhook(request, "sig")
+    result = await service.handle_stripe_event(event)
 
     assert result is None
     handler.assert_awaited_once_with(event["data"]["object"], sub_repo)
-    mock_send_cancel_subscription_email_task.assert_called_once_with(serialize_subscription(canceled_sub))
+    mock_send_subscription_emails_task.assert_called_once_with(str(canceled_sub.id), SubscriptionEmail.CANCELED)
 
 
 async def test_stripe_webhook_invalid_signature(monkeypatch):
@@ -543,10 +541,54 @@ async def test_stripe_webhook_invalid_signature(monkeypatch):
     monkeypatch.setattr("src.billing.service.run_in_threadpool", run_mock)
 
     request = _dummy_request(b"{}")
-    service = SubscriptionService(Mock(), Mock(), Mock(), Mock())
-    response = await service.stripe_webhook(request, "sig")
+    event_repo = Mock()
+    event_repo.ingest = AsyncMock()
+    service = StripeEventService(event_repo)
+    response = await service.receive_webhook(request, "sig")
 
     assert response == {"error": "bad signature"}
+    event_repo.ingest.assert_not_awaited()
+
+
+async def test_stripe_webhook_stores_event_and_enqueues_processing(monkeypatch, mock_process_stripe_events_task):
+    event = {"id": "evt_1", "type": "invoice.payment_succeeded", "data": {"object": {"id": "in_1"}}}
+    monkeypatch.setattr("src.billing.service.run_in_threadpool", AsyncMock(return_value=event))
+
+    event_repo = Mock()
+    event_repo.ingest = AsyncMock(return_value=True)
+    service = StripeEventService(event_repo)
+    await service.receive_webhook(_dummy_request(json.dumps(event).encode()), "sig")
+
+    event_repo.ingest.assert_awaited_once_with("evt_1", "invoice.payment_succeeded", event, None)
+    mock_process_stripe_events_task.assert_called_once()
+
+
+async def test_process_event_records_success_and_failure():
+    ok = SimpleNamespace(id=uuid4(), stripe_event_id="evt_ok", event_type="a", ordering_key="sub_1", attempts=1, payload={"type": "a"})
+    bad = SimpleNamespace(id=uuid4(), stripe_event_id="evt_bad", event_type="b", ordering_key="sub_2", attempts=3, payload={"type": "b"})
+    event_repo = Mock()
+    event_repo.db.rollback = AsyncMock()
+    event_repo.mark_processed = AsyncMock()
+    event_repo.mark_failed = AsyncMock()
+
+    subscription_service = Mock()
+    subscription_service.handle_stripe_event = AsyncMock(side_effect=[None, RuntimeError("db down")])
+
+    service = StripeEventService(event_repo)
+    await service.process_event(ok, subscription_service)
+    await service.process_event(bad, subscription_service)
+
+    event_repo.mark_processed.assert_awaited_once_with(ok.id)
+    event_repo.mark_failed.assert_awaited_once_with(bad.id, "RuntimeError('db down')")
+    event_repo.db.rollback.assert_awaited_once()
+
+
+async def test_stripe_event_ordering_key():
+    assert stripe_event_ordering_key({"type": "customer.subscription.deleted", "data": {"object": {"id": "sub_1"}}}) == "sub_1"
+    assert stripe_event_ordering_key({"type": "checkout.session.completed", "data": {"object": {"subscription": "sub_2"}}}) == "sub_2"
+    invoice = {"lines": {"data": [{"parent": {"subscription_item_details": {"subscription": "sub_3"}}}]}}
+    assert stripe_event_ordering_key({"type": "invoice.payment_failed", "data": {"object": invoice}}) == "sub_3"
+    assert stripe_event_ordering_key({"type": "customer.created", "data": {"object": {"id": "cus_1"}}}) is None
 
 
 async def test_payment_service_get_my_payments():
@@ -559,3 +601,350 @@ async def test_payment_service_get_my_payments():
 
     assert result == ["payment1", "payment2"]
     repo.get_my_payments.assert_awaited_once_with(user.id)
+
+
+def _plan_row(code: str, price_cents: int, is_active: bool = True):
+    return SimpleNamespace(
+        id=uuid4(), name=code, code=code, price_cents=price_cents, currency="USD",
+        billing_period=BillingPeriod.MONTHLY, is_active=is_active,
+        stripe_product_id=None, stripe_price_id=None, tier=PlanTier.FREE,
+    )
+
+
+async def test_plan_catalog_indexes_by_id_and_code():
+    catalog = PlanCatalog(ttl_seconds=60)
+    pro, basic, old = _plan_row("pro", 2000), _plan_row("basic", 1000), _plan_row("old", 500, is_active=False)
+    catalog.load([pro, basic, old], catalog.version)
+
+    assert catalog.is_fresh
+    assert catalog.get_by_id(str(pro.id)).code == "pro"
+    assert catalog.get_by_code("basic").id == basic.id
+    assert catalog.get_by_code("old") is None
+    assert [plan.code for plan in catalog.list_plans()] == ["basic", "pro"]
+    assert [plan.code for plan in catalog.list_plans(active_only=False)] == ["old", "basic", "pro"]
+
+
+async def test_plan_catalog_invalidation_during_load_keeps_it_stale():
+    catalog = PlanCatalog(ttl_seconds=60)
+    version = catalog.version
+    catalog.invalidate()
+    catalog.load([_plan_row("pro", 2000)], version)
+
+    assert catalog.is_fresh is False
+
+
+async def test_plan_repository_reads_from_catalog(monkeypatch):
+    catalog = PlanCatalog(ttl_seconds=60)
+    monkeypatch.setattr("src.billing.repository.plan_catalog", catalog)
+    plan = _plan_row("pro", 2000)
+    result = Mock()
+    result.scalars.return_value.all.return_value = [plan]
+    db = Mock()
+    db.execute = AsyncMock(return_value=result)
+
+    repo = PlanRepository(db)
+    assert (await repo.get_by_code("pro")).id == plan.id
+    assert (await repo.get_by_id(plan.id)).code == "pro"
+    assert len(await repo.list_plans()) == 1
+    db.execute.assert_awaited_once()
+
+
+def _entitlement(current_period_end: datetime):
+    return Entitlement(
+        user_id=uuid4(), subscription_id=uuid4(), plan_id=uuid4(), tier=PlanTier.PRO,
+        status=SubscriptionStatus.ACTIVE, current_period_end=current_period_end,
+    )
+
+
+async def test_entitlement_cache_expires_at_period_end():
+    cache = EntitlementCache(negative_ttl_seconds=60, max_entries=10)
+    live = _entitlement(datetime.now(timezone.utc) + timedelta(days=3))
+    ended = _entitlement(datetime.now(timezone.utc) - timedelta(seconds=1))
+    no_sub_user = uuid4()
+    cache.set(live.user_id, live, cache.version)
+    cache.set(ended.user_id, ended, cache.version)
+    cache.set(no_sub_user, None, cache.version)
+
+    assert cache.get(live.user_id) == (True, live)
+    assert cache.get(ended.user_id) == (False, None)
+    assert cache.get(no_sub_user) == (True, None)
+
+    cache.invalidate(str(live.user_id))
+    assert cache.get(live.user_id) == (False, None)
+    assert cache.get(no_sub_user) == (True, None)
+
+
+async def test_subscription_repository_caches_entitlement(monkeypatch):
+    cache = EntitlementCache(negative_ttl_seconds=60, max_entries=10)
+    monkeypatch.setattr("src.billing.repository.entitlement_cache", cache)
+    user_id = uuid4()
+    subscription = SimpleNamespace(
+        id=uuid4(), user_id=user_id, plan_id=uuid4(), status=SubscriptionStatus.ACTIVE,
+        current_period_end=datetime.now(timezone.utc) + timedelta(days=3),
+        plan=SimpleNamespace(tier=PlanTier.VIP),
+    )
+    repo = SubscriptionRepoistory(Mock())
+    repo.get_subscription_with_access = AsyncMock(return_value=subscription)
+
+    first = await repo.get_entitlement(user_id)
+    second = await repo.get_entitlement(user_id)
+
+    assert first == second
+    assert first.tier == PlanTier.VIP
+    repo.get_subscription_with_access.assert_awaited_once_with(user_id)
+
+
+async def test_stripe_webhook_suppresses_known_event_before_storing(monkeypatch, mock_process_stripe_events_task):
+    event = {"id": "evt_dup", "type": "invoice.payment_succeeded", "data": {"object": {}}}
+    monkeypatch.setattr("src.billing.service.run_in_threadpool", AsyncMock(return_value=event))
+    monkeypatch.setattr("src.billing.service.stripe_event_registry.begin", AsyncMock(return_value=StripeEventState.DONE))
+    incr = AsyncMock()
+    monkeypatch.setattr("src.billing.service.metrics.incr", incr)
+
+    event_repo = Mock()
+    event_repo.ingest = AsyncMock()
+    await StripeEventService(event_repo).receive_webhook(_dummy_request(json.dumps(event).encode()), "sig")
+
+    event_repo.ingest.assert_not_awaited()
+    mock_process_stripe_events_task.assert_not_called()
+    incr.assert_awaited_once_with("stripe_events.duplicates_suppressed")
+
+
+async def test_stripe_webhook_rejects_in_flight_delivery(monkeypatch):
+    event = {"id": "evt_busy", "type": "invoice.payment_succeeded", "data": {"object": {}}}
+    monkeypatch.setattr("src.billing.service.run_in_threadpool", AsyncMock(return_value=event))
+    monkeypatch.setattr("src.billing.service.stripe_event_registry.begin", AsyncMock(return_value=StripeEventState.IN_FLIGHT))
+
+    event_repo = Mock()
+    event_repo.ingest = AsyncMock()
+    with pytest.raises(HTTPException) as exc:
+        await StripeEventService(event_repo).receive_webhook(_dummy_request(json.dumps(event).encode()), "sig")
+
+    assert exc.value.status_code == 409
+    event_repo.ingest.assert_not_awaited()
+
+
+def _invoice(period: dict | None = None, metadata: dict | None = None):
+    line = {"parent": {"subscription_item_details": {"subscription": "sub_1"}}}
+    if period is not None:
+        line["period"] = period
+    invoice = {"id": "in_1", "customer": "cus_1", "lines": {"data": [line]}}
+    if metadata is not None:
+        invoice["parent"] = {"subscription_details": {"metadata": metadata}}
+    return invoice
+
+
+async def test_invoice_payment_reads_period_from_payload(monkeypatch, mock_stripe_client):
+    retrieve = mock_stripe_client.v1.subscriptions.retrieve_async
+    incr = AsyncMock()
+    monkeypatch.setattr("src.billing.stripe_gateway.metrics.incr", incr)
+    sub = SimpleNamespace(id=uuid4(), user_id=uuid4())
+    sub_repo = Mock()
+    sub_repo.update_subscription_period = AsyncMock(return_value=sub)
+
+    result = await StripeGateway.handle_invoice_payment_succeeded(_invoice({"start": 1700000000, "end": 1702592000}), sub_repo)
+
+    assert result is sub
+    retrieve.assert_not_awaited()
+    sub_repo.update_subscription_period.assert_awaited_once_with(
+        provider=PaymentProvider.STRIPE,
+        provider_subscription_id="sub_1",
+        current_period_start=datetime.fromtimestamp(1700000000, tz=timezone.utc),
+        current_period_end=datetime.fromtimestamp(1702592000, tz=timezone.utc),
+    )
+    incr.assert_awaited_once_with("stripe.subscription_retrieves_avoided.payload")
+
+
+async def test_invoice_payment_creates_subscription_from_payload_metadata(monkeypatch, mock_stripe_client):
+    retrieve = mock_stripe_client.v1.subscriptions.retrieve_async
+    user_id, plan_id = uuid4(), uuid4()
+    sub_repo = Mock()
+    sub_repo.update_subscription_period = AsyncMock(return_value=None)
+    sub_repo.create_subscription = AsyncMock(return_value=SimpleNamespace(id=uuid4(), user_id=user_id))
+
+    invoice = _invoice({"start": 1700000000, "end": 1702592000}, {"plan_id": str(plan_id), "user_id": str(user_id)})
+    await StripeGateway.handle_invoice_payment_succeeded(invoice, sub_repo)
+
+    retrieve.assert_not_awaited()
+    sub_repo.create_subscription.assert_awaited_once_with(
+        user_id, plan_id, PaymentProvider.STRIPE, "sub_1", "cus_1", SubscriptionStatus.ACTIVE)
+
+
+async def test_invoice_payment_without_period_retrieves_once(monkeypatch, mock_stripe_client):
+    stripe_subscription = {"id": "sub_1", "items": {"data": [{"current_period_start": 1700000000, "current_period_end": 1702592000}]}}
+    retrieve = mock_stripe_client.v1.subscriptions.retrieve_async
+    retrieve.return_value = stripe_subscription
+    sub_repo = Mock()
+    sub_repo.update_subscription_period = AsyncMock(return_value=SimpleNamespace(id=uuid4(), user_id=uuid4()))
+
+    await StripeGateway.handle_invoice_payment_succeeded(_invoice(), sub_repo)
+    await StripeGateway.handle_invoice_payment_succeeded(_invoice(), sub_repo)
+
+    retrieve.assert_awaited_once_with("sub_1")
+
+
+async def test_user_subscribe_reads_plan_from_session_metadata(monkeypatch, mock_stripe_client):
+    retrieve = mock_stripe_client.v1.subscriptions.retrieve_async
+    user_id, plan_id = uuid4(), uuid4()
+    plan_repo = Mock()
+    plan_repo.get_by_id = AsyncMock(return_value=SimpleNamespace(id=plan_id))
+    sub_repo = Mock()
+    sub_repo.get_by_provider_subscription_id = AsyncMock(return_value=SimpleNamespace(id=uuid4(), user_id=user_id))
+
+    session = {"client_reference_id": str(user_id), "subscription": "sub_1", "customer": "cus_1",
+               "metadata": {"plan_id": str(plan_id), "user_id": str(user_id)}}
+    await StripeGateway.user_subscribe(session, sub_repo, plan_repo)
+
+    retrieve.assert_not_awaited()
+    plan_repo.get_by_id.assert_awaited_once_with(str(plan_id))
+
+
+async def test_stripe_subscription_cache_expires():
+    cache = StripeSubscriptionCache(ttl_seconds=0, max_entries=10)
+    cache.set({"id": "sub_1"})
+    assert cache.get("sub_1") is None
+
+    cache = StripeSubscriptionCache(ttl_seconds=60, max_entries=1)
+    cache.set({"id": "sub_1"})
+    cache.set({"id": "sub_2"})
+    assert cache.get("sub_1") is None
+    assert cache.get("sub_2") == {"id": "sub_2"}
+
+
+async def test_stripe_client_is_shared_per_event_loop():
+    await stripe_client.close_stripe_client()
+    client = stripe_client.get_stripe_client()
+    assert stripe_client.get_stripe_client() is client
+
+    await stripe_client.close_stripe_client()
+    assert stripe_client.get_stripe_client() is not client
+    await stripe_client.close_stripe_client()
+
+
+async def test_stripe_pool_left_on_another_loop_is_closed_there(monkeypatch):
+    await stripe_client.close_stripe_client()
+    old_loop = asyncio.new_event_loop()
+    old_pool = Mock(close_async=AsyncMock())
+    monkeypatch.setattr(stripe_client, "_client", Mock())
+    monkeypatch.setattr(stripe_client, "_http_client", old_pool)
+    monkeypatch.setattr(stripe_client, "_client_loop", old_loop)
+
+    stripe_client.get_stripe_client()
+    await asyncio.to_thread(old_loop.run_until_complete, asyncio.sleep(0.01))
+    old_loop.close()
+    old_pool.close_async.assert_awaited_once()
+    await stripe_client.close_stripe_client()
+
+
+async def test_pooled_http_client_keeps_the_tls_and_proxy_options():
+    limits = httpx.Limits(max_connections=3)
+    http_client = stripe_client.PooledHTTPXClient(httpx.Timeout(5), limits, verify_ssl_certs=False,
+                                                 proxy="http://proxy.test:3128")
+    assert http_client._client_async._transport._pool._max_connections == 3
+    assert http_client._client_async._transport._pool._ssl_context.verify_mode == ssl.CERT_NONE
+    assert http_client._proxy == {"http": "http://proxy.test:3128", "https": "http://proxy.test:3128"}
+
+
+async def test_checkout_session_is_reused_until_completed(mock_stripe_client, in_memory_redis):
+    user = SimpleNamespace(id=uuid4(), email="a@test.com", stripe_customer_id="cus_1")
+    plan = SimpleNamespace(id=uuid4(), code="pro", name="Pro", stripe_price_id="price_1")
+    expires_at = int(datetime.now(timezone.utc).timestamp()) + 3600
+    create = mock_stripe_client.v1.checkout.sessions.create_async
+    create.return_value = SimpleNamespace(url="https://stripe.test/cs_1", get={"id": "cs_1", "expires_at": expires_at}.get)
+
+    first = await create_checkout_session(user, plan, Mock())
+    second = await create_checkout_session(user, plan, Mock())
+    assert first == second == "https://stripe.test/cs_1"
+    create.assert_awaited_once()
+
+    await create_checkout_session(user, plan, Mock(), "sub_old")
+    assert create.await_count == 2
+
+    plan_repo = Mock()
+    plan_repo.get_by_id = AsyncMock(return_value=plan)
+    sub_repo = Mock()
+    sub_repo.get_by_provider_subscription_id = AsyncMock(return_value=SimpleNamespace(id=uuid4(), user_id=user.id))
+    session = {"client_reference_id": str(user.id), "subscription": "sub_1", "customer": "cus_1",
+               "metadata": {"plan_id": str(plan.id), "user_id": str(user.id)}}
+    await StripeGateway.user_subscribe(session, sub_repo, plan_repo)
+
+    await create_checkout_session(user, plan, Mock())
+    assert create.await_count == 3
+
+
+class _ScriptedRedis:
+    """Replays the waits the token-bucket script would return and records how it was called."""
+    def __init__(self, waits: list[int]) -> None:
+        self.waits = waits
+        self.calls: list[dict] = []
+        self.values: dict[str, tuple[str, int | None]] = {}
+
+    def register_script(self, script):
+        async def _run(keys, args):
+            self.calls.append({"keys": keys, "args": args})
+            return self.waits.pop(0)
+        return _run
+
+    async def set(self, key, value, px=None):
+        self.values[key] = (value, px)
+
+
+async def test_rate_governor_waits_and_records_throttling(monkeypatch):
+    redis = _ScriptedRedis([20, 0])
+    monkeypatch.setattr("src.billing.stripe_client.get_redis", lambda: redis)
+    incr = AsyncMock()
+    monkeypatch.setattr("src.billing.stripe_client.metrics.incr", incr)
+    governor = stripe_client.StripeRateGovernor(rate_per_second=10, burst=10, interactive_reserve=3,
+                                                max_wait_seconds=5, default_cooldown_seconds=1)
+
+    await governor.acquire(stripe_client.StripePriority.BACKGROUND)
+
+    assert [call["args"] for call in redis.calls] == [[10, 10, 3], [10, 10, 3]]
+    incr.assert_any_await("stripe.throttled_requests.background")
+    assert incr.await_args_list[-1].args[0] == "stripe.throttled_wait_ms.background"
+
+
+async def test_rate_governor_interactive_calls_skip_the_reserve(monkeypatch):
+    redis = _ScriptedRedis([0])
+    monkeypatch.setattr("src.billing.stripe_client.get_redis", lambda: redis)
+    incr = AsyncMock()
+    monkeypatch.setattr("src.billing.stripe_client.metrics.incr", incr)
+    governor = stripe_client.StripeRateGovernor(rate_per_second=10, burst=10, interactive_reserve=3,
+                                                max_wait_seconds=5, default_cooldown_seconds=1)
+
+    await governor.acquire(stripe_client.StripePriority.INTERACTIVE)
+
+    assert redis.calls[0]["args"] == [10, 10, 0]
+    incr.assert_not_awaited()
+
+
+async def test_rate_governor_fails_open_without_redis(monkeypatch):
+    def _broken():
+        raise ConnectionError("redis down")
+    monkeypatch.setattr("src.billing.stripe_client.get_redis", _broken)
+    governor = stripe_client.StripeRateGovernor(rate_per_second=10, burst=10, interactive_reserve=3,
+                                                max_wait_seconds=5, default_cooldown_seconds=1)
+
+    await governor.acquire(stripe_client.StripePriority.INTERACTIVE)
+
+
+async def test_stripe_http_client_shares_429_cooldown_and_retries(monkeypatch):
+    redis = _ScriptedRedis([0])
+    monkeypatch.setattr("src.billing.stripe_client.get_redis", lambda: redis)
+    monkeypatch.setattr("src.billing.stripe_client.metrics.incr", AsyncMock())
+    response = (b"{}", 429, httpx.Headers({"Retry-After": "2"}))
+    monkeypatch.setattr("stripe.HTTPXClient.request_async", AsyncMock(return_value=response))
+
+    http_client = stripe_client.PooledHTTPXClient(timeout=httpx.Timeout(1), limits=httpx.Limits())
+    assert await http_client.request_async("post", "https://api.stripe.com/v1/customers", {}) == response
+
+    assert redis.values[stripe_client.StripeRateGovernor.COOLDOWN_KEY] == ("1", 2000)
+    assert http_client._should_retry(response, None, 0, 2) is True
+    assert http_client._should_retry(response, None, 2, 2) is False
+
+
+async def test_background_stripe_calls_sets_priority():
+    assert stripe_client.stripe_priority.get() == stripe_client.StripePriority.INTERACTIVE
+    with stripe_client.background_stripe_calls():
+        assert stripe_client.stripe_priority.get() == stripe_client.StripePriority.BACKGROUND
+    assert stripe_client.stripe_priority.get() == stripe_client.StripePriority.INTERACTIVE
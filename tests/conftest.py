@@ -7,6 +7,7 @@ from sqlalchemy.orm import sessionmaker
 from src.database import get_db
 from src.main import app 
 from src.config import settings
+from src.billing.cache import plan_catalog, entitlement_cache, stripe_event_registry, stripe_subscription_cache
 
 # DB setup
 test_engine = create_async_engine(settings.test_database_url, poolclass=NullPool)
@@ -22,6 +23,20 @@ async def init_db():
         await conn.run_sync(Base.metadata.drop_all)
     await test_engine.dispose()
 
+@pytest.fixture(autouse=True)
+def reset_process_caches():
+    # fixtures write straight to the DB, bypassing the cache invalidations
+    plan_catalog.invalidate()
+    entitlement_cache.invalidate()
+    stripe_event_registry.clear()
+    stripe_subscription_cache.invalidate()
+    yield
+    plan_catalog.invalidate()
+    entitlement_cache.invalidate()
+    stripe_event_registry.clear()
+    stripe_subscription_cache.invalidate()
+
+
 @pytest.fixture()
 async def override_dependencies():
     async def _get_test_db():
@@ -54,3 +69,32 @@ async def client(db_session):
 
 
 
+
+
+class InMemoryRedis:
+    """The handful of string commands the idempotency and checkout caches use (CI has no Redis)."""
+    def __init__(self) -> None:
+        self.values: dict[str, str] = {}
+
+
+    async def set(self, key, value, nx=False, ex=None):
+        if nx and key in self.values:
+            return None
+        self.values[key] = value
+        return True
+
+
+    async def get(self, key):
+        return self.values.get(key)
+
+
+    async def delete(self, key):
+        return int(self.values.pop(key, None) is not None)
+
+
+@pytest.fixture()
+def in_memory_redis(monkeypatch):
+    redis = InMemoryRedis()
+    monkeypatch.setattr("src.idempotency.get_redis", lambda: redis)
+    monkeypatch.setattr("src.billing.cache.get_redis", lambda: redis)
+    return redis
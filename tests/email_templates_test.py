@@ -0,0 +1,34 @@
+import pytest
+from src import email_templates
+from src.email_templates import EmailTemplates, TEMPLATE_FOLDER, static_context
+
+
+CONTEXT = {
+    "plan": "Pro", "price": 10, "start_date": "2026-01-01", "end_date": "N/A", "next_billing_date": "N/A",
+    "email_type": "Renewed", "user_name": "someone", "verification_url": "https://app.test/verify?token=t",
+    "reset_url": "https://app.test/reset?token=t", "otp_code": "123456",
+    "changes": [{"title": "Subscription started", "plan": "Pro", "price": 10, "start_date": "2026-01-01", "end_date": "N/A"}],
+}
+
+# templates with control flow, rendered by Jinja itself
+JINJA_ONLY = {"subscription_summary.html"}
+
+
+@pytest.fixture()
+def registry():
+    return EmailTemplates(TEMPLATE_FOLDER)
+
+
+def test_registry_renders_like_jinja(registry):
+    for name, (template, segments) in registry._templates.items():
+        assert (segments is None) == (name in JINJA_ONLY), name
+        assert registry.render(name, CONTEXT) == template.render(**static_context(), **CONTEXT), name
+
+
+def test_registry_overrides_and_refreshes_shared_context(registry, monkeypatch):
+    assert "Other App" in registry.render("otp.html", {**CONTEXT, "app_name": "Other App"})
+
+    compiled = registry.get("otp.html")
+    monkeypatch.setattr(email_templates, "static_context", lambda: {**compiled.shared, "year": 2999})
+    assert registry.get("otp.html") is not compiled
+    assert "2999" in registry.render("otp.html", CONTEXT)
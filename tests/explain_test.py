@@ -0,0 +1,83 @@
+import pytest
+from uuid import uuid4
+from unittest.mock import AsyncMock, MagicMock
+from sqlalchemy import text
+from sqlalchemy.dialects import postgresql
+from tests.conftest import TestSessionDB
+from src.auth.repository import UserRepository, LoginCodeRepository
+from src.repository import RefreshTokenRepository
+from src.billing.models import PaymentProvider
+from src.billing.repository import SubscriptionRepoistory, PaymentRepository
+from src.admin.repository import AdminUserRepository, AdminSubscriptionRepository, AdminPaymentRepository
+
+
+pytestmark = pytest.mark.asyncio
+
+
+def _recording_session():
+    """Stands in for AsyncSession and keeps every statement a repository executes."""
+    statements = []
+
+    async def _execute(statement, *args, **kwargs):
+        statements.append(statement)
+        result = MagicMock()
+        result.scalar_one.return_value = 0
+        result.scalar_one_or_none.return_value = None
+        result.scalars.return_value.all.return_value = []
+        return result
+
+    db = MagicMock()
+    db.execute = AsyncMock(side_effect=_execute)
+    db.commit = AsyncMock()
+    return db, statements
+
+
+async def _explain(statement) -> str:
+    """
+    EXPLAIN (without ANALYZE) against the test schema, which create_all builds with the models' indexes
+    and which holds next to no rows. Rather than seeding enough rows for the planner to prefer an index,
+    seq scans and sorts are priced out, so the plan only shows one when no usable index exists.
+    """
+    sql = str(statement.compile(dialect=postgresql.dialect(), compile_kwargs={"literal_binds": True}))
+    async with TestSessionDB() as session:
+        async with session.begin():
+            await session.execute(text("SET LOCAL enable_seqscan = off"))
+            await session.execute(text("SET LOCAL enable_sort = off"))
+            rows = (await session.execute(text(f"EXPLAIN {sql}"))).scalars().all()
+    return "\n".join(rows)
+
+
+# name -> (repository call, whether it reads an ordered page that must come straight off an index)
+REPOSITORY_CALLS = {
+    "user_by_id": (lambda db: UserRepository(db).get_by_id(uuid4()), False),
+    "user_by_email": (lambda db: UserRepository(db).get_by_email("a@test.com"), False),
+    "user_by_username": (lambda db: UserRepository(db).get_by_username("a"), False),
+    "login_code_latest": (lambda db: LoginCodeRepository(db).get_latest_for_user(uuid4()), True),
+    "login_code_delete": (lambda db: LoginCodeRepository(db).delete(uuid4()), False),
+    "refresh_token_by_jti": (lambda db: RefreshTokenRepository(db).get_by_jti("jti"), False),
+    "refresh_token_revoke_all": (lambda db: RefreshTokenRepository(db).revoke_all_for_user(uuid4()), False),
+    "subscription_with_access": (lambda db: SubscriptionRepoistory(db).get_subscription_with_access(uuid4()), True),
+    "subscription_by_provider_id": (lambda db: SubscriptionRepoistory(db).get_by_provider_subscription_id(
+        PaymentProvider.STRIPE, "sub_test"), False),
+    "subscriptions_for_user": (lambda db: SubscriptionRepoistory(db).list_for_user(uuid4()), False),
+    "payments_me": (lambda db: PaymentRepository(db).get_my_payments(uuid4()), False),
+    "admin_users": (lambda db: AdminUserRepository(db).list_users(), True),
+    "admin_user_subscriptions": (lambda db: AdminUserRepository(db).get_user_subscriptions(uuid4()), True),
+    "admin_user_transactions": (lambda db: AdminUserRepository(db).get_user_transactions(uuid4()), True),
+    "admin_subscriptions": (lambda db: AdminSubscriptionRepository(db).list_subscriptions(), True),
+    "admin_payments": (lambda db: AdminPaymentRepository(db).list_payments(), True),
+}
+
+
+@pytest.mark.parametrize("name", REPOSITORY_CALLS)
+async def test_repository_queries_use_indexes(name, init_db):
+    call, expect_ordered = REPOSITORY_CALLS[name]
+    db, statements = _recording_session()
+    await call(db)
+    assert statements
+
+    for statement in statements:
+        plan = await _explain(statement)
+        assert "Seq Scan" not in plan, f"{name} falls back to a sequential scan:\n{plan}"
+        if expect_ordered:
+            assert "Sort" not in plan, f"{name} sorts instead of reading an index in order:\n{plan}"
@@ -0,0 +1,98 @@
+import asyncio
+import pytest
+import aiosmtplib
+from email.message import EmailMessage
+from types import SimpleNamespace
+from unittest.mock import AsyncMock
+from fastapi_mail import MessageSchema, MessageType
+from src import mailer
+from src.mailer import SMTPPool
+from src.utils import conf
+from src.worker import run_async
+
+
+class _FakeSMTP:
+    """Records connections; `drop_next` makes the next send fail like a connection the server closed."""
+    connections: list["_FakeSMTP"] = []
+
+    def __init__(self, **kwargs):
+        self.is_connected = False
+        self.sent = 0
+        self.drop_next = False
+        _FakeSMTP.connections.append(self)
+
+    async def connect(self):
+        self.is_connected = True
+
+    async def login(self, username, password):
+        pass
+
+    async def send_message(self, message):
+        if self.drop_next:
+            self.is_connected = False
+            raise aiosmtplib.SMTPServerDisconnected("Connection lost")
+        self.sent += 1
+
+    async def quit(self):
+        self.is_connected = False
+
+    def close(self):
+        self.is_connected = False
+
+
+@pytest.fixture()
+def fake_smtp(monkeypatch):
+    _FakeSMTP.connections = []
+    monkeypatch.setattr(mailer.aiosmtplib, "SMTP", _FakeSMTP)
+    return _FakeSMTP
+
+
+@pytest.mark.asyncio
+async def test_pool_reuses_connection_and_reconnects_when_dropped(fake_smtp):
+    pool = SMTPPool(conf, size=2, idle_timeout_seconds=60)
+
+    await pool.send(EmailMessage())
+    await pool.send(EmailMessage())
+    assert len(fake_smtp.connections) == 1
+    assert fake_smtp.connections[0].sent == 2
+
+    fake_smtp.connections[0].drop_next = True
+    await pool.send(EmailMessage())
+    assert len(fake_smtp.connections) == 2
+    assert fake_smtp.connections[1].sent == 1
+
+    await pool.close()
+    assert not any(smtp.is_connected for smtp in fake_smtp.connections)
+
+
+@pytest.mark.asyncio
+async def test_pool_replaces_idle_connection(fake_smtp):
+    pool = SMTPPool(conf, size=1, idle_timeout_seconds=0)
+
+    await pool.send(EmailMessage())
+    await pool.send(EmailMessage())
+
+    assert [smtp.sent for smtp in fake_smtp.connections] == [1, 1]
+    assert not fake_smtp.connections[0].is_connected
+
+
+def test_run_async_keeps_one_loop_per_process():
+    async def _current_loop():
+        return asyncio.get_running_loop()
+
+    assert run_async(_current_loop()) is run_async(_current_loop())
+
+
+@pytest.mark.asyncio
+async def test_mailer_builds_the_message_and_sends_it_over_the_pool():
+    pool = SimpleNamespace(send=AsyncMock())
+    message = MessageSchema(subject="Welcome", recipients=["user@example.com"], body="Hello there",
+                            subtype=MessageType.plain, from_name="Billing")
+
+    await mailer.Mailer(conf, pool).send_message(message)
+
+    sent = pool.send.await_args.args[0]
+    assert sent["From"] == f"Billing <{conf.MAIL_FROM}>"
+    assert "user@example.com" in sent["To"]
+    assert sent["Subject"] == "Welcome"
+    assert sent.get_payload()[0].get_payload(decode=True) == b"Hello there"
@@ -0,0 +1,111 @@
+import pytest
+from contextlib import contextmanager
+from types import SimpleNamespace
+from unittest.mock import MagicMock
+from sqlalchemy import delete, func, select, update
+from src import outbox
+from src.billing.tasks import send_subscription_emails_task, process_stripe_events_task, provision_stripe_customer_task
+from src.models import TaskOutbox
+from src.outbox import stage_task, stage_coalesced_task, relay_outbox
+from tests.conftest import TestSessionDB
+
+
+@pytest.fixture()
+async def empty_outbox():
+    async with TestSessionDB() as session:
+        await session.execute(delete(TaskOutbox))
+        await session.commit()
+
+
+@pytest.fixture()
+def broker(monkeypatch):
+    """Stands in for the broker: records what the relay publishes, over how many connections."""
+    send_task = MagicMock()
+    connections = []
+
+    @contextmanager
+    def _producer_or_acquire(producer=None):
+        connections.append(object())
+        yield connections[-1]
+
+    monkeypatch.setattr(outbox.celery_app, "send_task", send_task)
+    monkeypatch.setattr(outbox.celery_app, "producer_or_acquire", _producer_or_acquire)
+    return SimpleNamespace(send_task=send_task, connections=connections)
+
+
+@pytest.mark.asyncio
+async def test_relay_publishes_committed_tasks_once_in_batches(monkeypatch, empty_outbox, broker):
+    monkeypatch.setattr(outbox.settings, "task_outbox_batch_size", 3)
+    async with TestSessionDB() as session:
+        stage_task(session, send_subscription_emails_task, "sub-rolled-back", "created")
+        await session.rollback()
+        stage_task(session, send_subscription_emails_task, "sub-0", "created")
+        stage_task(session, process_stripe_events_task)
+        stage_task(session, send_subscription_emails_task, "sub-1", "renewed")
+        stage_task(session, send_subscription_emails_task, "sub-2", "canceled")
+        stage_task(session, process_stripe_events_task)
+        await session.commit()
+
+    assert await relay_outbox(TestSessionDB) == 5
+    assert await relay_outbox(TestSessionDB) == 0
+
+    # rows of a batched task share one message per relay batch
+    published = [(call.args[0], call.kwargs["args"]) for call in broker.send_task.call_args_list]
+    assert published == [
+        ("send_subscription_emails_task", [[["sub-0", "created"], ["sub-1", "renewed"]]]),
+        ("process_stripe_events_task", []),
+        ("send_subscription_emails_task", [[["sub-2", "canceled"]]]),
+        ("process_stripe_events_task", []),
+    ]
+    assert len(broker.connections) == 2
+    async with TestSessionDB() as session:
+        rows = (await session.execute(select(TaskOutbox))).scalars().all()
+    assert all(row.sent_at is not None for row in rows)
+
+
+@pytest.mark.asyncio
+async def test_relay_keeps_unpublished_tasks_when_broker_fails(empty_outbox, broker):
+    async with TestSessionDB() as session:
+        for i in range(3):
+            stage_task(session, provision_stripe_customer_task, f"user-{i}")
+        await session.commit()
+    broker.send_task.side_effect = [None, ConnectionError("broker down")]
+
+    assert await relay_outbox(TestSessionDB) == 1
+
+    async with TestSessionDB() as session:
+        rows = (await session.execute(select(TaskOutbox).order_by(TaskOutbox.id))).scalars().all()
+    assert [row.sent_at is not None for row in rows] == [True, False, False]
+    assert [row.attempts for row in rows] == [0, 1, 0]
+    assert "broker down" in rows[1].last_error
+
+    broker.send_task.side_effect = None
+    assert await relay_outbox(TestSessionDB) == 2
+
+
+@pytest.mark.asyncio
+async def test_relay_holds_coalesced_tasks_for_their_window(monkeypatch, empty_outbox, broker):
+    monkeypatch.setattr(send_subscription_emails_task, "outbox_coalesce_seconds", 60)
+    async with TestSessionDB() as session:
+        stage_coalesced_task(session, send_subscription_emails_task, "user-1", "sub-old", "canceled")
+        stage_coalesced_task(session, send_subscription_emails_task, "user-2", "sub-other", "renewed")
+        stage_task(session, process_stripe_events_task)
+        await session.commit()
+
+    assert await relay_outbox(TestSessionDB) == 1
+
+    async with TestSessionDB() as session:
+        stage_coalesced_task(session, send_subscription_emails_task, "user-1", "sub-new", "created")
+        # the first row of user-1 comes due: the later one goes out with it
+        await session.execute(
+            update(TaskOutbox).where(TaskOutbox.args == ["sub-old", "canceled"]).values(available_at=func.now())
+        )
+        await session.commit()
+
+    assert await relay_outbox(TestSessionDB) == 2
+    published = [(call.args[0], call.kwargs["args"]) for call in broker.send_task.call_args_list]
+    assert published == [
+        ("process_stripe_events_task", []),
+        ("send_subscription_emails_task", [[["sub-old", "canceled"], ["sub-new", "created"]]]),
+    ]
+
@@ -0,0 +1,42 @@
+from types import SimpleNamespace
+from unittest.mock import AsyncMock
+from src import database, worker
+from src.worker import run_async, init_worker_process
+
+
+def test_worker_process_gets_its_own_pooled_engine(monkeypatch):
+    monkeypatch.setattr(database.settings, "worker_db_max_connections", 20)
+    monkeypatch.setattr(database.settings, "worker_db_pool_size", 2)
+    monkeypatch.setattr(database, "worker_engine", database.worker_engine)
+    inherited = database.worker_engine
+    assert database.worker_pool_limits(4) == (2, 3)
+    assert database.worker_pool_limits(40) == (1, 0)
+
+    init_worker_process()
+    try:
+        assert database.worker_engine is not inherited
+        assert database.worker_engine.pool.size() == 2
+        assert database.worker_async_session.kw["bind"] is database.worker_engine
+    finally:
+        run_async(database.dispose_worker_engine())
+        database.worker_async_session.configure(bind=inherited)
+
+
+def test_task_signals_record_wait_runtime_and_outcome(monkeypatch):
+    incr_many = AsyncMock()
+    monkeypatch.setattr(worker.metrics, "incr_many", incr_many)
+    headers = {}
+    worker.stamp_enqueue_time(headers=headers)
+    headers["enqueued_at"] -= 2
+    request = SimpleNamespace(enqueued_at=headers["enqueued_at"], eta=None, delivery_info={"routing_key": "emails_priority"})
+    task = SimpleNamespace(name="send_login_code_task", request=request)
+
+    worker.start_task_timer("task-1", task)
+    worker.record_task_metrics("task-1", task, state="RETRY")
+
+    counts = incr_many.await_args.args[0]
+    prefix = "tasks.emails_priority.send_login_code_task"
+    assert counts[f"{prefix}.runs"] == 1
+    assert counts[f"{prefix}.retry"] == 1
+    assert 2000 <= counts[f"{prefix}.wait_ms"] < 3000
+    assert counts[f"{prefix}.runtime_ms"] >= 0